@@ -0,0 +1,209 @@
+# _________________________________________
+#/ Needle ballistics for the moving coil   \
+#| meter. Rather than jumping the DAC      |
+#| straight to each new reading, the       |
+#| needle is moved there a little at a     |
+#| time from a fast timer, with its speed  |
+#| limited and its swing damped, so it     |
+#| doesn't slam across the scale and ring  |
+#\ on every range change.                  /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# The needle is modelled as a damped spring: each step it accelerates
+# towards the target in proportion to how far off it is, less a drag in
+# proportion to its speed.  Both are powers of two so the step is just
+# shifts and adds on integers, which is what lets it run from a hard timer
+# interrupt.  Positions are tenths of a percent of full scale (as in
+# drivemeter.py) with POS_FRAC_BITS of fraction.
+#
+# The settings come from the 'ballistics' part of the calibration file:
+#   enabled    - false to drive the needle straight to each reading
+#   rate_hz    - steps per second
+#   slew       - fastest the needle may move, tenths of a percent per second
+#   range_slew - the same while it's moving to a new range, so that a range
+#                change doesn't whip it from full scale to near zero
+#   stiffness  - the spring is 1/2**stiffness of the error per step
+#   damping    - the drag is 1/2**damping of the speed per step
+# damping = stiffness / 2 - 1 is about critically damped, smaller numbers
+# damp harder, bigger ones let the needle overshoot.
+
+RATE_MAX_HZ = 5000
+STIFFNESS_MAX = 12
+DEFAULT_SETTINGS = {'enabled': True, 'rate_hz': 1000, 'slew': 2000,
+                    'range_slew': 800, 'stiffness': 6, 'damping': 2}
+
+POS_FRAC_BITS = 8
+POS_ROUND = 1 << (POS_FRAC_BITS - 1)
+# close enough to count as having arrived after a range change.
+SETTLED = 2 << POS_FRAC_BITS
+
+pos = 0
+vel = 0
+target = 0
+driven = -1
+gliding = False
+slewStep = 0
+rangeSlewStep = 0
+stiffness = 6
+damping = 2
+drive = None
+top = 0
+
+
+############ checkSettings ############
+#         _               _     _____      _   _   _
+#        | |             | |   / ____|    | | | | (_)
+#     ___| |__   ___  ___| | _| (___   ___| |_| |_ _ _ __   __ _ ___
+#    / __| '_ \ / _ \/ __| |/ /\___ \ / _ \ __| __| | '_ \ / _` / __|
+#   | (__| | | |  __/ (__|   < ____) |  __/ |_| |_| | | | | (_| \__ \
+#    \___|_| |_|\___|\___|_|\_\_____/ \___|\__|\__|_|_| |_|\__, |___/
+#                                                           __/ |
+#                                                          |___/
+# Raise ValueError saying what is wrong if settings aren't usable.
+#
+def checkSettings(settings):
+    if not 100 <= settings['rate_hz'] <= RATE_MAX_HZ:
+        raise ValueError("ballistics rate_hz must be 100 to %d" % RATE_MAX_HZ)
+    for key in ('slew', 'range_slew'):
+        if not 0 < settings[key] <= 100000:
+            raise ValueError("ballistics %s must be 1 to 100000" % key)
+    if not 1 <= settings['stiffness'] <= STIFFNESS_MAX:
+        raise ValueError("ballistics stiffness must be 1 to %d" % STIFFNESS_MAX)
+    if not 0 <= settings['damping'] <= settings['stiffness']:
+        raise ValueError("ballistics damping must be 0 to the stiffness")
+
+
+############ configure ############
+#                     __ _
+#                    / _(_)
+#     ___ ___  _ __ | |_ _  __ _ _   _ _ __ ___
+#    / __/ _ \| '_ \|  _| |/ _` | | | | '__/ _ \
+#   | (_| (_) | | | | | | | (_| | |_| | | |  __/
+#    \___\___/|_| |_|_| |_|\__, |\__,_|_|  \___|
+#                           __/ |
+#                          |___/
+# Take the settings from the calibration's ballistics entry.  driveFn is
+# called with the needle position in tenths of a percent whenever it moves,
+# never more than topPerMille.
+#
+def configure(settings, driveFn, topPerMille):
+    global slewStep
+    global rangeSlewStep
+    global stiffness
+    global damping
+    global drive
+    global top
+
+    rate = settings['rate_hz']
+    slewStep = max((settings['slew'] << POS_FRAC_BITS) // rate, 1)
+    rangeSlewStep = max((settings['range_slew'] << POS_FRAC_BITS) // rate, 1)
+    stiffness = settings['stiffness']
+    damping = settings['damping']
+    drive = driveFn
+    top = topPerMille << POS_FRAC_BITS
+
+
+############ place ############
+#          _
+#         | |
+#    _ __ | | __ _  ___ ___
+#   | '_ \| |/ _` |/ __/ _ \
+#   | |_) | | (_| | (_|  __/
+#   | .__/|_|\__,_|\___\___|
+#   | |
+#   |_|
+# Put the needle at perMille, standing still, without driving it there.
+#
+def place(perMille):
+    global pos
+    global vel
+    global target
+    global driven
+    global gliding
+
+    pos = target = perMille << POS_FRAC_BITS
+    vel = 0
+    driven = perMille
+    gliding = False
+
+
+############ moveTo ############
+#                          _______
+#                         |__   __|
+#    _ __ ___   _____   _____| | ___
+#   | '_ ` _ \ / _ \ \ / / _ \ |/ _ \
+#   | | | | | | (_) \ V /  __/ | (_) |
+#   |_| |_| |_|\___/ \_/ \___|_|\___/
+#
+#
+# Set where the needle is heading, in tenths of a percent of full scale.
+#
+def moveTo(perMille):
+    global target
+    target = perMille << POS_FRAC_BITS
+
+
+############ rangeChange ############
+#                                _____ _
+#                               / ____| |
+#    _ __ __ _ _ __   __ _  ___| |    | |__   __ _ _ __   __ _  ___
+#   | '__/ _` | '_ \ / _` |/ _ \ |    | '_ \ / _` | '_ \ / _` |/ _ \
+#   | | | (_| | | | | (_| |  __/ |____| | | | (_| | | | | (_| |  __/
+#   |_|  \__,_|_| |_|\__, |\___|\_____|_| |_|\__,_|_| |_|\__, |\___|
+#                     __/ |                               __/ |
+#                    |___/                               |___/
+# The range has changed, so glide over to the new reading at range_slew.
+#
+def rangeChange():
+    global gliding
+    gliding = True
+
+
+############ step ############
+#        _
+#       | |
+#    ___| |_ ___ _ __
+#   / __| __/ _ \ '_ \
+#   \__ \ ||  __/ |_) |
+#   |___/\__\___| .__/
+#               | |
+#               |_|
+# Move the needle on one step.  Called from a hard timer interrupt so it
+# mustn't allocate: all the numbers stay small ints.
+#
+def step(timer=None):
+    global pos
+    global vel
+    global driven
+    global gliding
+
+    err = target - pos
+    vel += (err >> stiffness) - (vel >> damping)
+    if gliding:
+        limit = rangeSlewStep
+        if -SETTLED < err < SETTLED:
+            gliding = False
+    else:
+        limit = slewStep
+    if vel > limit:
+        vel = limit
+    elif vel < -limit:
+        vel = -limit
+    pos += vel
+    # an overshoot stops at the ends of the scale, as the real needle would.
+    if pos > top:
+        pos = top
+        vel = 0
+    elif pos < 0:
+        pos = 0
+        vel = 0
+    perMille = (pos + POS_ROUND) >> POS_FRAC_BITS
+    if perMille != driven:
+        driven = perMille
+        drive(perMille)
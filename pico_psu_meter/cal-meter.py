@@ -7,7 +7,9 @@
 #| useable values then writes these to the |
 #| DAC so that the settings for each       |
 #| graticule position can be easily        |
-#| obtained.                               |
+#| obtained and saved for drivemeter.py.   |
+#| guidedCal() does the whole meter in one |
+#| sweep of the DAC.                       |
 #\                                         /
 # -----------------------------------------
 #        \   ^__^
@@ -19,84 +21,26 @@
 
 
 #initialisation
-import array
-import machine
+import sys
 import utime
 from machine import Pin, Timer
+try:
+    import select
+except ImportError:
+    import uselect as select
+import calstore
+from metercore import *
 
-# set gpio23 high for continuous PWM SMPS operation.
-modeSmps = Pin(23, Pin.OUT)
-modeSmps.value(1)
-
-# An 8-bit R2R ladder DAC is used to drive the meter via a
-# single transistor V->I converter 
-# Range of meter is 0 to 1mA
-bit0 = Pin(0, Pin.OUT)
-bit1 = Pin(1, Pin.OUT)
-bit2 = Pin(2, Pin.OUT)
-bit3 = Pin(3, Pin.OUT)
-bit4 = Pin(4, Pin.OUT)
-bit5 = Pin(5, Pin.OUT)
-bit6 = Pin(6, Pin.OUT)
-bit7 = Pin(7, Pin.OUT)
-
-led = Pin(25, Pin.OUT)
-
-
-# ADC Channels
-#=============
-# direct reading of output voltage
-opVoltRdg = machine.ADC(0)
-# current is read as a voltage across a 0.3 ohm resistor
-opCurrRdg = machine.ADC(1)
-# 0v output is measured to offset various physical effects
-op0vRdg = machine.ADC(2)
-
-# meter range indication leds
-pin100m = Pin(10,  Pin.OUT)
-pin250m = Pin(11,  Pin.OUT)
-pin500m = Pin(12, Pin.OUT)
-pin1v   = Pin(13, Pin.OUT)
-pin2v5  = Pin(14, Pin.OUT)
-pin5v   = Pin(15, Pin.OUT)
-pin10v  = Pin(16, Pin.OUT)
-
-
-pin25v  = Pin(17, Pin.OUT)
-pin50v  = Pin(18, Pin.OUT)
-
-# GPIO Pin 21 is used to detect current limit mode.
-# Input = 0 when current limit is active. 
-pinILim = Pin(21, Pin.IN)
-# GPIO Pin 20 drives the red front panel Imode LED to mirror the control board LED.
-PinIlimFlag = Pin(20, Pin.OUT)
-# GPIO Pin 22 compliments to indicate voltage mode. 
-PinVoltsFlag = Pin(22, Pin.OUT)
-
-# GPIO Pin 19 is the power indicator.
-PinPwr = Pin(19, Pin.OUT)
-
-# onboard led (channel 25) is used to indicate how much time the processor is
-# spending awake.  If it never switches off, slow down the scheduling timer. 
-led.value(0)
+# Start from the saved calibration (or the defaults) so that only the parts
+# being recalibrated change.
+cal = calstore.load()
+
+# The pins, the ADC channels and the DAC drivers are the same ones
+# drivemeter.py uses, from metercore.py.
 
 # timer used to schedule measurements / update
 meterUpdateTim = Timer()
 
-### Aliases for the indicator lamps ###
-RANGE_INDICATOR_LAMP_100m = 0x001
-RANGE_INDICATOR_LAMP_250m = 0x002
-RANGE_INDICATOR_LAMP_500m = 0x004
-RANGE_INDICATOR_LAMP_1 =    0x008
-RANGE_INDICATOR_LAMP_2P5 =  0x010
-RANGE_INDICATOR_LAMP_5 =    0x020
-RANGE_INDICATOR_LAMP_10 =   0x040
-RANGE_INDICATOR_LAMP_25 =   0x080
-RANGE_INDICATOR_LAMP_50 =   0x100
-RANGE_INDICATOR_LAMPS_ALL = 0x1FF
-RANGE_INDICATOR_LAMPS_NONE = 0
-
-
 ### functions ###
 
 ############ meter update timer callback #############
@@ -118,65 +62,6 @@ def meterUpdateTick(timer):
     led.low()
 
 
-#
-############ driveMeterDAC ############
-#        _      _           __  __      _            _____          _____ 
-#       | |    (_)         |  \/  |    | |          |  __ \   /\   / ____|
-#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| |  | | /  \ | |     
-#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |  | |/ /\ \| |     
-#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | |__| / ____ \ |____ 
-#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_____/_/    \_\_____|
-#                                                                         
-#                                                                         
-# Send a binary number out to the R-2R Digital to Analogue Converter which will
-# drive the meter pointer to the required position. The value is masked to write
-# out the drive value bit by bit. 
-# 
-def driveMeterDAC(dacValue=0):   
-    if (dacValue & 0x01 == 0):
-        bit0.low()
-    else:
-        bit0.high()
-
-    if (dacValue & 0x02 == 0):
-        bit1.low()
-    else:
-        bit1.high()
-
-    if (dacValue & 0x04 == 0):
-        bit2.low()
-    else:
-        bit2.high()
-
-    if (dacValue & 0x08 == 0):
-        bit3.low()
-    else:
-        bit3.high()
-
-    if (dacValue & 0x10 == 0):
-        bit4.low()
-    else:
-        bit4.high()
-
-    if (dacValue & 0x20 == 0):
-        bit5.low()
-    else:
-        bit5.high()
-
-    if (dacValue & 0x40 == 0):
-        bit6.low()
-    else:
-        bit6.high()
-                                
-    if (dacValue & 0x80 == 0):
-        bit7.low()
-    else:
-        bit7.high()
-                                
-
-        
-
-
 ############# updateRdgs ##############
 #                  _       _       _____     _           
 #                 | |     | |     |  __ \   | |          
@@ -186,47 +71,30 @@ def driveMeterDAC(dacValue=0):
 #  \__,_| .__/ \__,_|\__,_|\__\___|_|  \_\__,_|\__, |___/
 #       | |                                     __/ |    
 #       |_|                                    |___/     
-# Read and average the readings for output voltage, output current and 
-# the zero point from which both of those are referenced. 
+# Read and average the readings for output voltage and the zero point from
+# which it is referenced.
 # Readings are held as integer values. 
 #
 def updateRdgs():
-    global opVarr
-    global opIarr
-    global op0varr
-    
-    # Read all three ADCs and shift to give range 0 - 4096.
-    # All arrays are the same length so just using size of first array
-    for i in range(len(opVarr)):
-        opVarr[i] = opVoltRdg.read_u16()>>4
-#        print("rdg ", i, " Val: ", opVarr[i])
-        op0varr[i] = op0vRdg.read_u16()>>4
+    global lastVoltsCount
+    global lastDacValue
     
-    # get averaged raw adc counts
-    voltsVal = 0
-    volt0Val = 0
-    for i in range(len(opVarr)):
-        voltsVal = voltsVal + opVarr[i]
-        volt0Val = volt0Val + op0varr[i]
-
-    # averaged raw output voltage adc count    
-    voltsVal = voltsVal / len(opVarr)
-    voltsVal = int(voltsVal)
-    
-    # averaged raw 0V voltage adc count
-    volt0Val = volt0Val / len(op0varr)
-    volt0Val = int(volt0Val)
+    # averaged raw output voltage and 0V adc counts
+    voltsVal = readAverage(opVoltRdg, RDG_READS)
+    volt0Val = readAverage(op0vRdg, RDG_READS)
 
     # subtract 0v from output volts reading
     if voltsVal > volt0Val:
         voltsVal -= volt0Val
     else:
         print("op volt error")  
+    lastVoltsCount = voltsVal
         
     # divide by 10 because it's a big number, then write to the DAC.
     voltsVal = int(voltsVal / 10)
     if voltsVal < 220:
         driveMeterDAC(voltsVal) 
+        lastDacValue = voltsVal
 
     print("voltsVal: ", voltsVal)
     print("0vVal: ",volt0Val)
@@ -239,6 +107,259 @@ def updateRdgs():
 
 
 
+############ markGraticule ############
+#                         _     _____           _   _            _
+#                        | |   / ____|         | | (_)          | |
+#    _ __ ___   __ _ _ __| | _| |  __ _ __ __ _| |_ _  ___ _   _| | ___
+#   | '_ ` _ \ / _` | '__| |/ / | |_ | '__/ _` | __| |/ __| | | | |/ _ \
+#   | | | | | | (_| | |  |   <| |__| | | | (_| | |_| | (__| |_| | |  __/
+#   |_| |_| |_|\__,_|_|  |_|\_\\_____|_|  \__,_|\__|_|\___|\__,_|_|\___|
+#
+#
+# With the pot turned so the needle sits on a graticule, call from the REPL
+# with the graticule's percentage to record the DAC count driving it.
+# e.g. markGraticule(48)
+#
+def markGraticule(percent):
+    cal['graticule_dac'][percent // 4] = lastDacValue
+    print(percent, "% graticule: ", lastDacValue)
+
+
+############ markVolts ############
+#                         _  __      __   _ _
+#                        | | \ \    / /  | | |
+#    _ __ ___   __ _ _ __| | _\ \  / /__ | | |_ ___
+#   | '_ ` _ \ / _` | '__| |/ /\ \/ / _ \| | __/ __|
+#   | | | | | | (_| | |  |   <  \  / (_) | | |_\__ \
+#   |_| |_| |_|\__,_|_|  |_|\_\  \/ \___/|_|\__|___/
+#
+#
+# With the PSU output set to a known voltage (10V is good), call with the
+# voltage read on a trusted meter to work out what one ADC count is worth.
+# This replaces adjusting the MAX_VOLTS_OUT literal by hand.
+#
+def markVolts(volts):
+    cal['volts_per_count'] = volts / lastVoltsCount
+    print("volts per count: ", cal['volts_per_count'])
+
+
+############ saveCal ############
+#                         _____      _
+#                        / ____|    | |
+#    ___  __ ___   _____| |     __ _| |
+#   / __|/ _` \ \ / / _ \ |    / _` | |
+#   \__ \ (_| |\ V /  __/ |___| (_| | |
+#   |___/\__,_| \_/ \___|\_____\__,_|_|
+#
+#
+# Save the calibration for drivemeter.py to pick up next time it boots.
+#
+def saveCal():
+    calstore.save(cal)
+    print("calibration saved to", calstore.CAL_FILE)
+
+
+############ guidedCal ############
+#                _     _          _  _____      _
+#               (_)   | |        | |/ ____|    | |
+#     __ _ _   _ _  __| | ___  __| | |     __ _| |
+#    / _` | | | | |/ _` |/ _ \/ _` | |    / _` | |
+#   | (_| | |_| | | (_| |  __/ (_| | |___| (_| | |
+#    \__, |\__,_|_|\__,_|\___|\__,_|\_____\__,_|_|
+#     __/ |
+#    |___/
+# Calibrate the whole meter in one go.  The DAC is stepped slowly from 0 up
+# to 255 and back down again.  Each time the needle crosses the next
+# graticule press Enter at the REPL (or the button, if buttonPin is given) -
+# 0% first, then 4% and so on.  Press q to give up.
+# Marks made on the way up come a little late and marks made on the way down
+# a little early, so averaging the two takes out the reaction time.  Any
+# graticules that were missed are filled in by fitGraticules.
+# The graticule of each mark is just the count of presses, so a missed or a
+# doubled press puts every mark after it on the wrong graticule.  checkMarks
+# catches that from the two sweeps disagreeing, and then nothing is saved.
+# Otherwise the result goes straight into the calibration and is saved.
+# The update timer is started again however it ends.
+#
+def guidedCal(stepMs=150, buttonPin=None):
+    global buttonPressed
+
+    meterUpdateTim.deinit()
+    try:
+        buttonPressed = False
+        if buttonPin is not None:
+            button = Pin(buttonPin, Pin.IN, Pin.PULL_UP)
+            button.irq(trigger=Pin.IRQ_FALLING, handler=buttonIrq)
+        keys = select.poll()
+        keys.register(sys.stdin, select.POLLIN)
+
+        print("Mark each graticule as the needle crosses it, 0% first. q to quit.")
+        upMarks = []
+        downMarks = []
+        sweep = list(range(256)) + list(range(255, -1, -1))
+        graticule = 0
+        for n in range(len(sweep)):
+            if n == 256:
+                # on the way back down, the graticules come in reverse order.
+                print("Now on the way back down, 104% first.")
+                graticule = calstore.GRATICULES - 1
+            driveMeterDAC(sweep[n])
+            utime.sleep_ms(stepMs)
+
+            pressed = buttonPressed
+            buttonPressed = False
+            # everything typed since the last step is one press, so the CR
+            # and LF of one Enter don't count as two.
+            typed = ''
+            while keys.poll(0):
+                typed += sys.stdin.read(1)
+            if typed:
+                if 'q' in typed or 'Q' in typed:
+                    print("calibration abandoned")
+                    return
+                pressed = True
+            if pressed and 0 <= graticule < calstore.GRATICULES:
+                print(graticule * 4, "% at DAC ", sweep[n])
+                if n < 256:
+                    upMarks.append((graticule, sweep[n]))
+                    graticule += 1
+                else:
+                    downMarks.append((graticule, sweep[n]))
+                    graticule -= 1
+
+        if not checkMarks(upMarks, downMarks, cal['graticule_dac']):
+            print("calibration not saved, a mark was missed or doubled - try again")
+            return
+        cal['graticule_dac'] = fitGraticules(upMarks + downMarks)
+        print("graticules: ", cal['graticule_dac'])
+        saveCal()
+        showGraticules()
+    finally:
+        meterUpdateTim.init(freq=5, mode=Timer.PERIODIC, callback=meterUpdateTick)
+
+
+############ buttonIrq ############
+#    _           _   _              _____
+#   | |         | | | |            |_   _|
+#   | |__  _   _| |_| |_ ___  _ __   | |  _ __ __ _
+#   | '_ \| | | | __| __/ _ \| '_ \  | | | '__/ _` |
+#   | |_) | |_| | |_| || (_) | | | |_| |_| | | (_| |
+#   |_.__/ \__,_|\__|\__\___/|_| |_|_____|_|  \__, |
+#                                                | |
+#                                                |_|
+# Mark button interrupt handler for guidedCal.
+#
+def buttonIrq(pin):
+    global buttonPressed
+    global buttonTime
+    # ignore contact bounce
+    now = utime.ticks_ms()
+    if utime.ticks_diff(now, buttonTime) > 200:
+        buttonPressed = True
+        buttonTime = now
+
+
+############ checkMarks ############
+#         _               _    __  __            _
+#        | |             | |  |  \/  |          | |
+#     ___| |__   ___  ___| | _| \  / | __ _ _ __| | _____
+#    / __| '_ \ / _ \/ __| |/ / |\/| |/ _` | '__| |/ / __|
+#   | (__| | | |  __/ (__|   <| |  | | (_| | |  |   <\__ \
+#    \___|_| |_|\___|\___|_|\_\_|  |_|\__,_|_|  |_|\_\___/
+#
+#
+# Compare the marks from guidedCal's sweep up with the ones from its sweep
+# down, graticule by graticule.  The reaction time puts each up mark about
+# the same distance after its down mark, so that distance is taken out (the
+# median over all the graticules marked both ways) and what's left should be
+# small.  Graticules are mostly only 4 to 8 DAC counts apart, and a missed or
+# doubled press moves a mark on by a whole one, so anything over half the
+# smaller gap to the graticules either side in graticules (the calibration
+# this one is to replace) means the presses got out of step.  Prints those
+# and returns False if there are any.
+#
+def checkMarks(upMarks, downMarks, graticules):
+    up = {}
+    for graticule, dacValue in upMarks:
+        up[graticule] = dacValue
+    down = {}
+    for graticule, dacValue in downMarks:
+        down[graticule] = dacValue
+    both = sorted(graticule for graticule in up if graticule in down)
+    if not both:
+        return True
+    lags = sorted(up[graticule] - down[graticule] for graticule in both)
+    lag = lags[len(lags) // 2]
+    good = True
+    for graticule in both:
+        gaps = [abs(graticules[graticule] - graticules[n])
+                for n in (graticule - 1, graticule + 1) if 0 <= n < len(graticules)]
+        if 2 * abs(up[graticule] - down[graticule] - lag) > min(gaps):
+            print(graticule * 4, "% marked at DAC ", up[graticule], " going up but ",
+                  down[graticule], " going down")
+            good = False
+    return good
+
+
+############ fitGraticules ############
+#     __ _ _    _____           _   _            _
+#    / _(_) |  / ____|         | | (_)          | |
+#   | |_ _| |_| |  __ _ __ __ _| |_ _  ___ _   _| | ___  ___
+#   |  _| | __| | |_ | '__/ _` | __| |/ __| | | | |/ _ \/ __|
+#   | | | | |_| |__| | | | (_| | |_| | (__| |_| | |  __/\__ \
+#   |_| |_|\__|\_____|_|  \__,_|\__|_|\___|\__,_|_|\___||___/
+#
+#
+# Turn a list of (graticule, DAC count) marks into a DAC count for every
+# graticule.  Graticules marked more than once get the average, ones that
+# were missed are interpolated from the marked graticules either side (or
+# extrapolated from the nearest two at the ends), then the whole lot is made
+# monotonic so the needle can never go backwards.
+#
+def fitGraticules(marks):
+    sums = [0] * calstore.GRATICULES
+    counts = [0] * calstore.GRATICULES
+    for graticule, dacValue in marks:
+        sums[graticule] += dacValue
+        counts[graticule] += 1
+    points = [(g, sums[g] / counts[g]) for g in range(calstore.GRATICULES) if counts[g]]
+    if len(points) < 2:
+        raise ValueError("need at least two graticules marked")
+
+    fitted = []
+    for g in range(calstore.GRATICULES):
+        # find the marked points either side, or the end pair to extrapolate
+        # from.
+        upper = 1
+        while upper < len(points) - 1 and points[upper][0] < g:
+            upper += 1
+        (g0, d0), (g1, d1) = points[upper - 1], points[upper]
+        dacValue = int(d0 + (d1 - d0) * (g - g0) / (g1 - g0) + 0.5)
+        if fitted and dacValue < fitted[-1]:
+            dacValue = fitted[-1]
+        fitted.append(min(max(dacValue, 0), 255))
+    return fitted
+
+
+############ showGraticules ############
+#        _                    _____           _   _            _
+#       | |                  / ____|         | | (_)          | |
+#    ___| |__   _____      _| |  __ _ __ __ _| |_ _  ___ _   _| | ___  ___
+#   / __| '_ \ / _ \ \ /\ / / | |_ | '__/ _` | __| |/ __| | | | |/ _ \/ __|
+#   \__ \ | | | (_) \ V  V /| |__| | | | (_| | |_| | (__| |_| | |  __/\__ \
+#   |___/_| |_|\___/ \_/\_/  \_____|_|  \__,_|\__|_|\___|\__,_|_|\___||___/
+#
+#
+# Move the needle to each graticule in turn so the calibration can be
+# checked by eye.
+#
+def showGraticules(holdMs=400):
+    for dacValue in cal['graticule_dac']:
+        driveMeterDAC(dacValue)
+        utime.sleep_ms(holdMs)
+    driveMeterDAC(0)
+
+
 ############ main program ###########
 #                    _                                                   
 #                   (_)                                                  
@@ -249,10 +370,13 @@ def updateRdgs():
 #                             | |               __/ |                    
 #                             |_|              |___/                     
 #
-opVoltRdg = machine.ADC(2)
-opVarr = [0, 0, 0, 0, 0, 0, 0, 0]
-op0vRdg = machine.ADC(0)
-op0varr = [0, 0, 0, 0, 0, 0, 0, 0]
+opVoltRdg, opCurrRdg, op0vRdg = openAdcs(cal['adc_channels'])
+# readings of each channel averaged per update
+RDG_READS = 8
+lastVoltsCount = 0
+lastDacValue = 0
+buttonPressed = False
+buttonTime = 0
 PinPwr.value(1) #power indicator
 
 # The meter update timer schedules running of the meter update code. 
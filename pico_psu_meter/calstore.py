@@ -0,0 +1,186 @@
+
+# _________________________________________
+#/ Calibration store for the meter         \
+#| programs. cal-meter.py saves the        |
+#| calibration to a file on the pico's     |
+#| flash and drivemeter.py loads it at     |
+#| boot, so recalibrating no longer means  |
+#\ editing the code.                       /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# The file is JSON so that it can be looked at and tweaked by hand:
+#   version          - CAL_VERSION, bumped whenever the layout changes
+#   graticule_dac    - DAC counts that put the needle on each graticule,
+#                      0%, 4% ... 104% of full scale
+#   volts_per_count  - output volts represented by one ADC count
+#   amps_per_count   - output amps represented by one ADC count
+#   volts_zero       - ADC counts to take off the volts reading on top of
+#                      the 0V channel reading
+#   amps_zero        - the same for the current reading
+#   adc_channels     - which ADC channel reads the output volts, the output
+#                      current and the 0V rail
+#   filters          - the filter chains for the volts and the amps readings,
+#                      see filters.py.  Not strictly calibration, but it's
+#                      the one file of settings the meter has.
+#   ballistics       - how the needle moves to each new reading, see
+#                      ballistics.py.  Likewise not really calibration.
+
+import json
+import os
+
+import ballistics
+import filters
+
+CAL_FILE = 'meter-cal.json'
+CAL_VERSION = 1
+
+###########  DEFAULT CALIBRATION VALUES ##########
+# Used when no calibration has been saved yet.
+# The following isn't that precise. In practice, the MAX_VOLTS_OUT literal
+# is adjusted to get the ADC voltage reading as close as possible to the
+# output when set to 10V. 
+# One ADC count represents...
+MAX_VOLTS_OUT = 46
+FULL_SCALE_COUNT = 4096
+MAX_AMPS_OUT = 6
+
+# The meter has 25 graticules, so each represents 4% of Full Scale
+# Deflection.  Below is a list of DAC counts to drive the indicator to each
+# graticule (0%, 4% ... 104%) because the system is not really linear.
+# Calibration used a test program to read an ADC input driven from a
+# potentiometer and print out the ADC count while the needle was moved to
+# each graticule position using the potentiometer.
+DEFAULT_GRATICULE_DAC = (
+     31,  51,  57,  63,  70,  78,  85,  91,  96, 102, 109, 115, 121, 126,
+    131, 137, 143, 148, 153, 158, 164, 170, 174, 179, 184, 192, 197)
+GRATICULES = 27
+
+
+############ defaults ############
+#        _       __            _ _
+#       | |     / _|          | | |
+#     __| | ___| |_ __ _ _   _| | |_ ___
+#    / _` |/ _ \  _/ _` | | | | | __/ __|
+#   | (_| |  __/ || (_| | |_| | | |_\__ \
+#    \__,_|\___|_| \__,_|\__,_|_|\__|___/
+#
+#
+# A fresh copy of the default calibration.
+#
+def defaults():
+    return {
+        'version': CAL_VERSION,
+        'graticule_dac': list(DEFAULT_GRATICULE_DAC),
+        'volts_per_count': MAX_VOLTS_OUT / FULL_SCALE_COUNT,
+        'amps_per_count': MAX_AMPS_OUT / FULL_SCALE_COUNT,
+        'volts_zero': 0,
+        'amps_zero': 0,
+        'adc_channels': {'volts': 2, 'amps': 1, 'zero': 0},
+        'filters': {'volts': [], 'amps': []},
+        'ballistics': dict(ballistics.DEFAULT_SETTINGS),
+    }
+
+
+############ validate ############
+#               _ _     _       _
+#              | (_)   | |     | |
+#   __   ____ _| |_  __| | __ _| |_ ___
+#   \ \ / / _` | | |/ _` |/ _` | __/ _ \
+#    \ V / (_| | | | (_| | (_| | ||  __/
+#     \_/ \__,_|_|_|\__,_|\__,_|\__\___|
+#
+#
+# Raise ValueError saying what is wrong if cal isn't a usable calibration.
+#
+def validate(cal):
+    if cal.get('version') != CAL_VERSION:
+        raise ValueError("calibration version %s, expected %d" % (cal.get('version'), CAL_VERSION))
+
+    graticule = cal['graticule_dac']
+    if len(graticule) != GRATICULES:
+        raise ValueError("calibration needs %d graticules" % GRATICULES)
+    for g in range(GRATICULES):
+        if not isinstance(graticule[g], int):
+            raise ValueError("graticule %d%% DAC count must be a whole number" % (g * 4))
+        if not 0 <= graticule[g] <= 255:
+            raise ValueError("graticule %d%% DAC count out of range" % (g * 4))
+        if g and graticule[g] < graticule[g - 1]:
+            raise ValueError("graticule %d%% lower than the one before" % (g * 4))
+
+    for key in ('volts_per_count', 'amps_per_count'):
+        if not cal[key] > 0:
+            raise ValueError(key + " must be positive")
+    # the zeros are shifted up to fixed point by drivemeter, so whole counts.
+    for key in ('volts_zero', 'amps_zero'):
+        if not isinstance(cal[key], int):
+            raise ValueError(key + " must be a whole number of counts")
+        if not -4096 < cal[key] < 4096:
+            raise ValueError(key + " out of range")
+
+    # the background capture only goes round channels 0, 1 and 2.
+    channels = cal['adc_channels']
+    used = [channels['volts'], channels['amps'], channels['zero']]
+    for channel in used:
+        if channel not in (0, 1, 2) or used.count(channel) > 1:
+            raise ValueError("adc_channels must be 0, 1 and 2 in some order")
+
+    filters.checkSpec(cal['filters']['volts'])
+    filters.checkSpec(cal['filters']['amps'])
+    ballistics.checkSettings(cal['ballistics'])
+
+
+############ load ############
+#    _                 _
+#   | |               | |
+#   | | ___   __ _  __| |
+#   | |/ _ \ / _` |/ _` |
+#   | | (_) | (_| | (_| |
+#   |_|\___/ \__,_|\__,_|
+#
+#
+# Load and check the saved calibration.  Falls back to the defaults, saying
+# why, if there isn't one or it's no good - the meter has to keep working.
+# Settings added since the file was saved take their default values.
+#
+def load(fileName=CAL_FILE):
+    try:
+        with open(fileName) as f:
+            cal = json.load(f)
+        for key, value in defaults().items():
+            if key not in cal:
+                cal[key] = value
+        validate(cal)
+        return cal
+    except OSError:
+        print("no calibration saved, using defaults")
+    except (ValueError, KeyError, TypeError) as e:
+        print("calibration not used:", e)
+    return defaults()
+
+
+############ save ############
+#
+#
+#    ___  __ ___   _____
+#   / __|/ _` \ \ / / _ \
+#   \__ \ (_| |\ V /  __/
+#   |___/\__,_| \_/ \___|
+#
+#
+# Check and save a calibration.  It's written to a temporary file first so
+# that a power cut part way through can't leave a half written calibration,
+# then renamed over the old one.  littlefs replaces the old file in the same
+# step, so there's always one calibration or the other on the flash.
+#
+def save(cal, fileName=CAL_FILE):
+    validate(cal)
+    tmpName = fileName + '.tmp'
+    with open(tmpName, 'w') as f:
+        json.dump(cal, f)
+    os.rename(tmpName, fileName)
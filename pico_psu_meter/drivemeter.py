@@ -29,97 +29,235 @@
 #                ||     ||
 #
 
-# note: to run standalone on the pico, file must be called main.py
-
-# The following isn't that precise. In practice, the MAX_VOLTS_OUT literal
-# is adjusted to get the ADC voltage reading as close as possible to the
-# output when set to 10V. 
-# One ADC count represents...
-MAX_VOLTS_OUT = 46
-FULL_SCALE_COUNT = 4096
-VOLTS_PER_ADC_STEP = (MAX_VOLTS_OUT / FULL_SCALE_COUNT)
-ISENSE_R_VAL_OHMS = 0.3
-
-MAX_AMPS_OUT = 6
-AMPS_PER_ADC_STEP = (MAX_AMPS_OUT / FULL_SCALE_COUNT)
+# note: to run standalone on the pico, file must be called main.py, or
+# built with host/build_mpy.py and started by the main.py that makes.
 
 #initialisation
 import array
-import machine
 import utime
-from machine import Pin, Timer
+# When this file started running, in ms since the pico was reset.  Anything
+# before this is the firmware booting and this file being compiled.  The
+# rest of startupMs is filled in as the meter comes up, see reportStartup.
+STARTUP_RUN = 0
+STARTUP_SETUP = 1
+STARTUP_LAMPS = 2
+STARTUP_RDG = 3
+startupMs = array.array('L', [utime.ticks_ms(), 0, 0, 0])
+import micropython
+from machine import Pin, Timer, mem32
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+import ballistics
+import calstore
+import filters
+from metercore import *
 
-# set gpio23 high for continuous PWM SMPS operation.
-modeSmps = Pin(23, Pin.OUT)
-modeSmps.value(1)
+# The calibration is saved on the flash by cal-meter.py, see calstore.py.
+# It's only read here, once, at boot.
+cal = calstore.load()
 
-# An 8-bit R2R ladder DAC is used to drive the meter via a
-# single transistor V->I converter 
-# Range of meter is 0 to 1mA
-bit0 = Pin(0, Pin.OUT)
-bit1 = Pin(1, Pin.OUT)
-bit2 = Pin(2, Pin.OUT)
-bit3 = Pin(3, Pin.OUT)
-bit4 = Pin(4, Pin.OUT)
-bit5 = Pin(5, Pin.OUT)
-bit6 = Pin(6, Pin.OUT)
-bit7 = Pin(7, Pin.OUT)
+# One ADC count represents...
+VOLTS_PER_ADC_STEP = cal['volts_per_count']
+AMPS_PER_ADC_STEP = cal['amps_per_count']
+ISENSE_R_VAL_OHMS = 0.3
 
-led = Pin(25, Pin.OUT)
+# The pins, the ADC channels, the lamp aliases and the DAC drivers are all
+# in metercore.py, shared with cal-meter.py.  USE_PORT_WRITES is set there.
 
+# Set USE_PIO_OUTPUTS to hand the DAC pins and the range lamp pins over to
+# two PIO state machines instead, see initPioOutputs.  Each update is then a
+# single put() into a state machine's FIFO.  The mode flags stay on the SIO:
+# the ILim input, GPIO21, sits between them so they can't be part of the
+# lamps' block of pins, and they change a few microseconds after the lamps.
+USE_PIO_OUTPUTS = False
+PIO_DAC_SM = 0
+PIO_LAMPS_SM = 1
 
-# ADC Channels
-#=============
-# direct reading of output voltage
-opVoltRdg = machine.ADC(0)
-# current is read as a voltage across a 0.3 ohm resistor
-opCurrRdg = machine.ADC(1)
-# 0v output is measured to offset various physical effects
-op0vRdg = machine.ADC(2)
-
-# meter range indication leds
-pin100m = Pin(10,  Pin.OUT)
-pin250m = Pin(11,  Pin.OUT)
-pin500m = Pin(12, Pin.OUT)
-pin1v   = Pin(13, Pin.OUT)
-pin2v5  = Pin(14, Pin.OUT)
-pin5v   = Pin(15, Pin.OUT)
-pin10v  = Pin(16, Pin.OUT)
-
-
-pin25v  = Pin(17, Pin.OUT)
-pin50v  = Pin(18, Pin.OUT)
-
-# GPIO Pin 21 is used to detect current limit mode.
-# Input = 0 when current limit is active. 
-pinILim = Pin(21, Pin.IN)
-# GPIO Pin 20 drives the red front panel Imode LED to mirror the control board LED.
-PinIlimFlag = Pin(20, Pin.OUT)
-# GPIO Pin 22 compliments to indicate voltage mode. 
-PinVoltsFlag = Pin(22, Pin.OUT)
-
-# GPIO Pin 19 is the power indicator.
-PinPwr = Pin(19, Pin.OUT)
-
-# onboard led (channel 25) is used to indicate how much time the processor is
-# spending awake.  If it never switches off, slow down the scheduling timer. 
-led.value(0)
+# the panel outputs as they are now.  A soft reset leaves GPIO_OUT as it
+# was, and Pin(n, Pin.OUT) doesn't clear it, so they can start off lit.
+panelShadow = mem32[SIO_GPIO_OUT] & PANEL_MASK
 
 # timer used to schedule measurements / update
 meterUpdateTim = Timer()
+# With the updates done by asyncio tasks rather than in the timer callback
+# the update rate is no longer limited to around 35Hz.
+METER_UPDATE_HZ = 100
+# With USE_ADAPTIVE_RATE the update rate follows what the output is doing,
+# see adaptRate.  While the readings sit still it idles at IDLE_UPDATE_HZ
+# with deeper averaging; a needle move of more than BUSY_PERMILLE of full
+# scale between updates, a range change or a change of mode puts it up to
+# BUSY_UPDATE_HZ with shorter averaging until BUSY_HOLD_MS after the last
+# of them.  METER_UPDATE_HZ is used when it's off.
+# It's the display side that idles: the capture and the sampling core keep
+# going flat out whatever the rate.
+# The first current limit edge goes busy straight away, see rateWake, and
+# the sampling core wakes an update as soon as the volts or current average
+# jumps by more than WAKE_COUNTS ADC counts, see samplingLoop - neither
+# waits for the next idle update.
+USE_ADAPTIVE_RATE = True
+IDLE_UPDATE_HZ = 25
+BUSY_UPDATE_HZ = 200
+BUSY_PERMILLE = 20
+BUSY_HOLD_MS = 500
+WAKE_COUNTS = 32
+# Each range's own oversample shift (see VOLTS_RANGES) is moved by these
+# while busy and idle, within OVERSAMPLE_MIN_SHIFT to OVERSAMPLE_MAX_SHIFT,
+# so the low ranges keep their deeper averaging either way: busy, the 100mV
+# range comes down from 4096 samples to 1024 and the top ranges stay at 256;
+# idle, the top ranges go up to 1024.  Without oversampling the ring buffer
+# window comes down to 2**BUSY_WINDOW_SHIFT while busy.
+BUSY_OVERSAMPLE_BIAS = -2
+IDLE_OVERSAMPLE_BIAS = 2
+BUSY_WINDOW_SHIFT = 3
+# With USE_SAMPLING_CORE the capture, averaging and filtering run in a loop
+# of their own on the pico's second core, see samplingLoop, and the tasks on
+# this core just take the latest readings at each tick.  The display side
+# can then take as long as it likes without holding up the sampling.
+USE_SAMPLING_CORE = True
+# how long the sampling core waits before looking again when the capture
+# hasn't finished a block.
+SAMPLING_IDLE_US = 200
+# Set PROFILE_TICKS to time each stage of every update, see tickprof.py.
+PROFILE_TICKS = False
+# Set TELEMETRY to stream every update down the USB serial port as binary
+# frames, see telemetry.py.  Much quicker than printing.
+TELEMETRY = False
+# how often the telemetry frames waiting in the ring are sent.
+TELEMETRY_FLUSH_MS = 20
+# While the update tasks are running the current limit input is watched by
+# an edge triggered interrupt, so the panel switches between volts and amps
+# as soon as the PSU goes into or out of current limit rather than at the
+# next tick.  The input has to stay put for ILIM_DEBOUNCE_MS to count.
+USE_ILIM_IRQ = True
+ILIM_DEBOUNCE_MS = 2
+# Each boot's startup times are added to the end of STARTUP_LOG on the
+# pico's flash once the first reading is on the meter, so the startup cost
+# can be followed from build to build.  Only the last STARTUP_LOG_LINES
+# boots are kept.  None to not keep them.
+STARTUP_LOG = 'startup-times.txt'
+STARTUP_LOG_LINES = 50
+# Set RECORD_TRANSIENTS to keep the captured samples around current limit
+# events, see transient.py and enableTransients.
+RECORD_TRANSIENTS = False
+# With the needle ballistics on, the needle is moved to each new reading a
+# step at a time from needleTim, see ballistics.py, rather than jumped there.
+# Turned on and tuned by the calibration file.
+USE_BALLISTICS = cal['ballistics']['enabled']
+# With USE_DITHER the needle timer also flicks the DAC between the two codes
+# either side of where the needle should be, in proportion, so the needle
+# settles between them and isn't limited to the 166 or so codes the
+# calibration spans.  The coil is far too slow to follow the flicking.
+USE_DITHER = True
+# needle timer rate when it's only dithering, without the ballistics.
+DITHER_HZ = 1000
+DITHER_FRAC_BITS = 8
+DITHER_FRAC_MASK = (1 << DITHER_FRAC_BITS) - 1
+needleTim = Timer()
+
+# Averaging
+#==========
+# Each channel is averaged over the last 2**RDG_WINDOW_SHIFT readings:
+# 3 for 8, 6 for 64, 8 for 256.  The window can be changed on the fly with
+# setRdgWindow, up to 2**RDG_WINDOW_MAX_SHIFT.
+RDG_WINDOW_SHIFT = 6
+RDG_WINDOW_MAX_SHIFT = 8
+# readings of each channel per tick when capturing with read_u16
+ADC_READS_PER_TICK = 8
+
+# Background ADC capture
+#=======================
+# Rather than reading the ADCs one at a time in the timer callback, the ADC
+# can free-run in round-robin over the three channels and DMA the results
+# into captureBuf.  The update tick then just sums up the block that was
+# captured since the last tick.  Needs rp2.DMA (MicroPython 1.22 on), the
+# blocking read_u16 loop is used if that isn't there.
+USE_ADC_CAPTURE = True
+CAPTURE_SAMPLES_PER_CHANNEL = 64
+# samples per second across all three channels, 48k means a block takes 4ms.
+CAPTURE_RATE_HZ = 48000
+ADC_CLOCK_HZ = 48000000
 
-### Aliases for the indicator lamps ###
-RANGE_INDICATOR_LAMP_100m = 0x001
-RANGE_INDICATOR_LAMP_250m = 0x002
-RANGE_INDICATOR_LAMP_500m = 0x004
-RANGE_INDICATOR_LAMP_1 =    0x008
-RANGE_INDICATOR_LAMP_2P5 =  0x010
-RANGE_INDICATOR_LAMP_5 =    0x020
-RANGE_INDICATOR_LAMP_10 =   0x040
-RANGE_INDICATOR_LAMP_25 =   0x080
-RANGE_INDICATOR_LAMP_50 =   0x100
-RANGE_INDICATOR_LAMPS_ALL = 0x1FF
-RANGE_INDICATOR_LAMPS_NONE = 0
+# Oversampling
+#=============
+# With USE_OVERSAMPLING the capture runs the ADC flat out and each display
+# update is the sum of one whole block of 2**n samples per channel, decimated
+# down to RDG_FRAC_BITS of fraction.  Every 4x oversampling buys another bit,
+# so 256 samples gives a 16 bit result from the 12 bit ADC - provided there's
+# a bit of noise on the input to dither it, which there always is.
+# The depth comes from the range being displayed (see VOLTS_RANGES), deep on
+# the low ranges where the extra bits matter and shallow on the high ones.  At
+# 500k samples/s a 4096 deep block of three channels takes about 25ms, so the
+# lowest ranges update at around 40Hz whatever METER_UPDATE_HZ says.
+# Needs the background capture, the ring buffer averaging is used without it.
+USE_OVERSAMPLING = True
+OVERSAMPLE_MIN_SHIFT = 8
+OVERSAMPLE_MAX_SHIFT = 12
+OVERSAMPLE_RATE_HZ = 500000
+ADC_BASE = 0x4004c000
+ADC_CS = ADC_BASE + 0x00
+ADC_FCS = ADC_BASE + 0x08
+ADC_FIFO = ADC_BASE + 0x0c
+ADC_DIV = ADC_BASE + 0x10
+ADC_CS_EN = 0x00000001
+ADC_CS_START_MANY = 0x00000008
+ADC_CS_READY = 0x00000100
+ADC_CS_AINSEL_SHIFT = 12
+ADC_CS_RROBIN_0_1_2 = 0x00070000
+ADC_FCS_EN = 0x00000001
+ADC_FCS_DREQ_EN = 0x00000008
+ADC_FCS_UNDER = 0x00000400
+ADC_FCS_OVER = 0x00000800
+ADC_FCS_LEVEL = 0x000f0000
+ADC_FCS_THRESH_1 = 0x01000000
+DREQ_ADC = 36
+
+###########  METER CALIBRATION VALUES ##########
+# The meter has 25 graticules, so each represents 4% of Full Scale
+# Deflection.  The calibration holds the DAC count to drive the indicator to
+# each graticule (0%, 4% ... 104%) because the system is not really linear.
+METER_GRATICULE_DAC = bytes(cal['graticule_dac'])
+METER_GRATICULES = calstore.GRATICULES
+GRATICULE_PERMILLE = 40
+METER_MAX_PERMILLE = 1040
+
+### Meter ranges ###
+# One entry per range: (full scale, up limit, down limit, range lamp,
+# oversample shift).
+# Hysteresis is applied when changing down through ranges by having the down
+# limit well below the full scale of the range underneath.
+# The oversample shift is log2 of the samples per channel summed for each
+# update when oversampling.  On the 100mV range one ADC count is a sizeable
+# chunk of full scale, so it gets the most.  The adaptive rate moves it up
+# or down a little, see BUSY_OVERSAMPLE_BIAS.
+RANGE_FULL_SCALE = 0
+RANGE_UP_LIM = 1
+RANGE_DOWN_LIM = 2
+RANGE_LAMP = 3
+RANGE_OVERSAMPLE = 4
+VOLTS_RANGES = (
+    (0.1,  0.1,  0.0,  RANGE_INDICATOR_LAMP_100m, 12),
+    (0.25, 0.25, 0.08, RANGE_INDICATOR_LAMP_250m, 12),
+    (0.5,  0.5,  0.2,  RANGE_INDICATOR_LAMP_500m, 11),
+    (1,    1.0,  0.4,  RANGE_INDICATOR_LAMP_1,    10),
+    (2.5,  2.5,  0.8,  RANGE_INDICATOR_LAMP_2P5,  9),
+    (5,    5.0,  2.0,  RANGE_INDICATOR_LAMP_5,    8),
+    (10,   10.0, 4.0,  RANGE_INDICATOR_LAMP_10,   8),
+    (25,   25.0, 8.0,  RANGE_INDICATOR_LAMP_25,   8),
+    (50,   50.0, 20.0, RANGE_INDICATOR_LAMP_50,   8))
+# No point having current ranges above 10A. The output transistor will melt
+# if current gets any higher.
+AMPS_RANGES = VOLTS_RANGES[:7]
+VOLTS_TOP_RANGE = len(VOLTS_RANGES) - 1
+AMPS_TOP_RANGE = len(AMPS_RANGES) - 1
+
+# Readings are kept as ADC counts with RDG_FRAC_BITS bits of fraction (from
+# the averaging) rather than as volts and amps, so what one reading step is
+# worth is...
+RDG_FRAC_BITS = 4
+VOLTS_PER_RDG = VOLTS_PER_ADC_STEP / (1 << RDG_FRAC_BITS)
+AMPS_PER_RDG = AMPS_PER_ADC_STEP / (1 << RDG_FRAC_BITS)
 
 
 ### functions ###
@@ -134,11 +272,374 @@ RANGE_INDICATOR_LAMPS_NONE = 0
 #                                      | |                                                                    
 #                                      |_|                                                                    
 # 
-# Called periodically to monitor things and update indicators / meter position. 
+# Called periodically to kick off a meter update.  This runs in interrupt
+# context, so all it does is wake up the sampling task - the real work is
+# done by the tasks in meterTasks.
 def meterUpdateTick(timer):
-    led.high()
-    updateRdgs()  # and do everything else...
-    led.low()
+    if tickBusy and PROFILE_TICKS:
+        tickprof.overrun()
+    tickFlag.set()
+
+
+############ meterUpdate ############
+#                   _            _    _           _       _
+#                  | |          | |  | |         | |     | |
+#    _ __ ___   ___| |_ ___ _ __| |  | |_ __   __| | __ _| |_ ___
+#   | '_ ` _ \ / _ \ __/ _ \ '__| |  | | '_ \ / _` |/ _` | __/ _ \
+#   | | | | | |  __/ ||  __/ |  | |__| | |_) | (_| | (_| | ||  __/
+#   |_| |_| |_|\___|\__\___|_|   \____/| .__/ \__,_|\__,_|\__\___|
+#                                      | |
+#                                      |_|
+# The whole update in one go, for running without the scheduler (from the
+# REPL or a host-side test for instance).
+def meterUpdate():
+    start = utime.ticks_us()
+    if updateRdgs():
+        calcModeAndRange(voltsRdg, currRdg)
+        refreshPanel()
+        refreshMeter()
+        if PROFILE_TICKS:
+            tickprof.record(tickprof.STAGE_TICK, start)
+        if TELEMETRY:
+            sendTelemetry(start)
+        if adaptiveRate:
+            adaptRate()
+
+
+############ enableProfiling ############
+#                     _     _      _____            __ _ _ _
+#                    | |   | |    |  __ \          / _(_) (_)
+#     ___ _ __   __ _| |__ | | ___| |__) | __ ___ | |_ _| |_ _ __   __ _
+#    / _ \ '_ \ / _` | '_ \| |/ _ \  ___/ '__/ _ \|  _| | | | '_ \ / _` |
+#   |  __/ | | | (_| | |_) | |  __/ |   | | | (_) | | | | | | | | | (_| |
+#    \___|_| |_|\__,_|_.__/|_|\___|_|   |_|  \___/|_| |_|_|_|_| |_|\__, |
+#                                                                   __/ |
+#                                                                  |___/
+# Start timing the stages of each update.  tickprof.report() shows the
+# results.
+#
+def enableProfiling():
+    global tickprof
+    global PROFILE_TICKS
+    import tickprof
+    PROFILE_TICKS = True
+
+
+############ enableTelemetry ############
+#                     _     _   _______   _                     _
+#                    | |   | | |__   __| | |                   | |
+#     ___ _ __   __ _| |__ | | ___| | ___| | ___ _ __ ___   ___| |_ _ __ _   _
+#    / _ \ '_ \ / _` | '_ \| |/ _ \ |/ _ \ |/ _ \ '_ ` _ \ / _ \ __| '__| | | |
+#   |  __/ | | | (_| | |_) | |  __/ |  __/ |  __/ | | | | |  __/ |_| |  | |_| |
+#    \___|_| |_|\__,_|_.__/|_|\___|_|\___|_|\___|_| |_| |_|\___|\__|_|   \__, |
+#                                                                         __/ |
+#                                                                        |___/
+# Start recording a telemetry frame for every update, sent to out (the USB
+# serial port by default) by telemetryTask.  Call before meterMain.
+#
+def enableTelemetry(out=None):
+    global telemetry
+    global TELEMETRY
+    import telemetry
+    telemetry.start(out)
+    TELEMETRY = True
+
+# For a look at the readings as they go by, see enableTelemetry rather than
+# printing them - printing slows the update down too much.
+
+
+############ enableTransients ############
+#                     _     _   _______                  _            _
+#                    | |   | | |__   __|                (_)          | |
+#     ___ _ __   __ _| |__ | | ___| |_ __ __ _ _ __  ___ _  ___ _ __ | |_ ___
+#    / _ \ '_ \ / _` | '_ \| |/ _ \ | '__/ _` | '_ \/ __| |/ _ \ '_ \| __/ __|
+#   |  __/ | | | (_| | |_) | |  __/ | | | (_| | | | \__ \ |  __/ | | | |_\__ \
+#    \___|_| |_|\__,_|_.__/|_|\___|_|_|  \__,_|_| |_|___/_|\___|_| |_|\__|___/
+#
+#
+# Arm the transient recorder.  It triggers on the PSU going into current
+# limit, or on the output going over volts or amps if they're given.  pre is
+# how many samples to keep from before the trigger.  Once it has triggered
+# and filled up, transient.dump() prints the record and calling this again
+# re-arms it.  Needs the background capture.
+#
+def enableTransients(volts=None, amps=None, pre=None):
+    global transient
+    global RECORD_TRANSIENTS
+
+    if captureDMA is None:
+        print("transient recorder needs the background ADC capture")
+        return
+    import transient
+    if USE_OVERSAMPLING:
+        rate = OVERSAMPLE_RATE_HZ
+    else:
+        rate = CAPTURE_RATE_HZ
+    transient.start(OP_VOLTS_ADC, OP_CURR_ADC, 3 * 1000000 // rate)
+    # thresholds as raw counts, on top of the zero point.
+    zero = (zeroAvg >> RDG_FRAC_BITS) + cal['volts_zero']
+    voltsCounts = None if volts is None else zero + int(volts / VOLTS_PER_ADC_STEP)
+    zero = (zeroAvg >> RDG_FRAC_BITS) + cal['amps_zero']
+    ampsCounts = None if amps is None else zero + int(amps / AMPS_PER_ADC_STEP)
+    if pre is None:
+        pre = transient.RECORD_PAIRS // 4
+    transient.arm(voltsCounts, ampsCounts, pre)
+    RECORD_TRANSIENTS = True
+
+
+############ sendTelemetry ############
+#                       _ _______   _                     _
+#                      | |__   __| | |                   | |
+#    ___  ___ _ __   __| |  | | ___| | ___ _ __ ___   ___| |_ _ __ _   _
+#   / __|/ _ \ '_ \ / _` |  | |/ _ \ |/ _ \ '_ ` _ \ / _ \ __| '__| | | |
+#   \__ \  __/ | | | (_| |  | |  __/ |  __/ | | | | |  __/ |_| |  | |_| |
+#   |___/\___|_| |_|\__,_|  |_|\___|_|\___|_| |_| |_|\___|\__|_|   \__, |
+#                                                                   __/ |
+#                                                                  |___/
+# Record the update that started at ticks in a telemetry frame.
+#
+def sendTelemetry(ticks):
+    if voltsMode:
+        telemetry.record(ticks, telemetry.FLAG_VOLTS_MODE, voltsAvg, currAvg, zeroAvg,
+                         rangeVolts, meterDac, meterPerMille, updateHz)
+    else:
+        telemetry.record(ticks, 0, voltsAvg, currAvg, zeroAvg,
+                         rangeAmps, meterDac, meterPerMille, updateHz)
+
+
+############ adaptRate ############
+#              _             _   _____       _
+#             | |           | | |  __ \     | |
+#     __ _  __| | __ _ _ __ | |_| |__) |__ _| |_ ___
+#    / _` |/ _` |/ _` | '_ \| __|  _  // _` | __/ _ \
+#   | (_| | (_| | (_| | |_) | |_| | \ \ (_| | ||  __/
+#    \__,_|\__,_|\__,_| .__/ \__|_|  \_\__,_|\__\___|
+#                     | |
+#                     |_|
+# Called after each update while the rate is adaptive.  Looks for activity
+# since the last update - the needle moving more than BUSY_PERMILLE, the
+# range lamps changing or the mode switching - and goes to the busy rate
+# when there is some, back to the idle rate BUSY_HOLD_MS after the last.
+#
+def adaptRate():
+    global rateBusyUntil
+    global ratePerMille
+    global rateLamps
+    global rateVoltsMode
+
+    now = utime.ticks_ms()
+    moved = meterPerMille - ratePerMille
+    if (moved > BUSY_PERMILLE or moved < -BUSY_PERMILLE or
+            rangeLamps != rateLamps or voltsMode != rateVoltsMode):
+        rateBusyUntil = utime.ticks_add(now, BUSY_HOLD_MS)
+        if not rateBusy:
+            setUpdateRate(True)
+    elif rateBusy and utime.ticks_diff(now, rateBusyUntil) >= 0:
+        setUpdateRate(False)
+    ratePerMille = meterPerMille
+    rateLamps = rangeLamps
+    rateVoltsMode = voltsMode
+
+
+############ setUpdateRate ############
+#             _   _    _           _       _       _____       _
+#            | | | |  | |         | |     | |     |  __ \     | |
+#    ___  ___| |_| |  | |_ __   __| | __ _| |_ ___| |__) |__ _| |_ ___
+#   / __|/ _ \ __| |  | | '_ \ / _` |/ _` | __/ _ \  _  // _` | __/ _ \
+#   \__ \  __/ |_| |__| | |_) | (_| | (_| | ||  __/ | \ \ (_| | ||  __/
+#   |___/\___|\__|\____/| .__/ \__,_|\__,_|\__\___|_|  \_\__,_|\__\___|
+#                       | |
+#                       |_|
+# Go to the busy or the idle update rate and averaging.  The sampling side
+# picks up the new averaging when it next starts a block.
+#
+def setUpdateRate(busy):
+    global rateBusy
+    global updateHz
+    global oversampleBias
+    global rdgWindowWanted
+    global rateChanges
+
+    rateBusy = busy
+    if busy:
+        updateHz = BUSY_UPDATE_HZ
+        oversampleBias = BUSY_OVERSAMPLE_BIAS
+        rdgWindowWanted = BUSY_WINDOW_SHIFT
+    else:
+        updateHz = IDLE_UPDATE_HZ
+        oversampleBias = IDLE_OVERSAMPLE_BIAS
+        rdgWindowWanted = RDG_WINDOW_SHIFT
+    rateChanges += 1
+    if tickTimerRunning:
+        meterUpdateTim.init(freq=updateHz, mode=Timer.PERIODIC, callback=meterUpdateTick)
+
+
+############ rateWake ############
+#              _    __          __   _
+#             | |   \ \        / /  | |
+#    _ __ __ _| |_ __\ \  /\  / /_ _| | _____
+#   | '__/ _` | __/ _ \ \/  \/ / _` | |/ / _ \
+#   | | | (_| | ||  __/\  /\  / (_| |   <  __/
+#   |_|  \__,_|\__\___| \/  \/ \__,_|_|\_\___|
+#
+#
+# Go to the busy rate now, not at the next idle update, when the current
+# limit input changes.  Scheduled by ilimIrq on the first edge of a burst -
+# restarting the timer isn't a job for a hard interrupt.  The restart brings
+# the next update in one busy period, by when ilimTask has switched the mode.
+#
+def rateWake(arg):
+    global rateBusyUntil
+
+    rateBusyUntil = utime.ticks_add(utime.ticks_ms(), BUSY_HOLD_MS)
+    if not rateBusy:
+        setUpdateRate(True)
+
+
+############ ilimIrq ############
+#    _ _ _           _____
+#   (_) (_)         |_   _|
+#    _| |_ _ __ ___   | |  _ __ __ _
+#   | | | | '_ ` _ \  | | | '__/ _` |
+#   | | | | | | | | |_| |_| | | (_| |
+#   |_|_|_|_| |_| |_|_____|_|  \__, |
+#                                 | |
+#                                 |_|
+# Interrupt handler for either edge on the current limit input.  Notes when
+# the first edge of a burst came in, for the latency figures, and wakes
+# ilimTask to debounce it and switch the panel over.  While the rate is idle
+# the first edge also schedules rateWake.
+#
+def ilimIrq(pin):
+    global ilimEdgeTicks
+    global ilimPending
+
+    if not ilimPending:
+        ilimEdgeTicks = utime.ticks_us()
+        ilimPending = True
+        if adaptiveRate and not rateBusy:
+            micropython.schedule(rateWake, None)
+    ilimFlag.set()
+
+
+############ switchMode ############
+#                 _ _       _     __  __           _
+#                (_) |     | |   |  \/  |         | |
+#    _____      ___| |_ ___| |__ | \  / | ___   __| | ___
+#   / __\ \ /\ / / | __/ __| '_ \| |\/| |/ _ \ / _` |/ _ \
+#   \__ \\ V  V /| | || (__| | | | |  | | (_) | (_| |  __/
+#   |___/ \_/\_/ |_|\__\___|_| |_|_|  |_|\___/ \__,_|\___|
+#
+#
+# Switch the display between volts and amps straight away, when ilimTask
+# has seen the current limit input change.  The range of the new mode was
+# put back to the top one by calcModeAndRange while the other mode was
+# showing, so the needle is shown on that until the next update ranges it
+# down - the last readings are from before the change and can't be trusted
+# to pick a range.  edge is the ticks_us() of the interrupt that started
+# it, so a transient record triggers from the edge rather than from now.
+#
+def switchMode(vMode, edge):
+    global voltsMode
+    global rangeLamps
+    global meterPerMille
+
+    if RECORD_TRANSIENTS and voltsMode and not vMode:
+        transient.trigger(edge)
+    voltsMode = vMode
+    if vMode:
+        meterRange = VOLTS_RANGE_RDGS[rangeVolts]
+        reading = voltsRdg
+    else:
+        meterRange = AMPS_RANGE_RDGS[rangeAmps]
+        reading = currRdg
+    rangeLamps = meterRange[RANGE_LAMP]
+    meterPerMille = reading * 1000 // meterRange[RANGE_FULL_SCALE]
+    refreshPanel()
+    refreshMeter()
+
+
+############ reportIlim ############
+#                              _   _____ _ _
+#                             | | |_   _| (_)
+#    _ __ ___ _ __   ___  _ __| |_  | | | |_ _ __ ___
+#   | '__/ _ \ '_ \ / _ \| '__| __| | | | | | '_ ` _ \
+#   | | |  __/ |_) | (_) | |  | |_ _| |_| | | | | | | |
+#   |_|  \___| .__/ \___/|_|   \__|_____|_|_|_| |_| |_|
+#            | |
+#            |_|
+# Print how long the panel took to change mode after the current limit
+# input changed, in microseconds.  Includes the debounce time.
+#
+def reportIlim():
+    if ilimStats[ILIM_EVENTS] == 0:
+        print("no current limit changes seen")
+        return
+    print("current limit changes: %d  last %dus  min %dus  max %dus" %
+          (ilimStats[ILIM_EVENTS], ilimStats[ILIM_LAST], ilimStats[ILIM_MIN],
+           ilimStats[ILIM_MAX]))
+
+
+############ reportStartup ############
+#                              _    _____ _             _
+#                             | |  / ____| |           | |
+#    _ __ ___ _ __   ___  _ __| |_| (___ | |_ __ _ _ __| |_ _   _ _ __
+#   | '__/ _ \ '_ \ / _ \| '__| __|\___ \| __/ _` | '__| __| | | | '_ \
+#   | | |  __/ |_) | (_) | |  | |_ ____) | || (_| | |  | |_| |_| | |_) |
+#   |_|  \___| .__/ \___/|_|   \__|_____/ \__\__,_|_|   \__|\__,_| .__/
+#            | |                                                 | |
+#            |_|                                                 |_|
+# Print how long the meter took to come up after the pico was reset, in ms:
+#   run   - this file starting to run, so the firmware boot plus compiling
+#           this file (nothing to compile when it's a .mpy)
+#   setup - the imports and the module setup below done
+#   lamps - the lamp test finished
+#   rdg   - the first reading on the meter
+# A 0 is a stage that hasn't been reached yet.
+#
+def reportStartup():
+    print("startup from %s: run %dms  setup %dms  lamps %dms  first reading %dms" %
+          (__file__, startupMs[STARTUP_RUN], startupMs[STARTUP_SETUP],
+           startupMs[STARTUP_LAMPS], startupMs[STARTUP_RDG]))
+
+
+############ logStartup ############
+#    _              _____ _             _
+#   | |            / ____| |           | |
+#   | | ___   __ _| (___ | |_ __ _ _ __| |_ _   _ _ __
+#   | |/ _ \ / _` |\___ \| __/ _` | '__| __| | | | '_ \
+#   | | (_) | (_| |____) | || (_| | |  | |_| |_| | |_) |
+#   |_|\___/ \__, |_____/ \__\__,_|_|   \__|\__,_| .__/
+#             __/ |                              | |
+#            |___/                               |_|
+# Add this boot's startup times to the end of STARTUP_LOG, one line of
+# file name, run, setup, lamps and first reading ms.  Once it holds
+# STARTUP_LOG_LINES the oldest lines are dropped, so it can't creep up on
+# the flash boot after boot.  Only done once, and a full flash isn't worth
+# stopping the meter for.
+#
+def logStartup():
+    global startupLogged
+
+    startupLogged = True
+    line = "%s %d %d %d %d\n" % (__file__, startupMs[STARTUP_RUN], startupMs[STARTUP_SETUP],
+                                 startupMs[STARTUP_LAMPS], startupMs[STARTUP_RDG])
+    try:
+        try:
+            with open(STARTUP_LOG) as f:
+                lines = f.readlines()
+        except OSError:
+            lines = []
+        if len(lines) < STARTUP_LOG_LINES:
+            with open(STARTUP_LOG, 'a') as f:
+                f.write(line)
+        else:
+            lines.append(line)
+            with open(STARTUP_LOG, 'w') as f:
+                for line in lines[len(lines) - STARTUP_LOG_LINES:]:
+                    f.write(line)
+    except OSError:
+        pass
 
 
 #
@@ -151,119 +652,111 @@ def meterUpdateTick(timer):
 #   |___/_| |_|\___/ \_/\_/ |_|  \_\__,_|_| |_|\__, |\___|
 #                                               __/ |     
 #                                              |___/      
-# Light one or more range LEDs according to the bit pattern given. 
+# Light one or more range LEDs according to the bit pattern given, leaving
+# the mode flags as they are.
 #
 def showRange(pattern):
-    global pin100m 
-    global pin250m
-    global pin500m
-    global pin1v
-    global pin2v5
-    global pin5v
-    global pin10v
-    global pin25v
-    global pin50v
-    
-    if (pattern & 0x001 == 0):
-        pin100m.low()
-    else:
-        pin100m.high()
-        
-    if (pattern & 0x002 == 0):
-        pin250m.low()
-    else:
-        pin250m.high()
-        
-    if (pattern & 0x004 == 0):
-        pin500m.low()
-    else:
-        pin500m.high()
-        
-    if (pattern & 0x008 == 0):
-        pin1v.low()
-    else:
-        pin1v.high()
-        
-    if (pattern & 0x010 == 0):
-        pin2v5.low()
-    else:
-        pin2v5.high()
-        
-    if (pattern & 0x020 == 0):
-        pin5v.low()
-    else:
-        pin5v.high()
-        
-    if (pattern & 0x040 == 0):
-        pin10v.low()
-    else:
-        pin10v.high()
-        
-    if (pattern & 0x080 == 0):
-        pin25v.low()
-    else:
-        pin25v.high()
-        
-    if (pattern & 0x100 == 0):
-        pin50v.low()
-    else:
-        pin50v.high()
-
-#
-############ driveMeterDAC ############
-#        _      _           __  __      _            _____          _____ 
-#       | |    (_)         |  \/  |    | |          |  __ \   /\   / ____|
-#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| |  | | /  \ | |     
-#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |  | |/ /\ \| |     
-#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | |__| / ____ \ |____ 
-#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_____/_/    \_\_____|
-#                                                                         
-#                                                                         
-# Send a binary number out to the R-2R Digital to Analogue Converter which will
-# drive the meter pointer to the required position. The value is masked to write
-# out the drive value bit by bit. 
-# 
-def driveMeterDAC(dacValue=0):   
-    if (dacValue & 0x01 == 0):
-        bit0.low()
-    else:
-        bit0.high()
+    if PROFILE_TICKS:
+        start = utime.ticks_us()
 
-    if (dacValue & 0x02 == 0):
-        bit1.low()
-    else:
-        bit1.high()
+    writePanel((panelShadow & ~PANEL_LAMPS_MASK) | (pattern << PANEL_LAMPS_SHIFT))
 
-    if (dacValue & 0x04 == 0):
-        bit2.low()
-    else:
-        bit2.high()
+    if PROFILE_TICKS:
+        tickprof.record(tickprof.STAGE_LAMPS, start)
 
-    if (dacValue & 0x08 == 0):
-        bit3.low()
-    else:
-        bit3.high()
 
-    if (dacValue & 0x10 == 0):
-        bit4.low()
-    else:
-        bit4.high()
+############ writePanel ############
+#                  _ _       _____                 _
+#                 (_) |     |  __ \               | |
+#   __      ___ __ _| |_ ___| |__) |_ _ _ __   ___| |
+#   \ \ /\ / / '__| | __/ _ \  ___/ _` | '_ \ / _ \ |
+#    \ V  V /| |  | | ||  __/ |  | (_| | | | |  __/ |
+#     \_/\_/ |_|  |_|\__\___|_|   \__,_|_| |_|\___|_|
+#
+#
+# Set the front panel outputs - the range lamps on GPIO10-18 and the mode
+# flags on GPIO20 and 22 - to bits, laid out as in GPIO_OUT.  panelShadow
+# holds what they were last set to, so only the bits that differ are
+# written, all in one go with GPIO_OUT_XOR, and nothing at all is written
+# when the panel hasn't changed.  No lamp is ever seen half way through a
+# range change.  The XOR is worked out against the live GPIO_OUT, as
+# driveMeterDACPort does, so a shadow that's out of step with the pins is
+# put right by the next change rather than inverting them for good.
+#
+def writePanel(bits):
+    global panelShadow
 
-    if (dacValue & 0x20 == 0):
-        bit5.low()
+    changed = (bits ^ panelShadow) & PANEL_MASK
+    if not changed:
+        return
+    panelShadow ^= changed
+    if lampsSm is not None:
+        # the lamps belong to the state machine, only the flags are left.
+        if changed & PANEL_LAMPS_MASK:
+            lampsSm.put((bits & PANEL_LAMPS_MASK) >> PANEL_LAMPS_SHIFT)
+        changed &= ~PANEL_LAMPS_MASK
+    if USE_PORT_WRITES:
+        mem32[SIO_GPIO_OUT_XOR] = (mem32[SIO_GPIO_OUT] ^ bits) & changed
     else:
-        bit5.high()
+        for mask, pin in panelPins:
+            if changed & mask:
+                pin.value(bits & mask)
+
+
+############ driveMeterDACPio ############
+#        _      _           __  __      _            _____          _____ _____ _
+#       | |    (_)         |  \/  |    | |          |  __ \   /\   / ____|  __ (_)
+#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| |  | | /  \ | |    | |__) |  ___
+#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |  | |/ /\ \| |    |  ___/ |/ _ \
+#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | |__| / ____ \ |____| |   | | (_) |
+#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_____/_/    \_\_____|_|   |_|\___/
+#
+#
+# With USE_PIO_OUTPUTS the DAC pins belong to a state machine that puts each
+# word from its FIFO straight out on GPIO0-7 in one instruction.
+#
+def driveMeterDACPio(dacValue=0):
+    dacSm.put(dacValue)
+
+
+############ initPioOutputs ############
+#    _       _ _   _____ _        ____        _               _
+#   (_)     (_) | |  __ (_)      / __ \      | |             | |
+#    _ _ __  _| |_| |__) |  ___ | |  | |_   _| |_ _ __  _   _| |_ ___
+#   | | '_ \| | __|  ___/ |/ _ \| |  | | | | | __| '_ \| | | | __/ __|
+#   | | | | | | |_| |   | | (_) | |__| | |_| | |_| |_) | |_| | |_\__ \
+#   |_|_| |_|_|\__|_|   |_|\___/ \____/ \__,_|\__| .__/ \__,_|\__|___/
+#                                                | |
+#                                                |_|
+# Set up the two state machines for USE_PIO_OUTPUTS: one owning the DAC
+# pins, one the range lamp pins.  Both run the same two instruction program,
+# wait for a word then copy it to the pins, and start off from what the pins
+# are showing now.  Returns the two, or None for each if there's no PIO.
+#
+def initPioOutputs():
+    try:
+        import rp2
+    except ImportError:
+        return None, None
+
+    @rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW,) * 8, out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+    def dacOut():
+        pull()
+        out(pins, 8)
+
+    @rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW,) * 9, out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+    def lampsOut():
+        pull()
+        out(pins, 9)
+
+    dacSm = rp2.StateMachine(PIO_DAC_SM, dacOut, out_base=bit0)
+    lampsSm = rp2.StateMachine(PIO_LAMPS_SM, lampsOut, out_base=pin100m)
+    dacSm.put(meterDac)
+    lampsSm.put((panelShadow & PANEL_LAMPS_MASK) >> PANEL_LAMPS_SHIFT)
+    dacSm.active(1)
+    lampsSm.active(1)
+    return dacSm, lampsSm
 
-    if (dacValue & 0x40 == 0):
-        bit6.low()
-    else:
-        bit6.high()
-                                
-    if (dacValue & 0x80 == 0):
-        bit7.low()
-    else:
-        bit7.high()
-                                
 
 ############# lampTest ############
 #    _                    _______        _   
@@ -287,6 +780,62 @@ def lampTest():
     utime.sleep(0.5)
 
 
+############ buildMeterTable ############
+#    _           _ _     _ __  __      _         _______    _     _
+#   | |         (_) |   | |  \/  |    | |       |__   __|  | |   | |
+#   | |__  _   _ _| | __| | \  / | ___| |_ ___ _ __| | __ _| |__ | | ___
+#   | '_ \| | | | | |/ _` | |\/| |/ _ \ __/ _ \ '__| |/ _` | '_ \| |/ _ \
+#   | |_) | |_| | | | (_| | |  | |  __/ ||  __/ |  | | (_| | |_) | |  __/
+#   |_.__/ \__,_|_|_|\__,_|_|  |_|\___|\__\___|_|  |_|\__,_|_.__/|_|\___|
+#
+#
+# Expand the graticule calibration points into a table giving the DAC count
+# for every tenth of a percent of Full Scale Deflection, interpolating
+# linearly between graticules.  Done once at startup so that positioning the
+# needle is just an index into the table.
+# The graticule counts must never go down as the percentage goes up, or the
+# needle would move backwards - refuse to build a table from them if they do.
+#
+def buildMeterTable(graticule):
+    if len(graticule) != METER_GRATICULES:
+        raise ValueError("meter calibration needs %d graticules" % METER_GRATICULES)
+    for g in range(1, METER_GRATICULES):
+        if graticule[g] < graticule[g - 1]:
+            raise ValueError("meter calibration not monotonic at %d%%" % (g * 4))
+
+    table = bytearray(METER_MAX_PERMILLE + 1)
+    for perMille in range(METER_MAX_PERMILLE):
+        g = perMille // GRATICULE_PERMILLE
+        lower = graticule[g]
+        table[perMille] = lower + ((graticule[g + 1] - lower) *
+                                   (perMille - g * GRATICULE_PERMILLE)) // GRATICULE_PERMILLE
+    table[METER_MAX_PERMILLE] = graticule[-1]
+    return table
+
+
+############ buildMeterFracTable ############
+#    _           _ _     _ __  __      _            ______           _______    _     _
+#   | |         (_) |   | |  \/  |    | |          |  ____|         |__   __|  | |   | |
+#   | |__  _   _ _| | __| | \  / | ___| |_ ___ _ __| |__ _ __ __ _  ___| | __ _| |__ | | ___
+#   | '_ \| | | | | |/ _` | |\/| |/ _ \ __/ _ \ '__|  __| '__/ _` |/ __| |/ _` | '_ \| |/ _ \
+#   | |_) | |_| | | | (_| | |  | |  __/ ||  __/ |  | |  | | | (_| | (__| | (_| | |_) | |  __/
+#   |_.__/ \__,_|_|_|\__,_|_|  |_|\___|\__\___|_|  |_|  |_|  \__,_|\___|_|\__,_|_.__/|_|\___|
+#
+#
+# The same table with DITHER_FRAC_BITS of fraction on each DAC count, for
+# dithering.  The whole number part is the same as in buildMeterTable's.
+#
+def buildMeterFracTable(graticule):
+    table = array.array('H', [0] * (METER_MAX_PERMILLE + 1))
+    for perMille in range(METER_MAX_PERMILLE):
+        g = perMille // GRATICULE_PERMILLE
+        lower = graticule[g] << DITHER_FRAC_BITS
+        table[perMille] = lower + (((graticule[g + 1] << DITHER_FRAC_BITS) - lower) *
+                                   (perMille - g * GRATICULE_PERMILLE)) // GRATICULE_PERMILLE
+    table[METER_MAX_PERMILLE] = graticule[-1] << DITHER_FRAC_BITS
+    return table
+
+
 #
 ############# driveMeterToPercentFS #############
 #        _      _           __  __      _         _______    _____                        _   ______ _____ 
@@ -301,131 +850,202 @@ def lampTest():
 # calculate the DAC count that the meter should be driven with. 
 # 
 def driveMeterToPercentFS(pcVal):
+    driveMeterToPerMilleFS(int(pcVal * 10))
+
+
+############ driveMeterToPerMilleFS ############
+#        _      _           __  __      _         _______    _____          __  __ _ _ _      ______ _____
+#       | |    (_)         |  \/  |    | |       |__   __|  |  __ \        |  \/  (_) | |    |  ____/ ____|
+#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| | ___ | |__) |__ _ __| \  / |_| | | ___| |__ | (___
+#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |/ _ \|  ___/ _ \ '__| |\/| | | | |/ _ \  __| \___ \
+#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | | (_) | |  |  __/ |  | |  | | | | |  __/ |    ____) |
+#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_|\___/|_|   \___|_|  |_|  |_|_|_|_|\___|_|   |_____/
+#
+#
+# The same in tenths of a percent, which is what the meter table is indexed
+# by, so this is all integer arithmetic.
+#
+def driveMeterToPerMilleFS(perMille):
+    if PROFILE_TICKS:
+        start = utime.ticks_us()
+
+    # needle is never driven beyond 4% past the last graticule.
+    if perMille > METER_MAX_PERMILLE:
+        perMille = METER_MAX_PERMILLE
+    elif perMille < 0:
+        perMille = 0
+
+    # with the ballistics running the needle timer takes it from here.
+    if needleMoving:
+        ballistics.moveTo(perMille)
+    else:
+        positionNeedle(perMille)
+
+    if PROFILE_TICKS:
+        tickprof.record(tickprof.STAGE_METER, start)
+
+
+############ positionNeedle ############
+#                    _ _   _             _   _               _ _
+#                   (_) | (_)           | \ | |             | | |
+#    _ __   ___  ___ _| |_ _  ___  _ __ |  \| | ___  ___  __| | | ___
+#   | '_ \ / _ \/ __| | __| |/ _ \| '_ \| . ` |/ _ \/ _ \/ _` | |/ _ \
+#   | |_) | (_) \__ \ | |_| | (_) | | | | |\  |  __/  __/ (_| | |  __/
+#   | .__/ \___/|___/_|\__|_|\___/|_| |_|_| \_|\___|\___|\__,_|_|\___|
+#   | |
+#   |_|
+# Put the needle at once where it should be for perMille, which must already
+# be in range.  Called by the needle ballistics from the needle timer, so it
+# mustn't allocate.  When dithering, the needle timer does the DAC writes.
+#
+def positionNeedle(perMille):
+    global meterDac
+    global needlePerMille
+    global needleDacFrac
+
+    needlePerMille = perMille
+    meterDac = meterTable[perMille]
+    if needleDithering:
+        needleDacFrac = meterFracTable[perMille]
+    else:
+        # and finally, send the drive value to the Digital to Analogue Converter...
+        driveMeterDAC(meterDac)
+
+
+############ needleTick ############
+#                        _ _   _______ _      _
+#                       | | | |__   __(_)    | |
+#    _ __   ___  ___  __| | | ___| |   _  ___| | __
+#   | '_ \ / _ \/ _ \/ _` | |/ _ \ |  | |/ __| |/ /
+#   | | | |  __/  __/ (_| | |  __/ |  | | (__|   <
+#   |_| |_|\___|\___|\__,_|_|\___|_|  |_|\___|_|\_\
+#
+#
+# Needle timer callback.  Steps the ballistics, then dithers the DAC: the
+# fraction of the code is added up each tick and the code goes up by one
+# for the tick whenever the sum carries, so over time the DAC spends that
+# fraction of the ticks on the code above - a first order sigma-delta.
+# Runs in interrupt context and mustn't allocate.
+#
+def needleTick(timer):
+    global ditherAcc
+
+    if needleMoving:
+        ballistics.step()
+    if needleDithering:
+        acc = ditherAcc + (needleDacFrac & DITHER_FRAC_MASK)
+        code = needleDacFrac >> DITHER_FRAC_BITS
+        if acc > DITHER_FRAC_MASK:
+            acc -= DITHER_FRAC_MASK + 1
+            code += 1
+        ditherAcc = acc
+        driveMeterDAC(code)
+
+
+############ startNeedle ############
+#        _             _   _   _               _ _
+#       | |           | | | \ | |             | | |
+#    ___| |_ __ _ _ __| |_|  \| | ___  ___  __| | | ___
+#   / __| __/ _` | '__| __| . ` |/ _ \/ _ \/ _` | |/ _ \
+#   \__ \ || (_| | |  | |_| |\  |  __/  __/ (_| | |  __/
+#   |___/\__\__,_|_|   \__|_| \_|\___|\___|\__,_|_|\___|
+#
+#
+# Start the needle timer, moving the needle with the ballistics from the
+# calibration file if they're on, and dithering it if USE_DITHER.  It starts
+# off from wherever it was last put.
+#
+def startNeedle():
+    global needleRunning
+    global needleMoving
+    global needleDithering
+    global needleDacFrac
+    global needleLamps
+
+    settings = cal['ballistics']
+    needleMoving = USE_BALLISTICS
+    if needleMoving:
+        ballistics.configure(settings, positionNeedle, METER_MAX_PERMILLE)
+        ballistics.place(needlePerMille)
+        needleLamps = rangeLamps
+    needleDacFrac = meterFracTable[needlePerMille]
+    needleDithering = USE_DITHER
+    needleRunning = True
+    freq = settings['rate_hz'] if needleMoving else DITHER_HZ
+    needleTim.init(freq=freq, mode=Timer.PERIODIC, callback=needleTick)
+
+
+############ stopNeedle ############
+#        _              _   _               _ _
+#       | |            | \ | |             | | |
+#    ___| |_ ___  _ __ |  \| | ___  ___  __| | | ___
+#   / __| __/ _ \| '_ \| . ` |/ _ \/ _ \/ _` | |/ _ \
+#   \__ \ || (_) | |_) | |\  |  __/  __/ (_| | |  __/
+#   |___/\__\___/| .__/|_| \_|\___|\___|\__,_|_|\___|
+#                | |
+#                |_|
+# Stop the needle timer and go back to putting the needle straight on each
+# reading.  It's left where it had got to.
+#
+def stopNeedle():
+    global needleRunning
+    global needleMoving
+    global needleDithering
+
+    needleTim.deinit()
+    needleRunning = False
+    needleMoving = False
+    needleDithering = False
+    driveMeterDAC(meterDac)
+
+
+############ buildRangeRdgs ############
+#    _           _ _     _ _____                        _____     _
+#   | |         (_) |   | |  __ \                      |  __ \   | |
+#   | |__  _   _ _| | __| | |__) |__ _ _ __   __ _  ___| |__) |__| | __ _ ___
+#   | '_ \| | | | | |/ _` |  _  // _` | '_ \ / _` |/ _ \  _  // _` |/ _` / __|
+#   | |_) | |_| | | | (_| | | \ \ (_| | | | | (_| |  __/ | \ \ (_| | (_| \__ \
+#   |_.__/ \__,_|_|_|\__,_|_|  \_\__,_|_| |_|\__, |\___|_|  \_\__,_|\__, |___/
+#                                             __/ |                  __/ |
+#                                            |___/                  |___/
+# Convert a table of ranges in volts or amps into the same table in
+# readings, so that the update doesn't need any floating point maths.
+#
+def buildRangeRdgs(ranges, unitsPerRdg):
+    table = []
+    for meterRange in ranges:
+        table.append((int(meterRange[RANGE_FULL_SCALE] / unitsPerRdg + 0.5),
+                      int(meterRange[RANGE_UP_LIM] / unitsPerRdg + 0.5),
+                      int(meterRange[RANGE_DOWN_LIM] / unitsPerRdg + 0.5),
+                      meterRange[RANGE_LAMP],
+                      meterRange[RANGE_OVERSAMPLE]))
+    return tuple(table)
+
+
+############ nextRange ############
+#                    _   _____
+#                   | | |  __ \
+#    _ __   _____  _| |_| |__) |__ _ _ __   __ _  ___
+#   | '_ \ / _ \ \/ / __|  _  // _` | '_ \ / _` |/ _ \
+#   | | | |  __/>  <| |_| | \ \ (_| | | | | (_| |  __/
+#   |_| |_|\___/_/\_\\__|_|  \_\__,_|_| |_|\__, |\___|
+#                                           __/ |
+#                                          |___/
+# Given the index of the current range in a range table and the latest
+# reading, return the index of the range that should be displayed.
+# Readings above the up limit move to the range above and readings below the
+# down limit move to the range below.  It keeps going until the reading fits,
+# so a step from 0V to 40V lands on the 50V range in a single tick rather than
+# climbing one range per tick.
+#
+def nextRange(ranges, rangeIdx, reading):
+    topIdx = len(ranges) - 1
+    while rangeIdx < topIdx and reading > ranges[rangeIdx][RANGE_UP_LIM]:
+        rangeIdx += 1
+    while rangeIdx > 0 and reading < ranges[rangeIdx][RANGE_DOWN_LIM]:
+        rangeIdx -= 1
+    return rangeIdx
 
-    ###########  METER CALIBRATION VALUES ##########
-    # The meter has 25 graticules, so each represents 4% of Full Scale
-    # Deflection.  Below this comment is a list of DAC counts to drive the
-    # indicator to each graticule because the system is not really linear.
-    # Calibration used a test program to read an ADC input driven from a
-    # potentiometer and print out the ADC count while the needle was moved to
-    # each graticule position using the potentiometer.  
-    pc0 = 31
-    pc4 = 51
-    pc8 = 57
-    pc12 = 63
-    pc16 = 70
-    pc20 = 78
-    pc24 = 85
-    pc28 = 91
-    pc32 = 96
-    pc36 = 102
-    pc40 = 109
-    pc44 = 115
-    pc48 = 121
-    pc52 = 126
-    pc56 = 131
-    pc60 = 137
-    pc64 = 143
-    pc68 = 148
-    pc72 = 153
-    pc76 = 158
-    pc80 = 164
-    pc84 = 170
-    pc88 = 174
-    pc92 = 179
-    pc96 = 184
-    pc100 = 192
-    pc104 = 197
-    
-    pcVal = pcVal / 100 # because this evolved using per-unit values. 
-    # needle is never driven beyond 4% past the last graticule. 
-    if pcVal > 1.04:
-        pcVal = 1.04
-        drive = pc104
-    elif pcVal >= 1.0:
-        pr = (pcVal - 1.0) / (1.04-1.0)
-        drive = pc100 + int(pr*(pc104-pc100))
-    elif pcVal >= 0.96:
-        pr = (pcVal - 0.96) / (1.0 - 0.96)
-        drive = pc96 + int(pr*(pc100-pc96))
-    elif pcVal >= 0.92:
-        pr = (pcVal - 0.92) / (0.96 - 0.92)
-        drive = pc92 + int(pr*(pc96-pc92))
-    elif pcVal >= 0.88:
-        pr = (pcVal - 0.88) / (0.92 - 0.88)
-        drive = pc88 + int(pr*(pc92-pc88))
-    elif pcVal >= 0.84:
-        pr = (pcVal - 0.84) / (0.88 - 0.84)
-        drive = pc84 + int(pr*(pc88-pc84))
-    elif pcVal >= 0.80:
-        pr = (pcVal - 0.80) / (0.84 - 0.80)
-        drive = pc80 + int(pr*(pc84-pc80))
-    elif pcVal >= 0.76:
-        pr = (pcVal - 0.76) / (0.80 - 0.76)
-        drive = pc76 + int(pr*(pc80-pc76))
-    elif pcVal >= 0.72:
-        pr = (pcVal - 0.72) / (0.80 - 0.76)
-        drive = pc72 + int(pr*(pc76-pc72))
-    elif pcVal >= 0.68:
-        pr = (pcVal - 0.68) / (0.72 - 0.68)
-        drive = pc68 + int(pr*(pc72-pc68))
-    elif pcVal >= 0.64:
-        pr = (pcVal - 0.64) / (0.68 - 0.64)
-        drive = pc64 + int(pr*(pc68-pc64))
-    elif pcVal >= 0.60:
-        pr = (pcVal - 0.60) / (0.64 - 0.60)
-        drive = pc60 + int(pr*(pc64-pc60))
-    elif pcVal >= 0.56:
-        pr = (pcVal - 0.56) / (0.60 - 0.56)
-        drive = pc56 + int(pr*(pc60-pc56))
-    elif pcVal >= 0.52:
-        pr = (pcVal - 0.52) / (0.56 - 0.52)
-        drive = pc52 + int(pr*(pc56-pc52))
-    elif pcVal >= 0.48:
-        pr = (pcVal - 0.48) / (0.52 - 0.48)
-        drive = pc48 + int(pr*(pc52-pc48))
-    elif pcVal >= 0.44:
-        pr = (pcVal - 0.44) / (0.48 - 0.44)
-        drive = pc44 + int(pr*(pc48-pc44))
-    elif pcVal >= 0.40:
-        pr = (pcVal - 0.40) / (0.44 - 0.40)
-        drive = pc40 + int(pr*(pc44-pc40))
-    elif pcVal >= 0.36:
-        pr = (pcVal - 0.36) / (0.40 - 0.36)
-        drive = pc36 + int(pr*(pc40-pc36))
-    elif pcVal >= 0.32:
-        pr = (pcVal - 0.32) / (0.36 - 0.32)
-        drive = pc32 + int(pr*(pc36-pc32))
-    elif pcVal >= 0.28:
-        pr = (pcVal - 0.28) / (0.32 - 0.28)
-        drive = pc28 + int(pr*(pc32-pc28))
-    elif pcVal >= 0.24:
-        pr = (pcVal - 0.24) / (0.28 - 0.24)
-        drive = pc24 + int(pr*(pc28-pc24))
-    elif pcVal >= 0.20:
-        pr = (pcVal - 0.20) / (0.24 - 0.20)
-        drive = pc20 + int(pr*(pc24-pc20))
-    elif pcVal >= 0.16:
-        pr = (pcVal - 0.16) / (0.20 - 0.16)
-        drive = pc16 + int(pr*(pc20-pc16))
-    elif pcVal >= 0.12:
-        pr = (pcVal - 0.12) / (0.16 - 0.12)
-        drive = pc12 + int(pr*(pc16-pc12))
-    elif pcVal >= 0.08:
-        pr = (pcVal - 0.08) / (0.12 - 0.08)
-        drive = pc8 + int(pr*(pc12-pc8))
-    elif pcVal >= 0.04:
-        pr = (pcVal - 0.04) / (0.08 - 0.04)
-        drive = pc4 + int(pr*(pc8-pc4))
-    else : # between 0.00 and 0.04
-        pr = pcVal / 0.04
-        drive = pc0 + int(pr*(pc4-pc0))
-     
-    # and finally, send the drive value to the Digital to Analogue Converter...
-    driveMeterDAC(drive) 
-        
-#    print ("%drive: ", drive)
-    
 
 ############# calcModeAndRange ############
 #            _      __  __           _                         _ _____                        
@@ -439,275 +1059,823 @@ def driveMeterToPercentFS(pcVal):
 # Determine whether we should be displaying Voltage or current and calculate a
 # suitable display range for the value being measured. 
 # 
-# Hysteresis is applied when changing down through ranges via the limit definitions. 
+# The range limits live in VOLTS_RANGES and AMPS_RANGES, see nextRange.
+# Readings and limits are both in ADC counts with RDG_FRAC_BITS of fraction.
+# The results are left in voltsMode, rangeLamps and meterPerMille (tenths of
+# a percent of full scale) for refreshPanel and refreshMeter to display.
 def calcModeAndRange(Volts, Curr):
-    RANGE_50   = 50
-    RANGE_25   = 25
-    RANGE_10   = 10
-    RANGE_5    = 5
-    RANGE_2P5  = 2.5
-    RANGE_1    = 1
-    RANGE_500m = 0.5
-    RANGE_250m = 0.25
-    RANGE_100m = 0.1
-
-    # Defines limits of voltage and current for each range. 
-    RANGE_50_LOW_LIM = 20.0
-    RANGE_25_HIGH_LIM = 25.0
-    RANGE_25_LOW_LIM = 8.0
-    RANGE_10_HIGH_LIM = 10.0
-    RANGE_10_LOW_LIM = 4.0
-    RANGE_5_HIGH_LIM = 5.0
-    RANGE_5_LOW_LIM = 2.0
-    RANGE_2P5_HIGH_LIM = 2.5
-    RANGE_2P5_LOW_LIM = 0.8
-    RANGE_1_HIGH_LIM = 1.0
-    RANGE_1_LOW_LIM = 0.4
-    RANGE_500m_HIGH_LIM = 0.5
-    RANGE_500m_LOW_LIM = 0.2
-    RANGE_250m_HIGH_LIM = 0.25
-    RANGE_250m_LOW_LIM = 0.08
-    RANGE_100m_HIGH_LIM = 0.1
-
     global rangeVolts
     global rangeAmps
+    global voltsMode
+    global rangeLamps
+    global meterPerMille
+
+    if PROFILE_TICKS:
+        start = utime.ticks_us()
     
-    # Read pinILim to determine whether displaying volts or amps
-    vMode = pinILim.value()
+    # Read pinILim to determine whether displaying volts or amps, or take
+    # the debounced level from ilimTask when the interrupt is watching it.
+    if ilimFlag is None:
+        vMode = pinILim.value()
+    else:
+        vMode = ilimLevel
     #print ("vMode: ", vMode)
-
+    if RECORD_TRANSIENTS and voltsMode and not vMode:
+        transient.trigger()
+    voltsMode = vMode
 
     if vMode == True:
         # voltage scales
-        PinVoltsFlag.value(1)
-        PinIlimFlag.value(0)
-        
-        if rangeVolts == RANGE_50:
-            # there is no higher voltage range. 
-            if Volts < RANGE_50_LOW_LIM:
-                rangeVolts = RANGE_25
-                showRange(RANGE_INDICATOR_LAMP_25)
-        elif rangeVolts == RANGE_25:
-            if Volts > RANGE_25_HIGH_LIM:
-                rangeVolts = RANGE_50
-                showRange(RANGE_INDICATOR_LAMP_50)
-            elif Volts < RANGE_25_LOW_LIM:
-                rangeVolts = RANGE_10
-                showRange(RANGE_INDICATOR_LAMP_10)
-        elif rangeVolts == RANGE_10:
-            if Volts > RANGE_10_HIGH_LIM:
-                rangeVolts = RANGE_25
-                showRange(RANGE_INDICATOR_LAMP_25)
-            elif Volts < RANGE_10_LOW_LIM:
-                rangeVolts = RANGE_5
-                showRange(RANGE_INDICATOR_LAMP_5)
-        elif rangeVolts == RANGE_5:
-            if Volts > RANGE_5_HIGH_LIM:
-                rangeVolts = RANGE_10
-                showRange(RANGE_INDICATOR_LAMP_10)
-            elif Volts < RANGE_5_LOW_LIM:
-                rangeVolts = RANGE_2P5
-                showRange(RANGE_INDICATOR_LAMP_2P5)
-        elif rangeVolts == RANGE_2P5:
-            if Volts > RANGE_2P5_HIGH_LIM:
-                rangeVolts = RANGE_5
-                showRange(RANGE_INDICATOR_LAMP_5)
-            elif Volts < RANGE_2P5_LOW_LIM:
-                rangeVolts = RANGE_1
-                showRange(RANGE_INDICATOR_LAMP_1)
-        elif rangeVolts == RANGE_1:
-            if Volts > RANGE_1_HIGH_LIM:
-                rangeVolts = RANGE_2P5
-                showRange(RANGE_INDICATOR_LAMP_2P5)
-            elif Volts < RANGE_1_LOW_LIM:
-                rangeVolts = RANGE_500m
-                showRange(RANGE_INDICATOR_LAMP_500m)
-        elif rangeVolts == RANGE_500m:
-            if Volts > RANGE_500m_HIGH_LIM:
-                rangeVolts = RANGE_1
-                showRange(RANGE_INDICATOR_LAMP_1)
-            elif Volts < RANGE_500m_LOW_LIM:
-                rangeVolts = RANGE_250m
-                showRange(RANGE_INDICATOR_LAMP_250m)
-        elif rangeVolts == RANGE_250m:
-            if Volts > RANGE_250m_HIGH_LIM:
-                rangeVolts = RANGE_500m
-                showRange(RANGE_INDICATOR_LAMP_500m)
-            elif Volts < RANGE_250m_LOW_LIM:
-                rangeVolts = RANGE_100m
-                showRange(RANGE_INDICATOR_LAMP_100m)
-        else: # rangeVolts is 100m or invalid. 
-            if Volts > RANGE_100m_HIGH_LIM:
-                rangeVolts = RANGE_250m
-                showRange(RANGE_INDICATOR_LAMP_250m)
-            else:
-                rangeVolts = RANGE_100m
-                showRange(RANGE_INDICATOR_LAMP_100m)
-            # there are no lower voltage ranges
-        # Now calculate the percentage of full scale for volts
-        # avoiding div by 0 if ADC readings not working.
-        if Volts == 0:
-            perCentDrive = 0
-        else:
-            perCentDrive = Volts / rangeVolts 
-        perCentDrive = perCentDrive * 100
-        #print("Volts: ",Volts, " rangeVolts: ", rangeVolts, " perCentDrive: ", perCentDrive)
-        driveMeterToPercentFS(perCentDrive) 
-
+        rangeVolts = nextRange(VOLTS_RANGE_RDGS, rangeVolts, Volts)
+        meterRange = VOLTS_RANGE_RDGS[rangeVolts]
+        reading = Volts
         # prepare for the next short circuit - 
-        rangeAmps = RANGE_10
-        # here endeth the voltage meter driving. 
-
+        rangeAmps = AMPS_TOP_RANGE
     else:
         # PSU is in current limit mode.  Display Current. 
-        PinVoltsFlag.value(0)
-        PinIlimFlag.value(1)
-
-        if rangeAmps == RANGE_10:
-            # No point changing to higher ranges. The output transistor will
-            # melt if current gets any higher. 
-            if Curr < RANGE_10_LOW_LIM:
-                rangeAmps = RANGE_5
-                showRange(RANGE_INDICATOR_LAMP_5)
-        elif rangeAmps == RANGE_5:
-            if Curr > RANGE_5_HIGH_LIM:
-                rangeAmps = RANGE_10
-                showRange(RANGE_INDICATOR_LAMP_10)
-            elif Curr < RANGE_5_LOW_LIM:
-                rangeAmps = RANGE_2P5
-                showRange(RANGE_INDICATOR_LAMP_2P5)
-        elif rangeAmps == RANGE_2P5:
-            if Curr > RANGE_2P5_HIGH_LIM:
-                rangeAmps = RANGE_5
-                showRange(RANGE_INDICATOR_LAMP_5)
-            elif Curr < RANGE_2P5_LOW_LIM:
-                rangeAmps = RANGE_1
-                showRange(RANGE_INDICATOR_LAMP_1)
-        elif rangeAmps == RANGE_1:
-            if Curr > RANGE_1_HIGH_LIM:
-                rangeAmps = RANGE_2P5
-                showRange(RANGE_INDICATOR_LAMP_2P5)
-            elif Curr < RANGE_1_LOW_LIM:
-                rangeAmps = RANGE_500m
-                showRange(RANGE_INDICATOR_LAMP_500m)
-        elif rangeAmps == RANGE_500m:
-            if Curr > RANGE_500m_HIGH_LIM:
-                rangeAmps = RANGE_1
-                showRange(RANGE_INDICATOR_LAMP_1)
-            elif Curr < RANGE_500m_LOW_LIM:
-                rangeAmps = RANGE_250m
-                showRange(RANGE_INDICATOR_LAMP_250m)
-        elif rangeAmps == RANGE_250m:
-            if Curr > RANGE_250m_HIGH_LIM:
-                rangeAmps = RANGE_500m
-                showRange(RANGE_INDICATOR_LAMP_500m)
-            elif Curr < RANGE_250m_LOW_LIM:
-                rangeAmps = RANGE_100m
-                showRange(RANGE_INDICATOR_LAMP_100m)
-        else: # rangeAmps is 100m or invalid. 
-            if Curr > RANGE_100m_HIGH_LIM:
-                rangeAmps = RANGE_250m
-                showRange(RANGE_INDICATOR_LAMP_250m)
-            else:
-                rangeAmps = RANGE_100m
-                showRange(RANGE_INDICATOR_LAMP_100m)
-            # there are no lower current ranges
-        # Now calculate the percentage of full scale for current
-        # avoiding div by 0 errors if ADC readings fault.
-        if Curr == 0:
-            perCentDrive = 0
-        else:
-            perCentDrive = Curr / rangeAmps
-        perCentDrive = perCentDrive * 100
-        #print("Curr: ",Curr, " rangeAmps: ", rangeAmps, " perCentDrive: ", perCentDrive)
-        driveMeterToPercentFS(perCentDrive)
+        rangeAmps = nextRange(AMPS_RANGE_RDGS, rangeAmps, Curr)
+        meterRange = AMPS_RANGE_RDGS[rangeAmps]
+        reading = Curr
         #prepare for change back to volts mode after short cct ends
-        rangeVolts = RANGE_50
-    # end of changing and scaling current ranges. 
+        rangeVolts = VOLTS_TOP_RANGE
+
+    rangeLamps = meterRange[RANGE_LAMP]
+
+    # Now calculate the tenths of a percent of full scale.
+    meterPerMille = reading * 1000 // meterRange[RANGE_FULL_SCALE]
+    #print("reading: ", reading, " range: ", meterRange[RANGE_FULL_SCALE], " meterPerMille: ", meterPerMille)
+
+    if PROFILE_TICKS:
+        tickprof.record(tickprof.STAGE_RANGE, start)
+
+
+############ refreshPanel ############
+#              __               _     _____                 _
+#             / _|             | |   |  __ \               | |
+#    _ __ ___| |_ _ __ ___  ___| |__ | |__) |_ _ _ __   ___| |
+#   | '__/ _ \  _| '__/ _ \/ __| '_ \|  ___/ _` | '_ \ / _ \ |
+#   | | |  __/ | | | |  __/\__ \ | | | |  | (_| | | | |  __/ |
+#   |_|  \___|_| |_|  \___||___/_| |_|_|   \__,_|_| |_|\___|_|
+#
+#
+# Show the mode and range worked out by calcModeAndRange on the front panel.
+# writePanel only touches the outputs when the range or mode has changed.
+#
+def refreshPanel():
+    if PROFILE_TICKS:
+        start = utime.ticks_us()
+
+    if voltsMode:
+        flags = PANEL_VOLTS_FLAG
+    else:
+        flags = PANEL_ILIM_FLAG
+    writePanel(flags | (rangeLamps << PANEL_LAMPS_SHIFT))
+
+    if PROFILE_TICKS:
+        tickprof.record(tickprof.STAGE_LAMPS, start)
+
+
+############ refreshMeter ############
+#              __               _     __  __      _
+#             / _|             | |   |  \/  |    | |
+#    _ __ ___| |_ _ __ ___  ___| |__ | \  / | ___| |_ ___ _ __
+#   | '__/ _ \  _| '__/ _ \/ __| '_ \| |\/| |/ _ \ __/ _ \ '__|
+#   | | |  __/ | | | |  __/\__ \ | | | |  | |  __/ ||  __/ |
+#   |_|  \___|_| |_|  \___||___/_| |_|_|  |_|\___|\__\___|_|
+#
+#
+# Move the needle to the reading worked out by calcModeAndRange.
+#
+def refreshMeter():
+    global needleLamps
+
+    # a change of range lamps means the needle has a new scale to go to.
+    if needleMoving and rangeLamps != needleLamps:
+        needleLamps = rangeLamps
+        ballistics.rangeChange()
+    driveMeterToPerMilleFS(meterPerMille)
+    if not startupMs[STARTUP_RDG]:
+        startupMs[STARTUP_RDG] = utime.ticks_ms()
+
+
+############ readAdcs ############
+#                       _             _
+#                      | |   /\      | |
+#    _ __ ___  __ _  __| |  /  \   __| | ___ ___
+#   | '__/ _ \/ _` |/ _` | / /\ \ / _` |/ __/ __|
+#   | | |  __/ (_| | (_| |/ ____ \ (_| | (__\__ \
+#   |_|  \___|\__,_|\__,_/_/    \_\__,_|\___|___/
+#
+#
+# Blocking fallback for when there is no background capture.  Read all three
+# ADCs a few times each and add the readings to the averaging buffers.
+#
+def readAdcs():
+    global rdgPos
+    global opVsum
+    global opIsum
+    global op0vsum
+
+    pos = rdgPos
+    vSum = opVsum
+    iSum = opIsum
+    zSum = op0vsum
+    for i in range(ADC_READS_PER_TICK):
+        # Read all three ADCs and shift to give range 0 - 4096.
+        val = opVoltRdg.read_u16()>>4
+        vSum += val - opVarr[pos]
+        opVarr[pos] = val
+        val = opCurrRdg.read_u16()>>4
+        iSum += val - opIarr[pos]
+        opIarr[pos] = val
+        val = op0vRdg.read_u16()>>4
+        zSum += val - op0varr[pos]
+        op0varr[pos] = val
+        pos = (pos + 1) & rdgWindowMask
+    rdgPos = pos
+    opVsum = vSum
+    opIsum = iSum
+    op0vsum = zSum
+
+
+############ setRdgWindow ############
+#             _   _____     _    __          ___           _
+#            | | |  __ \   | |   \ \        / (_)         | |
+#    ___  ___| |_| |__) |__| | __ \ \  /\  / / _ _ __   __| | _____      __
+#   / __|/ _ \ __|  _  // _` |/ _` \ \/  \/ / | | '_ \ / _` |/ _ \ \ /\ / /
+#   \__ \  __/ |_| | \ \ (_| | (_| |\  /\  /  | | | | | (_| | (_) \ V  V /
+#   |___/\___|\__|_|  \_\__,_|\__, | \/  \/   |_|_| |_|\__,_|\___/ \_/\_/
+#                              __/ |
+#                             |___/
+# Average over the last 2**shift readings of each channel from now on.  The
+# buffers are preallocated for the biggest window so this only has to refill
+# them with the current averages to keep the running sums honest.
+#
+def setRdgWindow(shift):
+    global rdgWindowShift
+    global rdgWindowMask
+    global rdgPos
+    global opVsum
+    global opIsum
+    global op0vsum
+
+    if shift > RDG_WINDOW_MAX_SHIFT:
+        shift = RDG_WINDOW_MAX_SHIFT
+    vAvg = opVsum >> rdgWindowShift
+    iAvg = opIsum >> rdgWindowShift
+    zAvg = op0vsum >> rdgWindowShift
+    for i in range(1 << shift):
+        opVarr[i] = vAvg
+        opIarr[i] = iAvg
+        op0varr[i] = zAvg
+    rdgWindowShift = shift
+    rdgWindowMask = (1 << shift) - 1
+    rdgPos = 0
+    opVsum = vAvg << shift
+    opIsum = iAvg << shift
+    op0vsum = zAvg << shift
+
+
+############ initCapture ############
+#    _       _ _    _____            _
+#   (_)     (_) |  / ____|          | |
+#    _ _ __  _| |_| |     __ _ _ __ | |_ _   _ _ __ ___
+#   | | '_ \| | __| |    / _` | '_ \| __| | | | '__/ _ \
+#   | | | | | | |_| |___| (_| | |_) | |_| |_| | | |  __/
+#   |_|_| |_|_|\__|\_____\__,_| .__/ \__|\__,_|_|  \___|
+#                             | |
+#                             |_|
+# Claim a DMA channel, set the ADC sample rate and point the FIFO at the DMA.
+# Returns the DMA channel, or None if background capture isn't available.
+#
+def initCapture():
+    global captureCtrl
+    try:
+        import rp2
+        dma = rp2.DMA()
+    except (ImportError, AttributeError):
+        return None
+    # 16 bit reads from the FIFO register into successive captureBuf entries,
+    # paced by the ADC's DMA request.
+    captureCtrl = dma.pack_ctrl(size=1, inc_read=False, inc_write=True, treq_sel=DREQ_ADC)
+    if USE_OVERSAMPLING:
+        rate = OVERSAMPLE_RATE_HZ
+    else:
+        rate = CAPTURE_RATE_HZ
+    mem32[ADC_DIV] = (ADC_CLOCK_HZ // rate - 1) << 8
+    mem32[ADC_FCS] = ADC_FCS_EN | ADC_FCS_DREQ_EN | ADC_FCS_THRESH_1
+    return dma
+
+
+############ startCapture ############
+#        _             _    _____            _
+#       | |           | |  / ____|          | |
+#    ___| |_ __ _ _ __| |_| |     __ _ _ __ | |_ _   _ _ __ ___
+#   / __| __/ _` | '__| __| |    / _` | '_ \| __| | | | '__/ _ \
+#   \__ \ || (_| | |  | |_| |___| (_| | |_) | |_| |_| | | |  __/
+#   |___/\__\__,_|_|   \__|\_____\__,_| .__/ \__|\__,_|_|  \___|
+#                                     | |
+#                                     |_|
+# Restart the round-robin conversions from channel 0 and arm the DMA for a
+# fresh block.  Restarting each time means captureBuf always holds channel
+# 0, 1, 2, 0, 1, 2... so there's no need to work out where the sequence began.
+# count is the number of samples to capture, all of captureBuf by default.
+#
+def startCapture(count=0):
+    global captureTicks
+
+    # stop the conversions and let the one in progress finish.
+    mem32[ADC_CS] = ADC_CS_EN | ADC_CS_RROBIN_0_1_2
+    while not mem32[ADC_CS] & ADC_CS_READY:
+        pass
+    # empty the FIFO and clear the sticky over/underflow flags.
+    while mem32[ADC_FCS] & ADC_FCS_LEVEL:
+        mem32[ADC_FIFO]
+    mem32[ADC_FCS] = ADC_FCS_EN | ADC_FCS_DREQ_EN | ADC_FCS_THRESH_1 | ADC_FCS_OVER | ADC_FCS_UNDER
+    if count == 0:
+        count = len(captureBuf)
+    captureDMA.config(read=ADC_FIFO, write=captureBuf, count=count,
+                      ctrl=captureCtrl, trigger=True)
+    mem32[ADC_CS] = ADC_CS_EN | ADC_CS_RROBIN_0_1_2 | ADC_CS_START_MANY
+    captureTicks = utime.ticks_us()
+
+
+############ readCapture ############
+#                       _  _____            _
+#                      | |/ ____|          | |
+#    _ __ ___  __ _  __| | |     __ _ _ __ | |_ _   _ _ __ ___
+#   | '__/ _ \/ _` |/ _` | |    / _` | '_ \| __| | | | '__/ _ \
+#   | | |  __/ (_| | (_| | |___| (_| | |_) | |_| |_| | | |  __/
+#   |_|  \___|\__,_|\__,_|\_____\__,_| .__/ \__|\__,_|_|  \___|
+#                                    | |
+#                                    |_|
+# Add the block captured since the last tick to the averaging buffers then
+# start capturing the next one.  Returns False if the block isn't complete yet.
+#
+def readCapture():
+    global rdgPos
+    global opVsum
+    global opIsum
+    global op0vsum
+
+    if captureDMA.active():
+        return False
+
+    buf = captureBuf
+    pos = rdgPos
+    vSum = opVsum
+    iSum = opIsum
+    zSum = op0vsum
+    for i in range(0, len(buf), 3):
+        val = buf[i + OP_VOLTS_ADC]
+        vSum += val - opVarr[pos]
+        opVarr[pos] = val
+        val = buf[i + OP_CURR_ADC]
+        iSum += val - opIarr[pos]
+        opIarr[pos] = val
+        val = buf[i + OP_0V_ADC]
+        zSum += val - op0varr[pos]
+        op0varr[pos] = val
+        pos = (pos + 1) & rdgWindowMask
+    if RECORD_TRANSIENTS:
+        transient.addBlock(buf, len(buf) // 3, captureTicks, zSum >> rdgWindowShift,
+                           1 - pinILim.value())
+    startCapture()
+
+    rdgPos = pos
+    opVsum = vSum
+    opIsum = iSum
+    op0vsum = zSum
+    return True
+
+
+############ sumCapture ############
+#                         _____            _
+#                        / ____|          | |
+#    ___ _   _ _ __ ___ | |     __ _ _ __ | |_ _   _ _ __ ___
+#   / __| | | | '_ ` _ \| |    / _` | '_ \| __| | | | '__/ _ \
+#   \__ \ |_| | | | | | | |___| (_| | |_) | |_| |_| | | |  __/
+#   |___/\__,_|_| |_| |_|\_____\__,_| .__/ \__|\__,_|_|  \___|
+#                                   | |
+#                                   |_|
+# Add up count samples of captureBuf into sums[0], sums[1] and sums[2], one
+# per round-robin channel.  Up to 12k samples have to be summed each update
+# when oversampling, which is far too slow as ordinary Python, so this is a
+# viper function working straight on the buffer's memory.  The largest sum
+# is 4096 * 4095, well inside a viper int.
+#
+@micropython.viper
+def sumCapture(buf, count: int, sums):
+    samples = ptr16(buf)
+    totals = ptr32(sums)
+    sum0 = 0
+    sum1 = 0
+    sum2 = 0
+    i = 0
+    while i < count:
+        sum0 += samples[i]
+        sum1 += samples[i + 1]
+        sum2 += samples[i + 2]
+        i += 3
+    totals[0] = sum0
+    totals[1] = sum1
+    totals[2] = sum2
+
+
+############ readOversampled ############
+#                       _  ____                                           _          _
+#                      | |/ __ \                                         | |        | |
+#    _ __ ___  __ _  __| | |  | |_   _____ _ __ ___  __ _ _ __ ___  _ __ | | ___  __| |
+#   | '__/ _ \/ _` |/ _` | |  | \ \ / / _ \ '__/ __|/ _` | '_ ` _ \| '_ \| |/ _ \/ _` |
+#   | | |  __/ (_| | (_| | |__| |\ V /  __/ |  \__ \ (_| | | | | | | |_) | |  __/ (_| |
+#   |_|  \___|\__,_|\__,_|\____/  \_/ \___|_|  |___/\__,_|_| |_| |_| .__/|_|\___|\__,_|
+#                                                                  | |
+#                                                                  |_|
+# Sum the block captured since the last tick, then start a new one as deep as
+# the range now being displayed wants.  The sums are left in captureSums and
+# the depth of the block they came from in oversampleShift.  Returns False if
+# the block isn't complete yet.
+#
+def readOversampled():
+    global oversampleShift
+    global captureShift
 
+    if captureDMA.active():
+        return False
 
+    shift = captureShift
+    sumCapture(captureBuf, 3 << shift, captureSums)
+    oversampleShift = shift
+    if RECORD_TRANSIENTS:
+        transient.addBlock(captureBuf, 1 << shift, captureTicks, captureSums[OP_0V_ADC] >> shift,
+                           1 - pinILim.value())
 
-############# updateRdgs ##############
-#                  _       _       _____     _           
-#                 | |     | |     |  __ \   | |          
-#  _   _ _ __   __| | __ _| |_ ___| |__) |__| | __ _ ___ 
-# | | | | '_ \ / _` |/ _` | __/ _ \  _  // _` |/ _` / __|
-# | |_| | |_) | (_| | (_| | ||  __/ | \ \ (_| | (_| \__ \
-#  \__,_| .__/ \__,_|\__,_|\__\___|_|  \_\__,_|\__, |___/
-#       | |                                     __/ |    
-#       |_|                                    |___/     
+    if voltsMode:
+        shift = VOLTS_RANGE_RDGS[rangeVolts][RANGE_OVERSAMPLE]
+    else:
+        shift = AMPS_RANGE_RDGS[rangeAmps][RANGE_OVERSAMPLE]
+    # shallower while the update rate is busy, so a block comes closer to
+    # keeping up with it, and deeper while it's idle.
+    shift += oversampleBias
+    if shift > OVERSAMPLE_MAX_SHIFT:
+        shift = OVERSAMPLE_MAX_SHIFT
+    elif shift < OVERSAMPLE_MIN_SHIFT:
+        shift = OVERSAMPLE_MIN_SHIFT
+    captureShift = shift
+    startCapture(3 << shift)
+    return True
+
+
+############ sampleRdgs ############
+#                              _      _____     _
+#                             | |    |  __ \   | |
+#    ___  __ _ _ __ ___  _ __ | | ___| |__) |__| | __ _ ___
+#   / __|/ _` | '_ ` _ \| '_ \| |/ _ \  _  // _` |/ _` / __|
+#   \__ \ (_| | | | | | | |_) | |  __/ | \ \ (_| | (_| \__ \
+#   |___/\__,_|_| |_| |_| .__/|_|\___|_|  \_\__,_|\__, |___/
+#                       | |                        __/ |
+#                       |_|                       |___/
 # Read and average the readings for output voltage, output current and 
 # the zero point from which both of those are referenced. 
-# Readings are held as integer values. 
+# Readings are held as integer values in ring buffers with a running sum per
+# channel, so the average costs the same whatever the window size.
+# The results are left in rdgOut as ADC counts with RDG_FRAC_BITS of
+# fraction, so no floats are needed anywhere in the update.
+# When oversampling, the sums of one deep block are used instead of the ring
+# buffers and the shift is the depth of that block - the same decimation.
+# scaleRdgs takes the averages on from there.
+# This is the part of the update that runs on the sampling core.
+# Returns False if there were no new readings this time.
 #
-def updateRdgs():
-    global opVarr
-    global opIarr
-    global op0varr
-    
-    # Read all three ADCs and shift to give range 0 - 4096.
-    # All arrays are the same length so just using size of first array
-    for i in range(len(opVarr)):
-        opVarr[i] = opVoltRdg.read_u16()>>4
-#        print("rdg ", i, " Val: ", opVarr[i])
-        opIarr[i] = opCurrRdg.read_u16()>>4
-        op0varr[i] = op0vRdg.read_u16()>>4
-    
-    # get averaged raw adc counts
-    voltsVal = 0
-    iVal = 0
-    volt0Val = 0
-    for i in range(len(opVarr)):
-        voltsVal = voltsVal + opVarr[i]
-        iVal = iVal + opIarr[i]
-        volt0Val = volt0Val + op0varr[i]
-
-    # averaged raw output voltage adc count    
-    voltsVal = voltsVal / len(opVarr)
-    voltsVal = int(voltsVal)
-    
-    # averaged raw output current adc count
-    iVal = iVal / len(opIarr)
-    iVal = int(iVal)
-    
-    # averaged raw 0V voltage adc count
-    volt0Val = volt0Val / len(op0varr)
-    volt0Val = int(volt0Val)
+def sampleRdgs():
+    if PROFILE_TICKS:
+        start = utime.ticks_us()
+
+    # the averaging window asked for by setUpdateRate, changed over here so
+    # that it's the sampling side that touches the ring buffers.
+    if adaptiveRate and rdgWindowWanted != rdgWindowShift:
+        setRdgWindow(rdgWindowWanted)
+
+    # get averaged raw adc counts, either from the block captured in the
+    # background since the last tick or by reading the ADCs now.
+    if captureDMA is None:
+        readAdcs()
+    elif USE_OVERSAMPLING:
+        if not readOversampled():
+            # deep block still going, leave the meter where it is.
+            return False
+    elif not readCapture():
+        # capture running late, leave the meter where it is until next tick.
+        return False
+
+    if PROFILE_TICKS:
+        start = tickprof.record(tickprof.STAGE_CAPTURE, start)
+
+    if captureDMA is not None and USE_OVERSAMPLING:
+        shift = oversampleShift
+        vSum = captureSums[OP_VOLTS_ADC]
+        iSum = captureSums[OP_CURR_ADC]
+        zSum = captureSums[OP_0V_ADC]
+    else:
+        shift = rdgWindowShift
+        vSum = opVsum
+        iSum = opIsum
+        zSum = op0vsum
+    scaleRdgs((vSum << RDG_FRAC_BITS) >> shift,
+              (iSum << RDG_FRAC_BITS) >> shift,
+              (zSum << RDG_FRAC_BITS) >> shift, rdgOut)
+
+    if PROFILE_TICKS:
+        tickprof.record(tickprof.STAGE_AVERAGE, start)
+    return True
+
+
+############ scaleRdgs ############
+#                  _      _____     _
+#                 | |    |  __ \   | |
+#    ___  ___ __ _| | ___| |__) |__| | __ _ ___
+#   / __|/ __/ _` | |/ _ \  _  // _` |/ _` / __|
+#   \__ \ (_| (_| | |  __/ | \ \ (_| | (_| \__ \
+#   |___/\___\__,_|_|\___|_|  \_\__,_|\__, |___/
+#                                      __/ |
+#                                     |___/
+# Take the zero point off the averaged volts and current counts and put them
+# through the filter chains set in the calibration file, see filters.py.
+# The results go in out, an array of RDG_FIELDS, along with the averages for
+# the telemetry - which also lets a recording be fed back in here on the host.
+#
+def scaleRdgs(voltsVal, iVal, volt0Val, out):
+    out[RDG_VOLTS_AVG] = voltsVal
+    out[RDG_AMPS_AVG] = iVal
+    out[RDG_ZERO_AVG] = volt0Val
 
     # subtract 0v from output volts reading
-    if voltsVal > volt0Val:
-        voltsVal -= volt0Val
+    zeroVal = volt0Val + VOLTS_ZERO_RDG
+    if voltsVal > zeroVal:
+        voltsVal -= zeroVal
     else:
         # negative voltage!
         voltsVal = 0
         #print("op volt error")  
-    #scale to real voltage
-    voltsOut = voltsVal* VOLTS_PER_ADC_STEP
+    out[RDG_VOLTS] = filters.runChain(voltsFilter, voltsVal)
         
-    if iVal > volt0Val:
-        iVal = iVal-volt0Val
+    zeroVal = volt0Val + AMPS_ZERO_RDG
+    if iVal > zeroVal:
+        iVal = iVal-zeroVal
     else:
         # negative current!  Maybe light the amber measurement warning lamp?  
         iVal = 0
         #print ("op I error")
+    out[RDG_AMPS] = filters.runChain(ampsFilter, iVal)
 
-    iOut = iVal * AMPS_PER_ADC_STEP
 
-    calcModeAndRange(voltsOut, iOut)
-    
-# remnants of the test program to display the DAC bits...    
-#    print("voltsVal: ", voltsVal)
-#    print("0vVal: ",volt0Val)
-#    print("iVal: ", iVal)
-#    print("voltsOut: ", voltsOut)
-#    print("iOut: ", iOut)
-#    print("meterVal: ", meterVal)
-    
-#    print(bit7.value(),bit6.value(), bit5.value(), bit4.value(), bit3.value(), bit2.value(), bit1.value(), bit0.value())
-    
-#    print("Iactive: ")
-#    print(" ")
+############ takeRdgs ############
+#    _        _        _____     _
+#   | |      | |      |  __ \   | |
+#   | |_ __ _| | _____| |__) |__| | __ _ ___
+#   | __/ _` | |/ / _ \  _  // _` |/ _` / __|
+#   | || (_| |   <  __/ | \ \ (_| | (_| \__ \
+#    \__\__,_|_|\_\___|_|  \_\__,_|\__, |___/
+#                                   __/ |
+#                                  |___/
+# Copy a set of readings from scaleRdgs into voltsRdg, currRdg and the
+# averages, which only the display side of the update uses.
+#
+def takeRdgs(rdgs):
+    global voltsRdg
+    global currRdg
+    global voltsAvg
+    global currAvg
+    global zeroAvg
+
+    voltsRdg = rdgs[RDG_VOLTS]
+    currRdg = rdgs[RDG_AMPS]
+    voltsAvg = rdgs[RDG_VOLTS_AVG]
+    currAvg = rdgs[RDG_AMPS_AVG]
+    zeroAvg = rdgs[RDG_ZERO_AVG]
+
+
+############ updateRdgs ############
+#                    _       _       _____     _
+#                   | |     | |     |  __ \   | |
+#    _   _ _ __   __| | __ _| |_ ___| |__) |__| | __ _ ___
+#   | | | | '_ \ / _` |/ _` | __/ _ \  _  // _` |/ _` / __|
+#   | |_| | |_) | (_| | (_| | ||  __/ | \ \ (_| | (_| \__ \
+#    \__,_| .__/ \__,_|\__,_|\__\___|_|  \_\__,_|\__, |___/
+#         | |                                     __/ |
+#         |_|                                    |___/
+# Get the latest readings for the display side.  With the sampling core
+# running they're whatever it last published, otherwise the sampling is
+# done here and now.
+# Returns False if there were no new readings this time.
+#
+def updateRdgs():
+    global rdgSeqTaken
+
+    if samplingRunning:
+        rdgLock.acquire()
+        seq = rdgShared[RDG_SEQ]
+        if seq != rdgSeqTaken:
+            takeRdgs(rdgShared)
+        rdgLock.release()
+        if seq == rdgSeqTaken:
+            return False
+        rdgSeqTaken = seq
+        return True
+
+    if not sampleRdgs():
+        return False
+    takeRdgs(rdgOut)
+    return True
+
+
+############ samplingLoop ############
+#                              _ _             _
+#                             | (_)           | |
+#    ___  __ _ _ __ ___  _ __ | |_ _ __   __ _| |     ___   ___  _ __
+#   / __|/ _` | '_ ` _ \| '_ \| | | '_ \ / _` | |    / _ \ / _ \| '_ \
+#   \__ \ (_| | | | | | | |_) | | | | | | (_| | |___| (_) | (_) | |_) |
+#   |___/\__,_|_| |_| |_| .__/|_|_|_| |_|\__, |______\___/ \___/| .__/
+#                       | |               __/ |                 | |
+#                       |_|              |___/                  |_|
+# The sampling core.  Captures, averages and filters readings as fast as
+# they come and publishes each set in rdgShared for updateRdgs, with a
+# sequence number so it can tell when there's a new one.  The lock is only
+# held for the copy, so neither side ever waits long for the other.
+# The loop only reads the display side's mode and range (to pick the
+# oversampling depth), everything it writes is its own.
+# While the rate is idle a set whose volts or current average is more than
+# WAKE_COUNTS from the last one sets tickFlag itself, so the update (and
+# adaptRate) comes now rather than at the next tick.  A ThreadSafeFlag can
+# be set from the other core.
+#
+def samplingLoop():
+    global samplingRunning
+
+    wake = WAKE_COUNTS << RDG_FRAC_BITS
+    while not samplingStop:
+        if sampleRdgs():
+            jumped = (abs(rdgOut[RDG_VOLTS_AVG] - rdgShared[RDG_VOLTS_AVG]) > wake or
+                      abs(rdgOut[RDG_AMPS_AVG] - rdgShared[RDG_AMPS_AVG]) > wake)
+            rdgLock.acquire()
+            for field in range(RDG_SEQ):
+                rdgShared[field] = rdgOut[field]
+            rdgShared[RDG_SEQ] += 1
+            rdgLock.release()
+            if jumped and adaptiveRate and not rateBusy and tickTimerRunning:
+                tickFlag.set()
+        else:
+            # block still being captured.
+            utime.sleep_us(SAMPLING_IDLE_US)
+    samplingRunning = False
+
+
+############ startSampling ############
+#        _             _    _____                       _ _
+#       | |           | |  / ____|                     | (_)
+#    ___| |_ __ _ _ __| |_| (___   __ _ _ __ ___  _ __ | |_ _ __   __ _
+#   / __| __/ _` | '__| __|\___ \ / _` | '_ ` _ \| '_ \| | | '_ \ / _` |
+#   \__ \ || (_| | |  | |_ ____) | (_| | | | | | | |_) | | | | | | (_| |
+#   |___/\__\__,_|_|   \__|_____/ \__,_|_| |_| |_| .__/|_|_|_| |_|\__, |
+#                                                | |               __/ |
+#                                                |_|              |___/
+# Start samplingLoop on the second core, if there is one.  Returns True if
+# it's running.
+#
+def startSampling():
+    global samplingRunning
+    global samplingStop
+    global rdgLock
 
+    try:
+        import _thread
+    except ImportError:
+        return False
+    rdgLock = _thread.allocate_lock()
+    samplingStop = False
+    samplingRunning = True
+    _thread.start_new_thread(samplingLoop, ())
+    return True
+
+
+############ stopSampling ############
+#        _              _____                       _ _
+#       | |            / ____|                     | (_)
+#    ___| |_ ___  _ __| (___   __ _ _ __ ___  _ __ | |_ _ __   __ _
+#   / __| __/ _ \| '_ \\___ \ / _` | '_ ` _ \| '_ \| | | '_ \ / _` |
+#   \__ \ || (_) | |_) |___) | (_| | | | | | | |_) | | | | | | (_| |
+#   |___/\__\___/| .__/_____/ \__,_|_| |_| |_| .__/|_|_|_| |_|\__, |
+#                | |                         | |               __/ |
+#                |_|                         |_|              |___/
+# Stop the sampling core and wait for it to finish its last set of readings.
+#
+def stopSampling():
+    global samplingStop
+    samplingStop = True
+    while samplingRunning:
+        utime.sleep_ms(1)
+
+
+############ meterTasks ############
+#                   _         _______        _
+#                  | |       |__   __|      | |
+#    _ __ ___   ___| |_ ___ _ __| | __ _ ___| | _____
+#   | '_ ` _ \ / _ \ __/ _ \ '__| |/ _` / __| |/ / __|
+#   | | | | | |  __/ ||  __/ |  | | (_| \__ \   <\__ \
+#   |_| |_| |_|\___|\__\___|_|  |_|\__,_|___/_|\_\___/
+#
+#
+# The meter update is split into asyncio tasks so that none of it runs in
+# interrupt context.  The timer wakes sampleTask, which passes the new
+# readings on to rangeTask, which in turn wakes the lamp and meter tasks.
+# The onboard led is on from the start of sampling until the needle has been
+# moved.  tickBusy covers the same time so that the timer can tell when it
+# has overrun an update.
+#
+async def sampleTask():
+    global tickBusy
+    global tickStart
+
+    while True:
+        await tickFlag.wait()
+        tickFlag.clear()
+        led.high()
+        tickBusy = True
+        tickStart = utime.ticks_us()
+        if updateRdgs():
+            rdgsReady.set()
+        else:
+            led.low()
+            tickBusy = False
+
+async def rangeTask():
+    while True:
+        await rdgsReady.wait()
+        rdgsReady.clear()
+        calcModeAndRange(voltsRdg, currRdg)
+        panelDue.set()
+        meterDue.set()
+
+async def panelTask():
+    while True:
+        await panelDue.wait()
+        panelDue.clear()
+        refreshPanel()
+
+async def meterTask():
+    global tickBusy
+
+    while True:
+        await meterDue.wait()
+        meterDue.clear()
+        refreshMeter()
+        if PROFILE_TICKS:
+            tickprof.record(tickprof.STAGE_TICK, tickStart)
+        if TELEMETRY:
+            sendTelemetry(tickStart)
+        if adaptiveRate:
+            adaptRate()
+        led.low()
+        tickBusy = False
+
+# Send the telemetry frames recorded since last time.  Runs at low priority
+# compared to the update, it only ever sleeps and writes what fits.
+async def telemetryTask():
+    while True:
+        await asyncio.sleep(TELEMETRY_FLUSH_MS / 1000)
+        telemetry.flush()
+
+# Woken by ilimIrq.  Waits for the input to settle and if it really has
+# changed, switches the display over and notes how long that took.
+async def ilimTask():
+    global ilimLevel
+    global ilimPending
+
+    while True:
+        await ilimFlag.wait()
+        ilimFlag.clear()
+        await asyncio.sleep(ILIM_DEBOUNCE_MS / 1000)
+        edge = ilimEdgeTicks
+        ilimPending = False
+        level = pinILim.value()
+        if level == ilimLevel:
+            continue
+        ilimLevel = level
+        switchMode(level, edge)
+        # a change of mode is activity, so don't wait for the next update
+        # to speed up.
+        if adaptiveRate:
+            adaptRate()
+        us = utime.ticks_diff(utime.ticks_us(), edge)
+        ilimStats[ILIM_EVENTS] += 1
+        ilimStats[ILIM_LAST] = us
+        if us < ilimStats[ILIM_MIN]:
+            ilimStats[ILIM_MIN] = us
+        if us > ilimStats[ILIM_MAX]:
+            ilimStats[ILIM_MAX] = us
+
+# Without a ThreadSafeFlag (CPython's asyncio on the host) there is no
+# hardware timer to call meterUpdateTick, so a task does it instead.
+async def tickTask():
+    while True:
+        await asyncio.sleep(1 / updateHz)
+        meterUpdateTick(None)
+
+
+############ meterMain ############
+#                   _            __  __       _
+#                  | |          |  \/  |     (_)
+#    _ __ ___   ___| |_ ___ _ __| \  / | __ _ _ _ __
+#   | '_ ` _ \ / _ \ __/ _ \ '__| |\/| |/ _` | | '_ \
+#   | | | | | |  __/ ||  __/ |  | |  | | (_| | | | | |
+#   |_| |_| |_|\___|\__\___|_|  |_|  |_|\__,_|_|_| |_|
+#
+#
+# Start the meter update tasks and the timer that drives them, then run
+# forever (or for runSecs seconds, which is handy on the host).  The rate is
+# adaptive with USE_ADAPTIVE_RATE unless freq is given.
+#
+async def meterMain(freq=None, runSecs=None):
+    global tickFlag
+    global rdgsReady
+    global panelDue
+    global meterDue
+    global ilimFlag
+    global ilimLevel
+    global adaptiveRate
+    global updateHz
+    global tickTimerRunning
+
+    adaptiveRate = USE_ADAPTIVE_RATE and freq is None
+    if adaptiveRate:
+        setUpdateRate(False)
+    else:
+        updateHz = freq or METER_UPDATE_HZ
+    rdgsReady = asyncio.Event()
+    panelDue = asyncio.Event()
+    meterDue = asyncio.Event()
+    if hasattr(asyncio, 'ThreadSafeFlag'):
+        tickFlag = asyncio.ThreadSafeFlag()
+        tickTimerRunning = True
+        meterUpdateTim.init(freq=updateHz, mode=Timer.PERIODIC, callback=meterUpdateTick)
+    else:
+        tickFlag = asyncio.Event()
+        asyncio.create_task(tickTask())
+
+    if USE_SAMPLING_CORE:
+        startSampling()
+    if (USE_BALLISTICS or USE_DITHER) and not needleRunning:
+        startNeedle()
+    asyncio.create_task(sampleTask())
+    asyncio.create_task(rangeTask())
+    asyncio.create_task(panelTask())
+    asyncio.create_task(meterTask())
+    if TELEMETRY:
+        asyncio.create_task(telemetryTask())
+    if USE_ILIM_IRQ:
+        if hasattr(asyncio, 'ThreadSafeFlag'):
+            ilimFlag = asyncio.ThreadSafeFlag()
+        else:
+            ilimFlag = asyncio.Event()
+        ilimLevel = pinILim.value()
+        asyncio.create_task(ilimTask())
+        pinILim.irq(handler=ilimIrq, trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, hard=True)
+    while runSecs is None or runSecs > 0:
+        await asyncio.sleep(1)
+        if STARTUP_LOG and not startupLogged and startupMs[STARTUP_RDG]:
+            logStartup()
+        if runSecs is not None:
+            runSecs -= 1
+    tickTimerRunning = False
+    meterUpdateTim.deinit()
+    if samplingRunning:
+        stopSampling()
+    if needleRunning:
+        stopNeedle()
+    pinILim.irq(handler=None)
+    ilimFlag = None
+
+
+############ main ############
+#                    _
+#                   (_)
+#    _ __ ___   __ _ _ _ __
+#   | '_ ` _ \ / _` | | '_ \
+#   | | | | | | (_| | | | | |
+#   |_| |_| |_|\__,_|_|_| |_|
+#
+#
+# Light up the panel, run the lamp test and hand over to the meter update
+# tasks.  Never returns.
+#
+def main():
+    PinPwr.value(1) #power indicator
+    if USE_BALLISTICS or USE_DITHER:
+        startNeedle()
+    lampTest()
+    startupMs[STARTUP_LAMPS] = utime.ticks_ms()
+    # The meter update timer schedules running of the meter update tasks. 
+    asyncio.run(meterMain())
 
 
 ############ main program ###########
@@ -720,22 +1888,137 @@ def updateRdgs():
 #                             | |               __/ |                    
 #                             |_|              |___/                     
 #
-opVoltRdg = machine.ADC(2)
-opVarr = [0, 0, 0, 0, 0, 0, 0, 0]
-opCurrRdg = machine.ADC(1)
-opIarr = [0, 0, 0, 0, 0, 0, 0, 0]
-op0vRdg = machine.ADC(0)
-op0varr = [0, 0, 0, 0, 0, 0, 0, 0]
-PinPwr.value(1) #power indicator
-lampTest()
+# ADC channels as wired.  Also used to pick each channel's samples out of
+# the round-robin capture buffer.
+OP_VOLTS_ADC = cal['adc_channels']['volts']
+OP_CURR_ADC = cal['adc_channels']['amps']
+OP_0V_ADC = cal['adc_channels']['zero']
+# fixed zero offsets on top of the 0V channel, in readings
+VOLTS_ZERO_RDG = cal['volts_zero'] << RDG_FRAC_BITS
+AMPS_ZERO_RDG = cal['amps_zero'] << RDG_FRAC_BITS
+opVoltRdg, opCurrRdg, op0vRdg = openAdcs(cal['adc_channels'])
+# averaging buffers, big enough for the largest window.
+opVarr = array.array('H', [0] * (1 << RDG_WINDOW_MAX_SHIFT))
+opIarr = array.array('H', [0] * (1 << RDG_WINDOW_MAX_SHIFT))
+op0varr = array.array('H', [0] * (1 << RDG_WINDOW_MAX_SHIFT))
+opVsum = 0
+opIsum = 0
+op0vsum = 0
+rdgPos = 0
+rdgWindowShift = RDG_WINDOW_SHIFT
+rdgWindowMask = (1 << RDG_WINDOW_SHIFT) - 1
+# when oversampling the buffer has to hold the deepest block, 24k bytes.
+if USE_ADC_CAPTURE and USE_OVERSAMPLING:
+    captureBuf = array.array('H', [0] * (3 << OVERSAMPLE_MAX_SHIFT))
+else:
+    captureBuf = array.array('H', [0] * (3 * CAPTURE_SAMPLES_PER_CHANNEL))
+captureSums = array.array('l', [0, 0, 0])
+captureShift = OVERSAMPLE_MIN_SHIFT
+oversampleShift = OVERSAMPLE_MIN_SHIFT
+captureCtrl = 0
+captureTicks = 0
+captureDMA = None
+if USE_ADC_CAPTURE:
+    captureDMA = initCapture()
+if captureDMA is not None:
+    if USE_OVERSAMPLING:
+        startCapture(3 << captureShift)
+    else:
+        startCapture()
+meterTable = buildMeterTable(METER_GRATICULE_DAC)
+meterFracTable = buildMeterFracTable(METER_GRATICULE_DAC)
+VOLTS_RANGE_RDGS = buildRangeRdgs(VOLTS_RANGES, VOLTS_PER_RDG)
+AMPS_RANGE_RDGS = buildRangeRdgs(AMPS_RANGES, AMPS_PER_RDG)
+voltsFilter = filters.makeChain(cal['filters']['volts'])
+ampsFilter = filters.makeChain(cal['filters']['amps'])
 currentRange = 0
 
-rangeVolts = 1
-rangeAmps = 1
-# The meter update timer schedules running of the meter update code. 
-# get it to run as fast as possible.  
-# Will likely need to slow it down if using print statements for testing. 
-#meterUpdateTim.init(freq=10, mode=Timer.PERIODIC, callback=meterUpdateTick)
-meterUpdateTim.init(freq=35, mode=Timer.PERIODIC, callback=meterUpdateTick)
+rangeVolts = VOLTS_TOP_RANGE
+rangeAmps = AMPS_TOP_RANGE
+voltsMode = 1
+rangeLamps = RANGE_INDICATOR_LAMPS_NONE
+# Each set of readings from scaleRdgs is an array of RDG_FIELDS: the
+# filtered volts and amps, the averages they came from and, in rdgShared,
+# a count of the sets published by the sampling core.
+RDG_VOLTS = 0
+RDG_AMPS = 1
+RDG_VOLTS_AVG = 2
+RDG_AMPS_AVG = 3
+RDG_ZERO_AVG = 4
+RDG_SEQ = 5
+RDG_FIELDS = 6
+rdgOut = array.array('l', [0] * RDG_FIELDS)
+rdgShared = array.array('l', [0] * RDG_FIELDS)
+rdgSeqTaken = 0
+rdgLock = None
+samplingRunning = False
+samplingStop = False
+meterPerMille = 0
+meterDac = 0
+needleRunning = False
+needleMoving = False
+needleDithering = False
+needlePerMille = 0
+# DAC code being dithered, with DITHER_FRAC_BITS of fraction.
+needleDacFrac = 0
+ditherAcc = 0
+needleLamps = RANGE_INDICATOR_LAMPS_NONE
+dacSm = None
+lampsSm = None
+if USE_PIO_OUTPUTS:
+    dacSm, lampsSm = initPioOutputs()
+if dacSm is not None:
+    driveMeterDAC = driveMeterDACPio
+voltsAvg = 0
+currAvg = 0
+zeroAvg = 0
+voltsRdg = 0
+currRdg = 0
+tickFlag = None
+tickTimerRunning = False
+tickBusy = False
+# adaptive update rate, see adaptRate.  Only adapts once meterMain has
+# started, so the window set by hand with setRdgWindow stays put till then.
+adaptiveRate = False
+updateHz = METER_UPDATE_HZ
+rateBusy = False
+rateBusyUntil = 0
+ratePerMille = 0
+rateLamps = RANGE_INDICATOR_LAMPS_NONE
+rateVoltsMode = 1
+rateChanges = 0
+oversampleBias = 0
+rdgWindowWanted = RDG_WINDOW_SHIFT
+tickStart = 0
+tickprof = None
+if PROFILE_TICKS:
+    enableProfiling()
+telemetry = None
+if TELEMETRY:
+    enableTelemetry()
+transient = None
+if RECORD_TRANSIENTS:
+    enableTransients()
+rdgsReady = None
+panelDue = None
+meterDue = None
+ilimFlag = None
+ilimLevel = 1
+ilimPending = False
+ilimEdgeTicks = 0
+# current limit latency figures, see reportIlim.
+ILIM_EVENTS = 0
+ILIM_LAST = 1
+ILIM_MIN = 2
+ILIM_MAX = 3
+ilimStats = array.array('L', [0, 0, 0x3FFFFFFF, 0])
+startupLogged = False
+startupMs[STARTUP_SETUP] = utime.ticks_ms()
+
+# Only start up when run as main.py, so the functions above can be imported
+# and tried out on their own.  A compiled drivemeter.mpy is imported by a
+# main.py that calls main() instead.
+if __name__ == '__main__':
+    main()
 
 
@@ -0,0 +1,195 @@
+# _________________________________________
+#/ Digital filters for the meter readings. \
+#| A chain of EMA, median and boxcar       |
+#| stages per channel, set up from the     |
+#| calibration file, with all the filter   |
+#| state in preallocated arrays so that    |
+#\ filtering a reading never allocates.    /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# A chain is described by a list of stages, each [name, parameter], applied
+# in order.  The stages are:
+#   ['ema', k]     - exponential moving average, each new reading counts for
+#                    1/2**k of the output.  k is 1 to EMA_MAX_SHIFT.
+#   ['median', n]  - median of the last n readings, n odd, 3 to MEDIAN_MAX.
+#                    Throws away spikes shorter than n/2 readings.
+#   ['boxcar', k]  - plain average of the last 2**k readings, k is 1 to
+#                    BOXCAR_MAX_SHIFT.
+# An empty list passes the readings straight through.  A median in front of
+# an EMA is a good start for ripple with the odd load transient on top:
+#   [['median', 3], ['ema', 2]]
+#
+# Readings are integers (ADC counts with a few bits of fraction in
+# drivemeter.py) and stay integers.  The first reading after makeChain or
+# resetChain fills every stage with that reading, so the output doesn't have
+# to climb up from zero at switch on.
+
+import array
+
+FILTER_EMA = 0
+FILTER_MEDIAN = 1
+FILTER_BOXCAR = 2
+FILTER_NAMES = {'ema': FILTER_EMA, 'median': FILTER_MEDIAN, 'boxcar': FILTER_BOXCAR}
+
+EMA_MAX_SHIFT = 8
+MEDIAN_MAX = 9
+BOXCAR_MAX_SHIFT = 6
+
+# chain is a tuple of (stages, state), each stage is (kind, parameter, base)
+# where base is the index of the stage's first entry in the state array.
+# state[0] is 0 until the chain has seen its first reading.
+CHAIN_STAGES = 0
+CHAIN_STATE = 1
+
+
+############ checkSpec ############
+#         _               _     _____
+#        | |             | |   / ____|
+#     ___| |__   ___  ___| | _| (___  _ __   ___  ___
+#    / __| '_ \ / _ \/ __| |/ /\___ \| '_ \ / _ \/ __|
+#   | (__| | | |  __/ (__|   < ____) | |_) |  __/ (__
+#    \___|_| |_|\___|\___|_|\_\_____/| .__/ \___|\___|
+#                                    | |
+#                                    |_|
+# Raise ValueError saying what is wrong if spec isn't a usable filter chain.
+#
+def checkSpec(spec):
+    for stage in spec:
+        if len(stage) != 2 or stage[0] not in FILTER_NAMES:
+            raise ValueError("filter stage %s not understood" % (stage,))
+        name, param = stage
+        if name == 'ema' and not 1 <= param <= EMA_MAX_SHIFT:
+            raise ValueError("ema shift must be 1 to %d" % EMA_MAX_SHIFT)
+        if name == 'median' and not (3 <= param <= MEDIAN_MAX and param & 1):
+            raise ValueError("median length must be odd, 3 to %d" % MEDIAN_MAX)
+        if name == 'boxcar' and not 1 <= param <= BOXCAR_MAX_SHIFT:
+            raise ValueError("boxcar shift must be 1 to %d" % BOXCAR_MAX_SHIFT)
+
+
+############ makeChain ############
+#                    _         _____ _           _
+#                   | |       / ____| |         (_)
+#    _ __ ___   __ _| | _____| |    | |__   __ _ _ _ __
+#   | '_ ` _ \ / _` | |/ / _ \ |    | '_ \ / _` | | '_ \
+#   | | | | | | (_| |   <  __/ |____| | | | (_| | | | | |
+#   |_| |_| |_|\__,_|_|\_\___|\_____|_| |_|\__,_|_|_| |_|
+#
+#
+# Build a filter chain from its description, with the state for every stage
+# allocated up front.
+#   ema    - the output with k bits of fraction
+#   median - next position, the last n readings, then n to sort them in
+#   boxcar - next position, running sum, the last 2**k readings
+#
+def makeChain(spec):
+    checkSpec(spec)
+    stages = []
+    size = 1
+    for name, param in spec:
+        kind = FILTER_NAMES[name]
+        stages.append((kind, param, size))
+        if kind == FILTER_EMA:
+            size += 1
+        elif kind == FILTER_MEDIAN:
+            size += 1 + 2 * param
+        else:
+            size += 2 + (1 << param)
+    return (tuple(stages), array.array('l', [0] * size))
+
+
+############ resetChain ############
+#                       _    _____ _           _
+#                      | |  / ____| |         (_)
+#    _ __ ___  ___  ___| |_| |    | |__   __ _ _ _ __
+#   | '__/ _ \/ __|/ _ \ __| |    | '_ \ / _` | | '_ \
+#   | | |  __/\__ \  __/ |_| |____| | | | (_| | | | | |
+#   |_|  \___||___/\___|\__|\_____|_| |_|\__,_|_|_| |_|
+#
+#
+# Forget the history, the next reading will fill the chain afresh.
+#
+def resetChain(chain):
+    chain[CHAIN_STATE][0] = 0
+
+
+############ fillChain ############
+#     __ _ _ _  _____ _           _
+#    / _(_) | |/ ____| |         (_)
+#   | |_ _| | | |    | |__   __ _ _ _ __
+#   |  _| | | | |    | '_ \ / _` | | '_ \
+#   | | | | | | |____| | | | (_| | | | | |
+#   |_| |_|_|_|\_____|_| |_|\__,_|_|_| |_|
+#
+#
+# Fill every stage as though it had only ever seen value.
+#
+def fillChain(chain, value):
+    state = chain[CHAIN_STATE]
+    for kind, param, base in chain[CHAIN_STAGES]:
+        if kind == FILTER_EMA:
+            state[base] = value << param
+        elif kind == FILTER_MEDIAN:
+            state[base] = 0
+            for i in range(param):
+                state[base + 1 + i] = value
+        else:
+            state[base] = 0
+            state[base + 1] = value << param
+            for i in range(1 << param):
+                state[base + 2 + i] = value
+    state[0] = 1
+
+
+############ runChain ############
+#                      _____ _           _
+#                     / ____| |         (_)
+#    _ __ _   _ _ __ | |    | |__   __ _ _ _ __
+#   | '__| | | | '_ \| |    | '_ \ / _` | | '_ \
+#   | |  | |_| | | | | |____| | | | (_| | | | | |
+#   |_|   \__,_|_| |_|\_____|_| |_|\__,_|_|_| |_|
+#
+#
+# Put a reading through the chain and return the filtered reading.
+#
+def runChain(chain, value):
+    state = chain[CHAIN_STATE]
+    if not state[0]:
+        fillChain(chain, value)
+    for kind, param, base in chain[CHAIN_STAGES]:
+        if kind == FILTER_EMA:
+            acc = state[base] + value - (state[base] >> param)
+            state[base] = acc
+            value = acc >> param
+        elif kind == FILTER_MEDIAN:
+            pos = state[base]
+            state[base + 1 + pos] = value
+            pos += 1
+            if pos == param:
+                pos = 0
+            state[base] = pos
+            # insertion sort the history into the scratch area.
+            hist = base + 1
+            work = hist + param
+            for i in range(param):
+                v = state[hist + i]
+                j = work + i
+                while j > work and state[j - 1] > v:
+                    state[j] = state[j - 1]
+                    j -= 1
+                state[j] = v
+            value = state[work + (param >> 1)]
+        else:
+            pos = state[base]
+            slot = base + 2 + pos
+            acc = state[base + 1] + value - state[slot]
+            state[slot] = value
+            state[base + 1] = acc
+            state[base] = (pos + 1) & ((1 << param) - 1)
+            value = acc >> param
+    return value
@@ -0,0 +1,78 @@
+
+# Compare the adaptive update rate in drivemeter.py with a fixed one.
+#
+# The simulator runs the same few seconds each way: the output sitting at
+# 12V with a little noise, a short circuit that puts the PSU into current
+# limit at 1.5A for 300ms, 12V again, then a step up to 20V.  For each run:
+#   updates  - updates per second overall, and while the output sat still
+#   jitter   - mean needle movement between updates while it sat still, in
+#              tenths of a percent of full scale
+#   response - time from each change of the output to the needle and lamps
+#              settling on the new reading (within 1% of full scale): the
+#              short, the recovery and the step
+# The adaptive run is woken at the short by the current limit interrupt and
+# at the step by the sampling core seeing the readings jump, so neither
+# waits for the next idle update.
+#
+# usage: python3 bench_adaptive.py [fixed freq]
+
+import sys
+
+import simulator
+
+SHORT_AT = 2.0
+RECOVER_AT = 2.3
+STEP_AT = 3.5
+RUN_SECS = 4.5
+QUIET = (1.0, SHORT_AT)
+
+fixedFreq = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+
+def run(freq):
+    sim = simulator.Simulator(
+        volts=simulator.piecewise([(0, 12), (SHORT_AT, 12), (SHORT_AT, 0.3),
+                                   (RECOVER_AT, 0.3), (RECOVER_AT, 12), (STEP_AT, 12),
+                                   (STEP_AT, 20)]),
+        amps=simulator.piecewise([(0, 0.1), (SHORT_AT, 0.1), (SHORT_AT, 1.5),
+                                  (RECOVER_AT, 1.5), (RECOVER_AT, 0.1)]),
+        ilim=lambda t: SHORT_AT <= t < RECOVER_AT,
+        freq=freq, noise=1)
+    meter = sim.meter
+    log = []
+    while sim.now() < RUN_SECS:
+        sim.tick()
+        log.append((sim.now(), meter.meterPerMille, meter.rangeLamps, meter.voltsMode,
+                    meter.updateHz))
+    return log
+
+
+def settledAt(log, start, end):
+    inside = [entry for entry in log if start <= entry[0] < end]
+    final = inside[-1]
+    settled = final[0]
+    for t, perMille, lamps, mode, hz in reversed(inside):
+        if abs(perMille - final[1]) > 10 or lamps != final[2] or mode != final[3]:
+            break
+        settled = t
+    return settled - start
+
+
+def summary(name, log):
+    quiet = [entry for entry in log if QUIET[0] <= entry[0] < QUIET[1]]
+    jitter = sum(abs(b[1] - a[1]) for a, b in zip(quiet, quiet[1:])) / (len(quiet) - 1)
+    quietRate = len(quiet) / (QUIET[1] - QUIET[0])
+    short = settledAt(log, SHORT_AT, RECOVER_AT)
+    recover = settledAt(log, RECOVER_AT, STEP_AT)
+    step = settledAt(log, STEP_AT, RUN_SECS)
+    print('%-9s %6.1f updates/s, %5.1f/s still  jitter %5.2f  '
+          'response %3.0fms short, %3.0fms recover, %3.0fms step' %
+          (name, len(log) / RUN_SECS, quietRate, jitter, short * 1000, recover * 1000,
+           step * 1000))
+
+
+summary('%dHz' % fixedFreq, run(fixedFreq))
+adaptive = run(None)
+summary('adaptive', adaptive)
+rates = sorted(set(entry[4] for entry in adaptive))
+print('adaptive rates used: %s Hz' % ', '.join(str(hz) for hz in rates))
@@ -0,0 +1,108 @@
+
+# Compare the DAC and front panel output backends in drivemeter.py on the host.
+#
+# For each backend, time a sweep of every code to every other code and count
+# how many intermediate codes appear on GPIO0-7 between the old and new value.
+# The single-write port and PIO backends should show none.
+# The same goes for the front panel: every range and mode change is made with
+# writePanel each way and any in-between lamp states are counted.  Last, the
+# output side of a meter update - a panel change and a needle move - is timed
+# for each backend.
+# The PIO backend is run last, as once the state machines have the pins the
+# SIO writes of the other backends no longer reach them.  On the host the
+# times only compare the Python each backend runs; on the pico, set
+# PROFILE_TICKS and compare the meter and lamps stages of tickprof.report().
+#
+# usage: python3 bench_dac.py
+
+import time
+
+import hostenv
+import machine
+
+meter = hostenv.loadProgram('drivemeter.py')
+
+
+def sweep(driveDAC):
+    for old in range(256):
+        for new in range(256):
+            driveDAC(old)
+            driveDAC(new)
+
+
+def countGlitches(driveDAC):
+    glitches = 0
+    for old in range(256):
+        for new in range(256):
+            driveDAC(old)
+            del machine.outputLog[:]
+            machine.logOutputs = True
+            driveDAC(new)
+            machine.logOutputs = False
+            for state in machine.outputLog:
+                if state & meter.DAC_BITS_MASK != new:
+                    glitches += 1
+    return glitches
+
+
+# every range lamp pattern in both modes, to every other.
+panelStates = [flag | (meter.VOLTS_RANGES[r][meter.RANGE_LAMP] << meter.PANEL_LAMPS_SHIFT)
+               for flag in (meter.PANEL_VOLTS_FLAG, meter.PANEL_ILIM_FLAG)
+               for r in range(len(meter.VOLTS_RANGES))]
+
+
+def panelFlicker():
+    flickers = 0
+    start = time.perf_counter()
+    for old in panelStates:
+        for new in panelStates:
+            meter.writePanel(old)
+            del machine.outputLog[:]
+            machine.logOutputs = True
+            meter.writePanel(new)
+            machine.logOutputs = False
+            for state in machine.outputLog:
+                if state & meter.PANEL_MASK != new:
+                    flickers += 1
+    elapsed = time.perf_counter() - start
+    return elapsed * 1e6 / len(panelStates) ** 2, flickers
+
+
+def updateCost(driveDAC):
+    updates = 0
+    start = time.perf_counter()
+    for code in range(0, 256, 4):
+        for state in panelStates:
+            meter.writePanel(state)
+            driveDAC(code)
+            updates += 1
+    return (time.perf_counter() - start) * 1e6 / updates
+
+
+def usePio():
+    meter.dacSm, meter.lampsSm = meter.initPioOutputs()
+    meter.USE_PORT_WRITES = True
+    return meter.driveMeterDACPio
+
+
+def usePort():
+    meter.USE_PORT_WRITES = True
+    return meter.driveMeterDACPort
+
+
+def usePins():
+    meter.USE_PORT_WRITES = False
+    return meter.driveMeterDACPins
+
+
+for name, backend in (('port', usePort), ('pins', usePins), ('pio', usePio)):
+    driveDAC = backend()
+    start = time.perf_counter()
+    sweep(driveDAC)
+    elapsed = time.perf_counter() - start
+    print('%-5s %6.2f us/write  %6d intermediate codes' %
+          (name, elapsed * 1e6 / (2 * 256 * 256), countGlitches(driveDAC)))
+    usPerChange, flickers = panelFlicker()
+    print('panel %-5s %6.2f us/change  %6d in-between states' % (name, usPerChange, flickers))
+    print('update %-4s %6.2f us for the panel and needle' % (name, updateCost(driveDAC)))
+meter.USE_PORT_WRITES = True
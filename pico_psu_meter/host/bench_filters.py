@@ -0,0 +1,120 @@
+
+# Check and benchmark the reading filters in filters.py on the host.
+#
+# Each filter chain is fed a waveform of volts readings and compared with a
+# plain Python version of the same filter, then timed per reading.  For each
+# chain the output is summed up as:
+#   jitter - mean change between successive readings, what the needle shows
+#   spike  - furthest the output strays from the clean waveform
+#   settle - readings taken to get within 1% of a step and stay there
+# The built in waveform is 10V with SMPS ripple and noise on top, a few load
+# transient spikes, then a step up to 12V.  A recorded waveform, one reading
+# in volts per line, can be given instead; spike and settle are then measured
+# against the recording itself.
+#
+# usage: python3 bench_filters.py [recording.txt]
+
+import math
+import random
+import statistics
+import sys
+import time
+
+import hostenv
+import filters
+
+CHAINS = (
+    [],
+    [['ema', 2]],
+    [['ema', 4]],
+    [['median', 3]],
+    [['median', 5]],
+    [['boxcar', 2]],
+    [['boxcar', 4]],
+    [['median', 3], ['ema', 2]],
+)
+STEP_AT = 1500
+READINGS = 2000
+
+# readings are ADC counts with RDG_FRAC_BITS of fraction, scaled as the
+# meter scales them.
+meter = hostenv.loadProgram('drivemeter.py')
+VOLTS_PER_RDG = meter.VOLTS_PER_RDG
+
+
+def builtinWaveform():
+    rand = random.Random(1)
+    clean = []
+    noisy = []
+    for n in range(READINGS):
+        volts = 10.0 if n < STEP_AT else 12.0
+        value = volts + 0.05 * math.sin(n * 2.1) + rand.gauss(0, 0.02)
+        if n in (300, 301, 700, 1100):
+            value += 3.0
+        clean.append(volts)
+        noisy.append(value)
+    return clean, noisy
+
+
+def reference(spec, readings):
+    out = list(readings)
+    for name, param in spec:
+        result = []
+        if name == 'ema':
+            acc = out[0] << param
+            for value in out:
+                acc += value - (acc >> param)
+                result.append(acc >> param)
+        elif name == 'median':
+            for n in range(len(out)):
+                window = out[max(0, n - param + 1):n + 1]
+                window = [out[0]] * (param - len(window)) + window
+                result.append(int(statistics.median(window)))
+        else:
+            length = 1 << param
+            for n in range(len(out)):
+                window = out[max(0, n - length + 1):n + 1]
+                window = [out[0]] * (length - len(window)) + window
+                result.append(sum(window) >> param)
+        out = result
+    return out
+
+
+def settleTime(out, clean):
+    target = clean[-1]
+    for n in range(len(out) - 1, -1, -1):
+        if abs(out[n] - target) > abs(target) // 100:
+            return n + 1 - STEP_AT
+    return 0
+
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1]) as f:
+        noisy = [float(line) for line in f if line.strip()]
+    clean = noisy
+else:
+    clean, noisy = builtinWaveform()
+readings = [max(0, int(v / VOLTS_PER_RDG)) for v in noisy]
+cleanRdgs = [int(v / VOLTS_PER_RDG) for v in clean]
+errors = 0
+
+for spec in CHAINS:
+    chain = filters.makeChain(spec)
+    out = [filters.runChain(chain, value) for value in readings]
+    if out != reference(spec, readings):
+        print('%s: output differs from the reference filter' % spec)
+        errors += 1
+
+    filters.resetChain(chain)
+    start = time.perf_counter()
+    for value in readings:
+        filters.runChain(chain, value)
+    usPerRdg = (time.perf_counter() - start) * 1e6 / len(readings)
+
+    jitter = sum(abs(b - a) for a, b in zip(out, out[1:])) / (len(out) - 1)
+    spike = max(abs(a - b) for a, b in zip(out, cleanRdgs))
+    settle = settleTime(out, cleanRdgs) if len(sys.argv) == 1 else 0
+    print('%-28s %5.2f us  jitter %6.4fV  spike %6.3fV  settle %3d' %
+          (spec or 'none', usPerRdg, jitter * VOLTS_PER_RDG, spike * VOLTS_PER_RDG, settle))
+
+print('%d errors' % errors)
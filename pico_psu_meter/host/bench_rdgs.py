@@ -0,0 +1,130 @@
+# Benchmark the averaging stage of drivemeter.py on the host.
+#
+# Each way the meter can get its readings is timed, and tracemalloc shows
+# how much memory a tick leaves allocated:
+#   readAdcs        - the blocking read_u16 loop plus working out the
+#                     averages, for each ring buffer window
+#   readCapture     - a DMA capture block added to the ring buffers plus the
+#                     averages, for each window, with captureBuf the size it
+#                     is without USE_OVERSAMPLING
+#   readOversampled - the sums of one deep DMA block, for each depth.  The
+#                     viper sumCapture runs as plain Python here, so the time
+#                     is nothing like the pico's, and it's slow enough that
+#                     these only run a twentieth of the ticks
+# The fake DMA fills each block between ticks, outside the timing and the
+# memory figures.  CPython boxes every int above 256, so the peak shows
+# those short-lived temporaries; what matters is that nothing is left behind
+# tick after tick, so retained is what drivemeter.py's own allocations grew
+# by over a second run of ticks, after a first one under tracemalloc has set
+# up whatever is kept for good (the last sums, say).
+#
+# usage: python3 bench_rdgs.py [ticks]
+
+import array
+import sys
+import time
+import tracemalloc
+
+import hostenv
+import machine
+import utime
+
+utime.useVirtualClock()
+meter = hostenv.loadProgram('drivemeter.py')
+ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+
+def averages():
+    return (meter.opVsum >> meter.rdgWindowShift,
+            meter.opIsum >> meter.rdgWindowShift,
+            meter.op0vsum >> meter.rdgWindowShift)
+
+
+def readAdcs():
+    meter.readAdcs()
+    return averages()
+
+
+def readCapture():
+    meter.readCapture()
+    return averages()
+
+
+def readOversampled():
+    meter.readOversampled()
+    return meter.captureSums
+
+
+def nothing():
+    pass
+
+
+# memory held by whatever drivemeter.py allocated, leaving out the fakes.
+def meterBytes():
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, meter.__file__)])
+    return sum(stat.size for stat in snapshot.statistics('filename'))
+
+
+# let the block being captured finish, as it would between ticks.
+def finishCapture():
+    utime.sleep_us(max(utime.ticks_diff(meter.captureDMA.due, utime.ticks_us()), 0))
+    meter.captureDMA.active()
+
+
+def bench(name, read, prepare=nothing, ticks=ticks):
+    for n in range(ticks):
+        machine.adcValues[meter.OP_VOLTS_ADC] = (n * 977) & 0xfff0
+        prepare()
+        read()
+
+    elapsed = 0
+    for n in range(ticks):
+        prepare()
+        start = time.perf_counter()
+        read()
+        elapsed += time.perf_counter() - start
+
+    tracemalloc.start()
+    for n in range(ticks):
+        prepare()
+        read()
+    base = meterBytes()
+    peak = 0
+    for n in range(ticks):
+        prepare()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        read()
+        _, tickPeak = tracemalloc.get_traced_memory()
+        peak = max(peak, tickPeak - before)
+    retained = meterBytes() - base
+    tracemalloc.stop()
+    print('%-22s %8.1f us/tick  retained %5.2f bytes/tick  peak %d bytes' %
+          (name, elapsed * 1e6 / ticks, retained / ticks, peak))
+
+
+for shift in (3, 6, 8):
+    meter.setRdgWindow(shift)
+    bench('readAdcs %d' % (1 << shift), readAdcs)
+
+# readCapture works through all of captureBuf, so give it the buffer it has
+# without oversampling.
+oversampleBuf = meter.captureBuf
+finishCapture()
+meter.captureBuf = array.array('H', [0] * (3 * meter.CAPTURE_SAMPLES_PER_CHANNEL))
+meter.startCapture()
+for shift in (3, 6, 8):
+    meter.setRdgWindow(shift)
+    bench('readCapture %d' % (1 << shift), readCapture, finishCapture)
+
+finishCapture()
+meter.captureBuf = oversampleBuf
+for shift in (meter.OVERSAMPLE_MIN_SHIFT, meter.OVERSAMPLE_MAX_SHIFT):
+    # the depth comes from the range shown, moved by the bias.
+    meter.oversampleBias = shift - meter.VOLTS_RANGE_RDGS[meter.rangeVolts][meter.RANGE_OVERSAMPLE]
+    # one block to get the depth going.
+    finishCapture()
+    meter.readOversampled()
+    bench('readOversampled %d' % (1 << shift), readOversampled, finishCapture,
+          max(ticks // 20, 100))
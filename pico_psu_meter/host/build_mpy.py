@@ -0,0 +1,105 @@
+
+# Cross-compile the meter's modules to .mpy files for the pico with mpy-cross.
+#
+# Copied to the pico as source, every module is compiled at each boot -
+# banners, comments and all - before lampTest and the first reading.  The
+# .mpy files are already compiled, so they load quicker and leave more RAM.
+# Each module in MODULES is compiled into the build directory along with a
+# main.py that just imports drivemeter and calls its main(), so there's
+# nothing left to compile at boot.  Copy the lot to the root of the pico in
+# place of the .py files (cal-meter.py is still run from source, it needs
+# the compiled modules alongside it all the same).
+#
+# The source and compiled size of each module is printed.  With --log the
+# totals are added to the end of a file, one line per build with the date
+# and git commit, to follow them from change to change.  drivemeter.py keeps
+# the matching log of startup times on the pico, see STARTUP_LOG.
+# With --manifest a manifest.py is written too, for freezing the modules into
+# a MicroPython firmware build (FROZEN_MANIFEST=...).  Frozen modules run
+# straight from flash and don't take any RAM to load at all.
+#
+# mpy-cross comes from "pip install mpy-cross", or set MPY_CROSS to one
+# built from the MicroPython source.  Its .mpy version has to match the
+# firmware's, see the MicroPython docs on .mpy files.
+#
+# usage: python3 build_mpy.py [--out dir] [--log file] [--manifest]
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import hostenv
+
+MODULES = ('ballistics', 'calstore', 'filters', 'metercore', 'telemetry',
+           'tickprof', 'transient', 'drivemeter')
+# the RP2040's Cortex-M0+, for the viper functions.
+MARCH = 'armv6m'
+MAIN_PY = 'import drivemeter\ndrivemeter.main()\n'
+
+
+def mpyCross():
+    if os.environ.get('MPY_CROSS'):
+        return [os.environ['MPY_CROSS']]
+    if shutil.which('mpy-cross'):
+        return ['mpy-cross']
+    try:
+        import mpy_cross
+    except ImportError:
+        sys.exit('mpy-cross not found: pip install mpy-cross, or set MPY_CROSS')
+    return [sys.executable, '-m', 'mpy_cross']
+
+
+def compileModule(command, name, outDir):
+    source = os.path.join(hostenv.PROGRAM_DIR, name + '.py')
+    output = os.path.join(outDir, name + '.mpy')
+    subprocess.run(command + ['-march=' + MARCH, '-o', output, source], check=True)
+    return os.path.getsize(source), os.path.getsize(output)
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=hostenv.PROGRAM_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def writeManifest(outDir):
+    with open(os.path.join(outDir, 'manifest.py'), 'w') as f:
+        f.write('# the meter modules, frozen into the firmware, see host/build_mpy.py\n')
+        f.write('include("$(PORT_DIR)/boards/manifest.py")\n')
+        for name in MODULES:
+            f.write('module("%s.py", base_path="%s")\n' % (name, hostenv.PROGRAM_DIR))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    outDir = args[args.index('--out') + 1] if '--out' in args else \
+        os.path.join(hostenv.PROGRAM_DIR, 'build')
+    os.makedirs(outDir, exist_ok=True)
+
+    command = mpyCross()
+    version = subprocess.run(command + ['--version'], capture_output=True, text=True).stdout
+    print(version.strip())
+    totalSource = 0
+    totalMpy = 0
+    for name in MODULES:
+        sourceSize, mpySize = compileModule(command, name, outDir)
+        totalSource += sourceSize
+        totalMpy += mpySize
+        print('%-12s %7d bytes source  %6d bytes .mpy  %3d%%' %
+              (name, sourceSize, mpySize, mpySize * 100 // sourceSize))
+    print('%-12s %7d bytes source  %6d bytes .mpy  %3d%%' %
+          ('total', totalSource, totalMpy, totalMpy * 100 // totalSource))
+    with open(os.path.join(outDir, 'main.py'), 'w') as f:
+        f.write(MAIN_PY)
+    if '--manifest' in args:
+        writeManifest(outDir)
+    print('copy %s/*.mpy and main.py to the pico' % outDir)
+
+    if '--log' in args:
+        with open(args[args.index('--log') + 1], 'a') as f:
+            f.write('%s %s %d %d\n' % (time.strftime('%Y-%m-%d'), gitCommit(),
+                                       totalSource, totalMpy))
@@ -0,0 +1,106 @@
+
+# Check the needle ballistics in ballistics.py on the simulator.
+#
+# Each set of settings is run through two steps of the output volts and the
+# needle position is logged every time it moves:
+#   step  - 12V to 22V, both on the 25V range, so the needle has a long way
+#           to go on one scale
+#   range - 9V to 12V, which takes the meter from the 10V range to the 25V,
+#           so the needle has to come down from 90% to 48%.  It starts at 5V
+#           to get the meter down to the 10V range first.
+# and summed up as:
+#   slew      - fastest the needle moved over any 10ms, tenths of a percent
+#               per second
+#   overshoot - furthest it went past where it was heading, tenths of a %
+#   settle    - time from the step to within 1% of full scale and staying
+# The slew mustn't be more than the settings allow, and the calibration's
+# own settings mustn't overshoot by more than 1%: on the range step that
+# would be the needle whipping down past the new reading.  The exit status
+# is the number of failures.
+#
+# usage: python3 check_ballistics.py
+
+import sys
+
+import simulator
+
+STEP_AT = 0.2
+RUN_SECS = 1.5
+WINDOW_SECS = 0.01
+SETTINGS = (
+    None,
+    {'stiffness': 4, 'damping': 1},
+    {'stiffness': 6, 'damping': 1},
+    {'stiffness': 6, 'damping': 4},
+    {'stiffness': 8, 'damping': 3},
+    {'slew': 5000, 'range_slew': 5000},
+)
+SCENARIOS = (
+    ('step', simulator.step(12, 22, STEP_AT)),
+    ('range', simulator.piecewise([(0, 5), (0.05, 5), (0.05, 9), (STEP_AT, 9), (STEP_AT, 12)])),
+)
+
+
+def runStep(settings, volts):
+    sim = simulator.Simulator(volts=volts, needle=False)
+    meter = sim.meter
+    meter.cal['ballistics'].update(settings or {})
+    # let the range settle before the needle starts moving.
+    sim.run(STEP_AT / 2)
+    meter.startNeedle()
+    log = [(sim.now(), meter.needlePerMille)]
+    ballistics = meter.ballistics
+
+    def logPosition(perMille):
+        log.append((sim.now(), perMille))
+        meter.positionNeedle(perMille)
+
+    ballistics.drive = logPosition
+    sim.run(RUN_SECS)
+    meter.stopNeedle()
+    return log, meter.meterPerMille, meter.cal['ballistics']
+
+
+def maxSlew(log):
+    fastest = 0
+    first = 0
+    for n in range(len(log)):
+        while log[n][0] - log[first][0] > WINDOW_SECS:
+            first += 1
+        if n > first:
+            span = max(log[n][0] - log[first][0], WINDOW_SECS)
+            fastest = max(fastest, abs(log[n][1] - log[first][1]) / span)
+    return fastest
+
+
+def summary(log, target):
+    rising = target > log[0][1]
+    overshoot = 0
+    settle = 0
+    for t, p in log:
+        overshoot = max(overshoot, (p - target) if rising else (target - p))
+        if abs(p - target) > 10:
+            settle = t - STEP_AT
+    return overshoot, max(settle, 0)
+
+
+failures = 0
+for settings in SETTINGS:
+    for name, volts in SCENARIOS:
+        log, target, used = runStep(settings, volts)
+        slew = maxSlew(log)
+        overshoot, settle = summary(log, target)
+        allowed = max(used['slew'], used['range_slew'])
+        print('%-34s %-5s slew %5.0f/s  overshoot %3d  settle %5.3fs' %
+              (settings or 'calibration', name, slew, overshoot, settle))
+        # a step up of one sample's worth from starting within a window
+        # allows a little over the configured figure.
+        if slew > allowed * 1.1 + 1 / WINDOW_SECS:
+            print('  faster than the slew allows')
+            failures += 1
+        if settings is None and overshoot > 10:
+            print('  the calibration settings overshoot')
+            failures += 1
+
+print('%d failures' % failures)
+sys.exit(min(failures, 255))
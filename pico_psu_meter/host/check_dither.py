@@ -0,0 +1,91 @@
+
+# Check how finely the dithered DAC places the needle.
+#
+# The simulator slowly ramps the output from 10V to 10.6V on the 25V range,
+# about four DAC codes' worth, with the needle dithered and then without.
+# The needle is modelled as a first order lag on the DAC code with a time
+# constant of NEEDLE_TAU, which is about what the coil's inertia does, and
+# compared every millisecond with where it ought to be: the graticule
+# calibration interpolated without rounding.  For each run:
+#   error - rms and largest difference, in DAC codes
+#   jump  - largest the needle moved in any 20ms, in DAC codes, which is
+#           what shows as the needle stepping rather than creeping
+#   wobble - largest the needle moved in any 20ms while the output stood
+#            still at the end, the dithering that gets through the lag
+# The dithered needle must be closer than the plain one.  The exit status
+# is the number of failures.
+#
+# usage: python3 check_dither.py
+
+import math
+import sys
+
+import simulator
+
+RAMP = (10.0, 10.6, 1.0, 4.0)
+RUN_SECS = 5.0
+NEEDLE_TAU = 0.1
+SAMPLE_SECS = 0.001
+JUMP_SECS = 0.02
+
+
+def ideal(meter, volts):
+    perMille = volts * 1000 / 25
+    g = int(perMille // meter.GRATICULE_PERMILLE)
+    graticule = meter.METER_GRATICULE_DAC
+    frac = (perMille - g * meter.GRATICULE_PERMILLE) / meter.GRATICULE_PERMILLE
+    return graticule[g] + (graticule[g + 1] - graticule[g]) * frac
+
+
+def needlePath(dacLog, start, end):
+    path = []
+    position = dacLog[0][1]
+    entry = 0
+    code = dacLog[0][1]
+    alpha = 1 - math.exp(-SAMPLE_SECS / NEEDLE_TAU)
+    steps = int((end - start) / SAMPLE_SECS)
+    for n in range(steps):
+        t = start + n * SAMPLE_SECS
+        while entry < len(dacLog) and dacLog[entry][0] <= t:
+            code = dacLog[entry][1]
+            entry += 1
+        position += (code - position) * alpha
+        path.append((t, position))
+    return path
+
+
+def biggestMove(path, start, end):
+    window = int(JUMP_SECS / SAMPLE_SECS)
+    moves = [abs(path[n][1] - path[n - window][1])
+             for n in range(window, len(path)) if start <= path[n][0] <= end]
+    return max(moves) if moves else 0
+
+
+def run(dither):
+    volts = simulator.ramp(*RAMP)
+    sim = simulator.Simulator(volts=volts, needle=False)
+    meter = sim.meter
+    meter.USE_DITHER = dither
+    meter.startNeedle()
+    sim.run(RUN_SECS)
+    meter.stopNeedle()
+    # leave the ranging and the first swing of the needle out of it.
+    path = needlePath(sim.dacLog, 0, RUN_SECS)
+    errors = [position - ideal(meter, volts(t)) for t, position in path if t >= RAMP[2]]
+    rms = math.sqrt(sum(e * e for e in errors) / len(errors))
+    worst = max(abs(e) for e in errors)
+    jump = biggestMove(path, RAMP[2], RAMP[3])
+    wobble = biggestMove(path, RAMP[3] + 5 * NEEDLE_TAU, RUN_SECS)
+    print('%-9s error rms %5.3f max %5.3f  jump %5.3f  wobble %5.3f DAC codes, %d DAC writes' %
+          ('dithered' if dither else 'plain', rms, worst, jump, wobble, len(sim.dacLog)))
+    return rms
+
+
+dithered = run(True)
+plain = run(False)
+failures = 0
+if dithered >= plain:
+    print('dithering made the needle no closer')
+    failures += 1
+print('%d failures' % failures)
+sys.exit(failures)
@@ -0,0 +1,74 @@
+
+# Check the hand over of readings from the sampling core in drivemeter.py.
+#
+# CPython's own _thread stands in for the pico's second core: samplingLoop
+# runs in a host thread exactly as it would on core 1 while this thread plays
+# the display side, changing the ADC inputs and taking readings as fast as
+# it can.  Every set taken must hang together - the filtered readings must be
+# the ones worked out from the averages in the same set - and the sequence
+# numbers must only ever go up.  Then the display side is slowed right down
+# to show that the sampling rate doesn't suffer for it.
+#
+# usage: python3 check_handoff.py [seconds]
+
+import random
+import sys
+import time
+
+import hostenv
+import machine
+
+secs = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+meter = hostenv.loadProgram('drivemeter.py')
+machine.setInput(21, 1)
+rand = random.Random(1)
+errors = 0
+
+
+def expected(avg, zero, offset):
+    return avg - zero - offset if avg > zero + offset else 0
+
+
+def takeFor(seconds, displayDelay):
+    global errors
+    taken = 0
+    lastSeq = meter.rdgSeqTaken
+    firstSeq = meter.rdgShared[meter.RDG_SEQ]
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        machine.adcValues[meter.OP_VOLTS_ADC] = rand.randrange(0, 0xfff0)
+        machine.adcValues[meter.OP_CURR_ADC] = rand.randrange(0, 0xfff0)
+        if not meter.updateRdgs():
+            continue
+        taken += 1
+        if meter.rdgSeqTaken <= lastSeq:
+            print('sequence went from %d to %d' % (lastSeq, meter.rdgSeqTaken))
+            errors += 1
+        lastSeq = meter.rdgSeqTaken
+        if (meter.voltsRdg != expected(meter.voltsAvg, meter.zeroAvg, meter.VOLTS_ZERO_RDG) or
+                meter.currRdg != expected(meter.currAvg, meter.zeroAvg, meter.AMPS_ZERO_RDG)):
+            print('torn set of readings at %d' % lastSeq)
+            errors += 1
+        if displayDelay:
+            time.sleep(displayDelay)
+    published = meter.rdgShared[meter.RDG_SEQ] - firstSeq
+    return published / seconds, taken / seconds
+
+
+if meter.cal['filters']['volts'] or meter.cal['filters']['amps']:
+    print('filters are set in the calibration, the check needs them off')
+    sys.exit(1)
+
+for capture in (True, False):
+    if not capture:
+        meter.captureDMA = None
+    meter.startSampling()
+    for delay in (0, 0.02):
+        published, taken = takeFor(secs / 4, delay)
+        print('%-7s display %s: %7.0f sets/s published, %6.0f sets/s taken' %
+              ('dma' if capture else 'read_u16', 'slow' if delay else 'fast', published, taken))
+    meter.stopSampling()
+
+print('%d errors' % errors)
+sys.exit(min(errors, 255))
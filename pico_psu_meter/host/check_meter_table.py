@@ -0,0 +1,51 @@
+
+# Check the percent-to-DAC table built by drivemeter.py against the graticule
+# calibration points it was built from.
+#
+# The table must hit every graticule count exactly at its percentage, never
+# step backwards, and stay within one count of the float interpolation that
+# driveMeterToPercentFS used to do.  The table with fractions for dithering
+# must have the same whole counts and never step backwards either.
+#
+# usage: python3 check_meter_table.py
+
+import hostenv
+
+meter = hostenv.loadProgram('drivemeter.py')
+
+graticule = meter.METER_GRATICULE_DAC
+table = meter.meterTable
+fracTable = meter.meterFracTable
+errors = 0
+
+for g in range(len(graticule)):
+    if table[g * meter.GRATICULE_PERMILLE] != graticule[g]:
+        print('graticule %d%%: table %d, calibration %d' %
+              (g * 4, table[g * meter.GRATICULE_PERMILLE], graticule[g]))
+        errors += 1
+
+for perMille in range(1, len(table)):
+    if table[perMille] < table[perMille - 1]:
+        print('table steps backwards at %.1f%%' % (perMille / 10))
+        errors += 1
+
+for perMille in range(len(table) - 1):
+    pcVal = perMille / 1000
+    g = perMille // meter.GRATICULE_PERMILLE
+    pr = (pcVal - g * 0.04) / 0.04
+    drive = graticule[g] + int(pr * (graticule[g + 1] - graticule[g]))
+    if abs(drive - table[perMille]) > 1:
+        print('%.1f%%: table %d, interpolated %d' % (perMille / 10, table[perMille], drive))
+        errors += 1
+
+for perMille in range(len(table)):
+    if fracTable[perMille] >> meter.DITHER_FRAC_BITS != table[perMille]:
+        print('%.1f%%: fraction table %d, table %d' %
+              (perMille / 10, fracTable[perMille], table[perMille]))
+        errors += 1
+    if perMille and fracTable[perMille] < fracTable[perMille - 1]:
+        print('fraction table steps backwards at %.1f%%' % (perMille / 10))
+        errors += 1
+
+print('%d entries checked, %d errors' % (len(table), errors))
+raise SystemExit(1 if errors else 0)
@@ -0,0 +1,37 @@
+# Check that writePanel in drivemeter.py puts the front panel right when the
+# outputs weren't all off to start with.
+#
+# A soft reset on the pico leaves the GPIO_OUT register as it was, so the
+# range lamps and mode flags can already be lit when drivemeter.py starts.
+# For each preset the output register is set before the program loads, then
+# a run of panel patterns is written and the pins compared with each one.
+#
+# usage: python3 check_panel.py
+
+import hostenv
+import machine
+from metercore import PANEL_ILIM_FLAG, PANEL_LAMPS_MASK, PANEL_LAMPS_SHIFT, PANEL_MASK, \
+    PANEL_VOLTS_FLAG
+
+PRESETS = (0, PANEL_MASK, PANEL_VOLTS_FLAG | (0x004 << PANEL_LAMPS_SHIFT),
+           PANEL_ILIM_FLAG | (0x100 << PANEL_LAMPS_SHIFT))
+PATTERNS = [PANEL_VOLTS_FLAG | (1 << (PANEL_LAMPS_SHIFT + n)) for n in range(9)] + \
+    [PANEL_ILIM_FLAG | (1 << PANEL_LAMPS_SHIFT), 0, PANEL_MASK, PANEL_VOLTS_FLAG]
+
+errors = 0
+for preset in PRESETS:
+    machine.reset()
+    machine.setOutputs(preset)
+    meter = hostenv.loadProgram('drivemeter.py')
+    for bits in PATTERNS + PATTERNS[::-1]:
+        meter.writePanel(bits)
+        pins = machine.gpioOut & PANEL_MASK
+        if pins != bits:
+            print('preset %06x: wrote %06x, pins %06x' % (preset, bits, pins))
+            errors += 1
+            break
+    else:
+        lamps = (machine.gpioOut & PANEL_LAMPS_MASK) >> PANEL_LAMPS_SHIFT
+        print('preset %06x: %d patterns written, lamps end at %03x' %
+              (preset, 2 * len(PATTERNS), lamps))
+print('%d errors' % errors)
@@ -0,0 +1,148 @@
+
+# Decode the binary telemetry stream from drivemeter.py, see telemetry.py.
+#
+# A capture is just the raw bytes read from the pico's USB serial port.  The
+# decoder hunts for the sync bytes and checks each frame's checksum, so REPL
+# chatter mixed in with the frames is skipped over and counted.  Frames come
+# out as CSV, as NumPy arrays in an .npz file, or are replayed through the
+# meter program under the host fakes: each frame's averaged counts and mode
+# go through the zero offsets, filters and range logic, and the range and
+# needle position that come out are compared with the ones recorded.  The
+# DAC code isn't compared: with the needle ballistics on it's where the
+# needle had got to, not where it was heading.  That checks
+# changes to the update against real recordings without the hardware, and
+# the exit status is the number of frames that came out differently.
+#
+# usage:
+#   python3 decode_telemetry.py capture.bin                 summary
+#   python3 decode_telemetry.py capture.bin --csv out.csv
+#   python3 decode_telemetry.py capture.bin --npz out.npz   needs numpy
+#   python3 decode_telemetry.py capture.bin --replay
+#   python3 decode_telemetry.py --record /dev/ttyACM0 secs capture.bin
+#                                                           needs pyserial
+# To start the stream, run drivemeter.enableTelemetry() before meterMain, or
+# set TELEMETRY in drivemeter.py.
+
+import struct
+import sys
+import time
+
+import hostenv
+import machine
+import telemetry
+
+FIELDS = ('seq', 'flags', 'ticks', 'volts', 'amps', 'zero', 'range', 'dac', 'perMille', 'rate')
+PIN_ILIM = 21
+
+
+def decode(data):
+    frames = []
+    skipped = 0
+    pos = 0
+    end = len(data) - telemetry.FRAME_SIZE
+    while pos <= end:
+        if data[pos] != telemetry.SYNC0 or data[pos + 1] != telemetry.SYNC1:
+            pos += 1
+            skipped += 1
+            continue
+        frame = data[pos:pos + telemetry.FRAME_SIZE]
+        check = sum(frame[telemetry.CHECK_START:telemetry.CHECK_END]) & 0xff
+        if check != frame[telemetry.CHECK_END]:
+            pos += 1
+            skipped += 1
+            continue
+        frames.append(struct.unpack(telemetry.FRAME_FORMAT, frame)[2:-1])
+        pos += telemetry.FRAME_SIZE
+    return frames, skipped + len(data) - pos
+
+
+def droppedFrames(frames):
+    dropped = 0
+    for a, b in zip(frames, frames[1:]):
+        dropped += (b[0] - a[0] - 1) & 0xff
+    return dropped
+
+
+# seconds since the first frame, allowing for ticks_us wrapping round.
+def frameTimes(frames):
+    times = []
+    elapsed = 0
+    for n in range(len(frames)):
+        if n:
+            elapsed += (frames[n][2] - frames[n - 1][2]) & 0xffffffff
+        times.append(elapsed / 1000000)
+    return times
+
+
+def writeCsv(frames, fileName):
+    with open(fileName, 'w') as f:
+        f.write('time,' + ','.join(FIELDS) + '\n')
+        for t, frame in zip(frameTimes(frames), frames):
+            f.write('%.6f,' % t + ','.join(str(v) for v in frame) + '\n')
+
+
+def toArrays(frames):
+    import numpy
+    arrays = {'time': numpy.array(frameTimes(frames))}
+    columns = list(zip(*frames)) if frames else [()] * len(FIELDS)
+    for name, column in zip(FIELDS, columns):
+        arrays[name] = numpy.array(column, dtype=numpy.int64)
+    return arrays
+
+
+def record(port, secs, fileName):
+    import serial
+    with serial.Serial(port, timeout=0.1) as ser, open(fileName, 'wb') as f:
+        stop = time.time() + secs
+        while time.time() < stop:
+            f.write(ser.read(4096))
+
+
+def replay(frames):
+    meter = hostenv.loadProgram('drivemeter.py')
+    mismatches = 0
+    for n, frame in enumerate(frames):
+        seq, flags, ticks, volts, amps, zero, rangeIdx, dac, perMille, rate = frame
+        voltsMode = flags & telemetry.FLAG_VOLTS_MODE
+        machine.setInput(PIN_ILIM, voltsMode)
+        meter.scaleRdgs(volts, amps, zero, meter.rdgOut)
+        meter.takeRdgs(meter.rdgOut)
+        meter.calcModeAndRange(meter.voltsRdg, meter.currRdg)
+        meter.refreshPanel()
+        meter.refreshMeter()
+        shownRange = meter.rangeVolts if voltsMode else meter.rangeAmps
+        if shownRange != rangeIdx or meter.meterPerMille != perMille:
+            if mismatches < 10:
+                print('frame %d: range %d at %d, recorded range %d at %d' %
+                      (n, shownRange, meter.meterPerMille, rangeIdx, perMille))
+            mismatches += 1
+    print('%d of %d frames replayed differently' % (mismatches, len(frames)))
+    return mismatches
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == '--record':
+        record(args[1], float(args[2]), args[3])
+        args = args[3:]
+    if not args:
+        print('usage: decode_telemetry.py capture.bin [--csv file | --npz file | --replay]')
+        sys.exit(2)
+
+    with open(args[0], 'rb') as f:
+        frames, skipped = decode(f.read())
+    times = frameTimes(frames)
+    rate = (len(frames) - 1) / times[-1] if len(frames) > 1 and times[-1] else 0
+    rates = [frame[FIELDS.index('rate')] for frame in frames] or [0]
+    print('%d frames, %d dropped, %d bytes skipped, %.1f updates/s, %d to %dHz' %
+          (len(frames), droppedFrames(frames), skipped, rate, min(rates), max(rates)))
+
+    result = 0
+    if '--csv' in args:
+        writeCsv(frames, args[args.index('--csv') + 1])
+    if '--npz' in args:
+        import numpy
+        numpy.savez(args[args.index('--npz') + 1], **toArrays(frames))
+    if '--replay' in args:
+        result = min(replay(frames), 255)
+    sys.exit(result)
@@ -0,0 +1,296 @@
+
+# Host-side stand-in for the MicroPython machine module.
+#
+# Only the bits of machine that the meter programs use are provided.  All the
+# GPIO outputs live in one integer, just like the RP2040 SIO GPIO_OUT
+# register, so the pin-by-pin and single-write DAC backends can be compared.
+# Every change to the outputs is appended to outputLog, which makes it easy
+# to see whether the DAC went through intermediate codes on its way to a new
+# value, and passed to onOutput if that has been set.
+# Timers don't run by themselves, fireTimers calls their callbacks.  Under
+# utime's virtual clock, though, sleeping runs the callbacks of any timers
+# falling due on the way, each at the time it was due.
+# Pin interrupts are called straight from setInput when the edge matches.
+# Pins handed over to a PIO state machine (see rp2.StateMachine) follow what
+# it puts out and ignore the SIO register, as on the real chip, so gpioOut
+# is always what's on the pins and sioOut is the SIO GPIO_OUT register.
+
+import array
+import itertools
+
+import utime
+
+SIO_BASE = 0xd0000000
+SIO_GPIO_IN = SIO_BASE + 0x004
+SIO_GPIO_OUT = SIO_BASE + 0x010
+SIO_GPIO_OUT_SET = SIO_BASE + 0x014
+SIO_GPIO_OUT_CLR = SIO_BASE + 0x018
+SIO_GPIO_OUT_XOR = SIO_BASE + 0x01c
+
+ADC_BASE = 0x4004c000
+ADC_CS = ADC_BASE + 0x00
+ADC_FCS = ADC_BASE + 0x08
+ADC_DIV = ADC_BASE + 0x10
+ADC_CS_READY = 0x00000100
+
+gpioOut = 0
+gpioIn = 0
+sioOut = 0
+pioPins = 0
+pioOut = 0
+outputLog = []
+logOutputs = False
+onOutput = None
+timers = []
+pinIrqs = {}
+# last value written to the ADC DIV register, rp2.DMA uses it for pacing.
+adcDiv = 0
+
+# The voltage on each ADC input, in raw 16 bit units.  The bottom four bits
+# are kept as a fraction of an ADC count, each sample is quantised to 12 bits
+# like the real thing, after adding the next value from adcNoise if that has
+# been set.  Noise that varies from sample to sample is what lets oversampling
+# see below one count.
+adcValues = [0, 0, 0, 0, 0]
+adcNoise = None
+_noisePos = 0
+# noisy samples for each ADC value seen lately, see sampleAdcBlock.
+_noiseBlocks = {}
+NOISE_BLOCKS = 64
+
+
+def reset():
+    global gpioOut, gpioIn, logOutputs, onOutput, adcDiv, sioOut, pioPins, pioOut
+    gpioOut = 0
+    sioOut = 0
+    pioPins = 0
+    pioOut = 0
+    gpioIn = 0
+    del outputLog[:]
+    logOutputs = False
+    onOutput = None
+    del timers[:]
+    pinIrqs.clear()
+    adcDiv = 0
+    adcValues[:] = [0] * len(adcValues)
+    setAdcNoise(None)
+
+
+# a write to the SIO GPIO_OUT register.
+def setOutputs(value):
+    global sioOut
+    sioOut = value
+    _updatePins()
+
+
+# the PIO outputs for the pins in mask, handing them over to the PIO.
+def setPioOutputs(mask, value):
+    global pioPins, pioOut
+    pioPins |= mask
+    pioOut = (pioOut & ~mask) | (value & mask)
+    _updatePins()
+
+
+def _updatePins():
+    global gpioOut
+    value = (sioOut & ~pioPins) | (pioOut & pioPins)
+    if value != gpioOut:
+        gpioOut = value
+        if logOutputs:
+            outputLog.append(value)
+        if onOutput is not None:
+            onOutput(value)
+
+
+def setInput(pinId, level):
+    global gpioIn
+    was = gpioIn
+    if level:
+        gpioIn |= (1 << pinId)
+    else:
+        gpioIn &= ~(1 << pinId)
+    changed = (was ^ gpioIn) & (1 << pinId)
+    if changed and pinId in pinIrqs:
+        pin, handler, trigger = pinIrqs[pinId]
+        if trigger & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+            handler(pin)
+
+
+def setAdcNoise(noise):
+    global adcNoise, _noisePos
+    adcNoise = noise
+    _noisePos = 0
+    _noiseBlocks.clear()
+
+
+def sampleAdc(channel):
+    global _noisePos
+    value = adcValues[channel]
+    if adcNoise:
+        value += adcNoise[_noisePos]
+        _noisePos += 1
+        if _noisePos == len(adcNoise):
+            _noisePos = 0
+    return min(max(int(value), 0), 0xffff) & 0xfff0
+
+
+# count 12 bit samples, as the ADC FIFO gives them, going round channels 0,
+# 1 and 2 into buf.  The same as sampleAdc for each but done in bulk, for
+# rp2.DMA - a deep oversampling block is 12k samples every update.  For each
+# ADC value the samples with the noise added are worked out once, twice
+# round the noise so any run of them is one slice, and kept while the value
+# keeps coming up; a block is then three slice copies.
+def sampleAdcBlock(buf, count):
+    global _noisePos
+    for channel in range(3):
+        n = len(range(channel, count, 3))
+        value = adcValues[channel]
+        if not adcNoise:
+            sample = min(max(int(value), 0), 0xffff) >> 4
+            buf[channel:count:3] = array.array('H', [sample]) * n
+            continue
+        if n > len(adcNoise):
+            noise = itertools.islice(itertools.cycle(adcNoise), _noisePos, _noisePos + n)
+            samples = array.array('H', [min(max(int(value + x), 0), 0xffff) >> 4 for x in noise])
+        else:
+            samples = _noiseBlocks.get(value)
+            if samples is None:
+                if len(_noiseBlocks) >= NOISE_BLOCKS:
+                    _noiseBlocks.clear()
+                samples = array.array('H', [min(max(int(value + x), 0), 0xffff) >> 4
+                                            for x in adcNoise * 2])
+                _noiseBlocks[value] = samples
+            samples = samples[_noisePos:_noisePos + n]
+        _noisePos = (_noisePos + n) % len(adcNoise)
+        buf[channel:count:3] = samples
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pinId, mode=IN, pull=None, value=None):
+        self.pinId = pinId
+        self.mode = mode
+        self.mask = 1 << pinId
+        if value is not None:
+            self.value(value)
+
+    def value(self, level=None):
+        if level is None:
+            if self.mode == Pin.OUT:
+                return 1 if gpioOut & self.mask else 0
+            return 1 if gpioIn & self.mask else 0
+        if level:
+            setOutputs(sioOut | self.mask)
+        else:
+            setOutputs(sioOut & ~self.mask)
+
+    def high(self):
+        setOutputs(sioOut | self.mask)
+
+    def low(self):
+        setOutputs(sioOut & ~self.mask)
+
+    on = high
+    off = low
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        if handler is None:
+            pinIrqs.pop(self.pinId, None)
+        else:
+            pinIrqs[self.pinId] = (self, handler, trigger)
+        return None
+
+
+class ADC:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def read_u16(self):
+        return sampleAdc(self.channel)
+
+
+class Timer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, timerId=-1, **kwargs):
+        self.callback = None
+        self.freq = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, freq=-1, period=-1, callback=None, hard=True):
+        self.mode = mode
+        self.freq = freq if freq > 0 else 1000 / period
+        self.callback = callback
+        self.periodUs = 1000000 / self.freq
+        self.due = utime.ticks_us() + self.periodUs
+        if self not in timers:
+            timers.append(self)
+
+    def deinit(self):
+        self.callback = None
+        if self in timers:
+            timers.remove(self)
+
+
+# the timers due by endUs, for utime's virtual sleep.
+def runTimersUntil(endUs):
+    while True:
+        due = [timer for timer in timers if timer.callback is not None and timer.due <= endUs]
+        if not due:
+            return
+        timer = min(due, key=lambda timer: timer.due)
+        utime.setVirtualTime(int(timer.due))
+        timer.due += timer.periodUs
+        timer.callback(timer)
+        if timer.mode == Timer.ONE_SHOT:
+            timer.deinit()
+
+
+utime.timerHook = runTimersUntil
+
+
+def fireTimers():
+    for timer in list(timers):
+        if timer.callback is not None:
+            timer.callback(timer)
+            if timer.mode == Timer.ONE_SHOT:
+                timer.deinit()
+
+
+# Memory mapped register access, only the SIO GPIO registers are emulated.
+# The ADC always looks idle with an empty FIFO, rp2.DMA does the capturing,
+# but the sample rate set in DIV is kept for it.
+class _Mem32:
+    def __getitem__(self, addr):
+        if addr == SIO_GPIO_OUT:
+            return sioOut
+        if addr == SIO_GPIO_IN:
+            return gpioIn
+        if addr == ADC_CS:
+            return ADC_CS_READY
+        return 0
+
+    def __setitem__(self, addr, value):
+        global adcDiv
+        if addr == ADC_DIV:
+            adcDiv = value
+        elif addr == SIO_GPIO_OUT:
+            setOutputs(value)
+        elif addr == SIO_GPIO_OUT_SET:
+            setOutputs(sioOut | value)
+        elif addr == SIO_GPIO_OUT_CLR:
+            setOutputs(sioOut & ~value)
+        elif addr == SIO_GPIO_OUT_XOR:
+            setOutputs(sioOut ^ value)
+
+
+mem32 = _Mem32()
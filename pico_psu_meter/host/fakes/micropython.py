@@ -0,0 +1,39 @@
+
+# Host-side stand-in for the MicroPython micropython module.
+#
+# The code emitters are no-ops under CPython.  Viper functions get at buffers
+# through ptr8/ptr16/ptr32, which are builtins on the pico, so they're added
+# to the builtins here as pass-throughs - indexing the array itself does the
+# same job.  Viper's 32 bit integer wrap-around isn't emulated.
+
+import builtins
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+def viper(func):
+    return func
+
+
+def schedule(func, arg):
+    func(arg)
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def _ptr(buf):
+    return buf
+
+
+builtins.ptr8 = _ptr
+builtins.ptr16 = _ptr
+builtins.ptr32 = _ptr
@@ -0,0 +1,100 @@
+
+# Host-side stand-in for the MicroPython rp2 module.
+#
+# DMA only knows about the ADC capture that drivemeter.py does: a transfer
+# from the ADC FIFO stays active for as long as the ADC would take to do
+# that many conversions at the rate set in its DIV register, then fills the
+# whole block with the round-robin samples of channels 0, 1 and 2 from
+# machine.sampleAdc.  The time is utime's, so it's virtual in the simulator.
+#
+# PIO programs aren't run.  A state machine just copies each word put into
+# it onto its out pins, which is all the output programs in drivemeter.py
+# do, and takes the pins over from the SIO when it's made.
+
+import machine
+import utime
+
+ADC_FIFO = machine.ADC_BASE + 0x0c
+ADC_CLOCK_HZ = 48000000
+
+
+class DMA:
+    def __init__(self):
+        self.count = 0
+        self.due = 0
+
+    def pack_ctrl(self, **kwargs):
+        return 0
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        self.read = read
+        self.write = write
+        self.count = count
+        if trigger:
+            self.active(1)
+
+    def active(self, value=None):
+        if value is None:
+            if self.count and utime.ticks_diff(utime.ticks_us(), self.due) >= 0:
+                self.fill()
+            return self.count > 0
+        if value:
+            cycles = (machine.adcDiv >> 8) + 1
+            self.due = utime.ticks_add(utime.ticks_us(),
+                                       self.count * cycles * 1000000 // ADC_CLOCK_HZ)
+
+    def fill(self):
+        if self.read == ADC_FIFO:
+            machine.sampleAdcBlock(self.write, self.count)
+        self.count = 0
+
+    def close(self):
+        pass
+
+
+class PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+
+
+class _Program:
+    def __init__(self, outCount):
+        self.outCount = outCount
+
+
+def asm_pio(out_init=None, **kwargs):
+    if out_init is None:
+        outCount = 0
+    elif isinstance(out_init, tuple):
+        outCount = len(out_init)
+    else:
+        outCount = 1
+    return lambda program: _Program(outCount)
+
+
+class StateMachine:
+    def __init__(self, smId, program, freq=-1, out_base=None, **kwargs):
+        self.base = out_base.pinId if out_base is not None else 0
+        self.mask = ((1 << program.outCount) - 1) << self.base
+        self.running = False
+        self.fifo = []
+        machine.setPioOutputs(self.mask, 0)
+
+    def put(self, value, shift=0):
+        self.fifo.append(value >> shift)
+        if self.running:
+            self.drain()
+
+    def drain(self):
+        for value in self.fifo:
+            machine.setPioOutputs(self.mask, value << self.base)
+        del self.fifo[:]
+
+    def active(self, value=None):
+        if value is None:
+            return self.running
+        self.running = bool(value)
+        if self.running:
+            self.drain()
@@ -0,0 +1,67 @@
+
+# Host-side stand-in for the MicroPython utime module.
+#
+# The ticks follow the host clock but sleeping only moves a virtual offset on,
+# so lampTest and friends don't hold up a benchmark run.  It does give any
+# other thread a turn though, as a loop on the pico's second core would be
+# sleeping to let the first one get on.  With virtual set the
+# host clock is ignored and time only moves on when something sleeps, which
+# is what the simulator uses to step through time, and machine.Timer
+# callbacks are run through timerHook as their times come round.
+
+import time as _time
+
+_offsetUs = 0
+virtual = False
+timerHook = None
+
+
+def useVirtualClock(startUs=0):
+    global virtual, _offsetUs
+    virtual = True
+    _offsetUs = startUs
+
+
+def setVirtualTime(us):
+    global _offsetUs
+    _offsetUs = us
+
+
+def ticks_us():
+    if virtual:
+        return _offsetUs
+    return int(_time.perf_counter() * 1000000) + _offsetUs
+
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+
+def ticks_diff(new, old):
+    return new - old
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def sleep_us(us):
+    global _offsetUs
+    end = _offsetUs + int(us)
+    if virtual and timerHook is not None:
+        timerHook(end)
+    _offsetUs = end
+    if not virtual:
+        _time.sleep(0)
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+def sleep(s):
+    sleep_us(s * 1000000)
+
+
+def time():
+    return ticks_ms() // 1000
@@ -0,0 +1,34 @@
+
+# Helpers for running the Pico programs under CPython.
+#
+# The fakes directory holds stand-ins for the MicroPython modules (machine,
+# utime ...) and goes on the front of sys.path so the programs import those
+# instead of failing.  The program directory goes on the path too, as the
+# root of the pico's filesystem would, for the modules the programs import.
+# Programs are loaded from their file names because cal-meter.py isn't a
+# valid module name.
+# metercore is dropped before each load so that it sets up the pins afresh,
+# as it does when a program boots on the pico.
+
+import importlib.util
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKES_DIR = os.path.join(HOST_DIR, 'fakes')
+PROGRAM_DIR = os.path.dirname(HOST_DIR)
+
+if FAKES_DIR not in sys.path:
+    sys.path.insert(0, FAKES_DIR)
+if PROGRAM_DIR not in sys.path:
+    sys.path.insert(1, PROGRAM_DIR)
+
+
+def loadProgram(fileName='drivemeter.py'):
+    sys.modules.pop('metercore', None)
+    moduleName = os.path.splitext(fileName)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(
+        moduleName, os.path.join(PROGRAM_DIR, fileName))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,70 @@
+
+# Measure how quickly the front panel follows the current limit input.
+#
+# Runs the drivemeter.py update tasks under CPython, once with the current
+# limit interrupt and once polling the input at each tick, while a task
+# flips the input at random moments - with a little contact bounce on each
+# change.  The time from the first edge to the ILim flag LED changing is
+# taken from the fake GPIO outputs, and the program's own figures from
+# reportIlim are printed for the interrupt run.
+#
+# usage: python3 ilim_latency.py [freq] [changes]
+
+import asyncio
+import random
+import sys
+import time
+
+import hostenv
+import machine
+
+PIN_ILIM = 21
+PIN_ILIM_FLAG = 20
+
+freq = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+changes = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+
+async def flipInput(meter, latencies):
+    rand = random.Random(1)
+    level = 1
+    await asyncio.sleep(0.2)
+    for n in range(changes):
+        await asyncio.sleep(rand.uniform(0.05, 0.15))
+        level = 1 - level
+        edge = time.perf_counter()
+        # bounce: the edge, back, and forward again before settling.
+        machine.setInput(PIN_ILIM, level)
+        machine.setInput(PIN_ILIM, 1 - level)
+        machine.setInput(PIN_ILIM, level)
+        wanted = 0 if level else 1
+        while (machine.gpioOut >> PIN_ILIM_FLAG) & 1 != wanted:
+            await asyncio.sleep(0)
+        latencies.append((time.perf_counter() - edge) * 1000)
+
+
+async def run(meter):
+    latencies = []
+    main = asyncio.create_task(meter.meterMain(freq, changes // 5 + 2))
+    await flipInput(meter, latencies)
+    await main
+    return latencies
+
+
+for useIrq in (False, True):
+    machine.reset()
+    machine.setInput(PIN_ILIM, 1)
+    meter = hostenv.loadProgram('drivemeter.py')
+    meter.STARTUP_LOG = None
+    meter.USE_ILIM_IRQ = useIrq
+    # filling the fake DMA blocks takes milliseconds of host time, and a
+    # sampling thread fights the event loop for the GIL, either of which
+    # would swamp what's being measured.
+    meter.captureDMA = None
+    meter.USE_SAMPLING_CORE = False
+    latencies = sorted(asyncio.run(run(meter)))
+    print('%-7s %d changes  median %.1fms  max %.1fms' %
+          ('irq' if useIrq else 'polled', len(latencies),
+           latencies[len(latencies) // 2], latencies[-1]))
+    if useIrq:
+        meter.reportIlim()
@@ -0,0 +1,571 @@
+
+# Replay recorded raw ADC traces through the meter's ranging offline.
+#
+# A trace is the raw 12 bit volts, amps and 0V counts and the current limit
+# input, sample by sample, with the time of each sample.  The replay runs the
+# meter's updates over it at a fixed rate.  Each update averages the last few
+# samples of each channel, as drivemeter.py does with USE_OVERSAMPLING on:
+# one block of 2**shift samples, shift being the RANGE_OVERSAMPLE of the
+# range shown when the block started plus a bias (0 on the meter with the
+# adaptive rate left out).  With --ring it averages the last 2**window
+# instead, as the ring buffers do without oversampling.  Either way the
+# samples before the start of the trace count as zeros, and the averages go
+# through scaleRdgs, calcModeAndRange and refreshMeter - the zero offsets,
+# filters, range logic and meter table of drivemeter.py itself, loaded under
+# the host fakes.  The trace's samples are taken to be the ones the meter
+# would average, whatever rate they were recorded at.
+# Out come the range, needle position and DAC code of every update and:
+#   changes - range and mode changes
+#   hunts   - changes straight back to the range shown before the last
+#             change, within HUNT_SECS of it
+#   settle  - from a range change after the range had stayed put for
+#             SETTLE_SECS, until it stays put for that long again with the
+#             needle within SETTLE_PERMILLE throughout.  Mean and worst.
+# The needle ballistics, dithering and adaptive update rate are left out;
+# the DAC code is where the needle is being sent.
+#
+# To tune the ranging, the up and down limits of every range (or just the
+# one given with --range) can be scaled, and the averaging changed - the
+# oversampling bias, or the window with --ring.
+# --sweep tries every combination of a grid of them at once with NumPy:
+# the same averaging and range logic done on arrays, one element per
+# combination, so thousands take seconds.  It can't use a filter chain
+# from the calibration, so set those to [] first.  --check replays a few
+# combinations both ways and compares them update by update.
+#
+# Traces are read from CSV with a header line naming the columns - time (in
+# seconds) or us (microseconds), volts, amps, zero and ilim (1 while the PSU
+# is in current limit), all of them needed - so the output of
+# transient.dump() can be replayed as it is.  Or from the binary format here,
+# TRACE_MAGIC then one TRACE_FORMAT record per sample: microseconds, volts,
+# amps, zero, ilim.  --demo makes up a trace of a noisy supply being turned
+# up, shorted and let go - at each channel's share of OVERSAMPLE_RATE_HZ, so
+# it takes a few seconds, unless with --ring.
+#
+# usage:
+#   python3 replay.py trace.csv|trace.bin|--demo [options]
+#     --bias n              add n to every range's oversample shift
+#     --ring                average with the ring buffers instead
+#     --window n            average 2**n samples per update with --ring
+#     --up x --down y       scale the range up / down limits
+#     --range n             only scale range n's limits (7 is 25V)
+#     --hz n                updates per second, METER_UPDATE_HZ by default
+#     --log file            the replay update by update as CSV
+#     --save file.bin       write the trace in the binary format
+#     --sweep               sweep --biases (or --windows), --ups and --downs,
+#                           needs numpy
+#     --biases -2:2 --windows 3:8 --ups 1:1.5:0.05 --downs 0.5:1.5:0.05
+#                           the grid, first:last[:step]
+#     --csv file            every combination's results from the sweep
+#     --check               compare the NumPy and drivemeter.py replays
+#   python3 replay.py --help prints this.
+
+import bisect
+import itertools
+import random
+import struct
+import sys
+import time
+
+import hostenv
+import machine
+import simulator
+
+TRACE_MAGIC = b'PMT1'
+TRACE_FORMAT = '<IHHHB'
+TRACE_RECORD = struct.calcsize(TRACE_FORMAT)
+ZERO_COUNTS = 16
+PIN_ILIM = 21
+HUNT_SECS = 0.5
+SETTLE_SECS = 0.2
+SETTLE_PERMILLE = 20
+# amps ranges go in range codes after the volts ones.
+AMPS_CODE = 16
+DEMO_SECS = 8
+DEMO_RATE_HZ = 800
+
+
+class Trace:
+    def __init__(self, times, volts, amps, zero, ilim):
+        self.times = times
+        self.volts = volts
+        self.amps = amps
+        self.zero = zero
+        self.ilim = ilim
+
+
+def readCsv(fileName):
+    with open(fileName) as f:
+        names = f.readline().strip().split(',')
+        rows = [line.strip().split(',') for line in f if line.strip()]
+    columns = {name: [float(row[n]) for row in rows] for n, name in enumerate(names)}
+    # without ilim the replay would never see current limit, and a made up
+    # 0V would shift every reading.
+    missing = [name for name in ('volts', 'amps', 'zero', 'ilim') if name not in columns]
+    if 'time' not in columns and 'us' not in columns:
+        missing.insert(0, 'time or us')
+    if missing:
+        raise ValueError('%s has no %s column' % (fileName, ', '.join(missing)))
+    if 'time' in columns:
+        times = columns['time']
+    else:
+        times = [us / 1000000 for us in columns['us']]
+
+    def counts(name):
+        return [int(value) for value in columns[name]]
+
+    return Trace(times, counts('volts'), counts('amps'), counts('zero'), counts('ilim'))
+
+
+def readBinary(fileName):
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+        raise ValueError('%s is not a trace' % fileName)
+    data = data[len(TRACE_MAGIC):]
+    data = data[:len(data) - len(data) % TRACE_RECORD]
+    records = list(struct.iter_unpack(TRACE_FORMAT, data))
+    us, volts, amps, zero, ilim = (list(column) for column in zip(*records)) if records \
+        else ([], [], [], [], [])
+    return Trace([t / 1000000 for t in us], volts, amps, zero, ilim)
+
+
+def readTrace(fileName):
+    with open(fileName, 'rb') as f:
+        binary = f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+    return readBinary(fileName) if binary else readCsv(fileName)
+
+
+def writeBinary(trace, fileName):
+    start = trace.times[0] if trace.times else 0
+    with open(fileName, 'wb') as f:
+        f.write(TRACE_MAGIC)
+        for t, v, a, z, i in zip(trace.times, trace.volts, trace.amps, trace.zero, trace.ilim):
+            f.write(struct.pack(TRACE_FORMAT, int((t - start) * 1000000 + 0.5), v, a, z, i))
+
+
+# a supply turned up through the ranges, sitting just under 25V for a while,
+# shorted at 1.5A, let go and turned down again, with ripple and noise.
+# Sampled at the rate the averaging sees them: each channel's share of the
+# ADC when oversampling, DEMO_RATE_HZ for the ring buffers.
+def demoTrace(meter, rate=DEMO_RATE_HZ):
+    volts = simulator.piecewise([(0, 0.05), (1, 0.05), (2.5, 24.8), (4, 24.8), (4, 0.2),
+                                 (4.5, 0.2), (4.5, 24.8), (5, 24.8), (7, 3), (DEMO_SECS, 3)])
+    amps = simulator.piecewise([(0, 0.02), (4, 0.02), (4, 1.5), (4.5, 1.5), (4.5, 0.02),
+                                (DEMO_SECS, 0.02)])
+    rand = random.Random(1)
+    trace = Trace([], [], [], [], [])
+    # 100Hz ripple whatever the rate.
+    ripplePeriod = max(rate // 100, 2)
+    for n in range(DEMO_SECS * rate):
+        t = n / rate
+        ripple = 0.15 * ((n % ripplePeriod) - (ripplePeriod - 1) / 2) / ((ripplePeriod - 1) / 2)
+        trace.times.append(t)
+        trace.zero.append(ZERO_COUNTS + int(rand.gauss(0, 1.5) + 0.5))
+        trace.volts.append(ZERO_COUNTS + max(0, int((volts(t) + ripple) / meter.VOLTS_PER_ADC_STEP
+                                                  + rand.gauss(0, 1) + 0.5)))
+        trace.amps.append(ZERO_COUNTS + max(0, int(amps(t) / meter.AMPS_PER_ADC_STEP
+                                                 + rand.gauss(0, 3) + 0.5)))
+        trace.ilim.append(1 if 4 <= t < 4.5 else 0)
+    return trace
+
+
+def loadMeter():
+    meter = hostenv.loadProgram('drivemeter.py')
+    meter.STARTUP_LOG = None
+    return meter
+
+
+# the range tables of drivemeter.py with the up and down limits scaled, of
+# every range or just the one given.
+def rangeTables(meter, up=1.0, down=1.0, only=None):
+    ranges = []
+    for n, meterRange in enumerate(meter.VOLTS_RANGES):
+        if only is None or n == only:
+            meterRange = list(meterRange)
+            meterRange[meter.RANGE_UP_LIM] *= up
+            meterRange[meter.RANGE_DOWN_LIM] *= down
+        ranges.append(tuple(meterRange))
+    ampsRanges = ranges[:len(meter.AMPS_RANGES)]
+    return (meter.buildRangeRdgs(ranges, meter.VOLTS_PER_RDG),
+            meter.buildRangeRdgs(ampsRanges, meter.AMPS_PER_RDG))
+
+
+# the times of the updates, and how many samples each one has to average.
+def updatePoints(trace, updateHz):
+    times = []
+    ends = []
+    if not trace.times:
+        return times, ends
+    n = 1
+    t = trace.times[0] + n / updateHz
+    while t <= trace.times[-1]:
+        times.append(t)
+        ends.append(bisect.bisect_right(trace.times, t))
+        n += 1
+        t = trace.times[0] + n / updateHz
+    return times, ends
+
+
+def prefixSums(values):
+    return [0] + list(itertools.accumulate(values))
+
+
+# the depth of the block readOversampled starts for the range shown, moved
+# by the bias.
+def oversampleShift(meter, bias):
+    if meter.voltsMode:
+        shift = meter.VOLTS_RANGE_RDGS[meter.rangeVolts][meter.RANGE_OVERSAMPLE]
+    else:
+        shift = meter.AMPS_RANGE_RDGS[meter.rangeAmps][meter.RANGE_OVERSAMPLE]
+    return min(max(shift + bias, meter.OVERSAMPLE_MIN_SHIFT), meter.OVERSAMPLE_MAX_SHIFT)
+
+
+# Replay the trace through drivemeter.py, averaging oversampled blocks moved
+# by the bias given, or with ring set the last 2**window samples.  Returns
+# the update times and the range code, needle position (tenths of a
+# percent) and DAC code of each.
+def replay(meter, trace, window, updateHz, up=1.0, down=1.0, only=None, ring=False):
+    meter.VOLTS_RANGE_RDGS, meter.AMPS_RANGE_RDGS = rangeTables(meter, up, down, only)
+    meter.rangeVolts = meter.VOLTS_TOP_RANGE
+    meter.rangeAmps = meter.AMPS_TOP_RANGE
+    meter.voltsMode = 1
+    times, ends = updatePoints(trace, updateHz)
+    sumVolts = prefixSums(trace.volts)
+    sumAmps = prefixSums(trace.amps)
+    sumZero = prefixSums(trace.zero)
+    frac = meter.RDG_FRAC_BITS
+    rdgs = meter.rdgOut
+    codes = []
+    perMilles = []
+    dacs = []
+    for end in ends:
+        # the block ending now was started for the range of the last update.
+        shift = window if ring else oversampleShift(meter, window)
+        start = max(end - (1 << shift), 0)
+        meter.scaleRdgs(((sumVolts[end] - sumVolts[start]) << frac) >> shift,
+                        ((sumAmps[end] - sumAmps[start]) << frac) >> shift,
+                        ((sumZero[end] - sumZero[start]) << frac) >> shift, rdgs)
+        meter.takeRdgs(rdgs)
+        machine.setInput(PIN_ILIM, not trace.ilim[end - 1])
+        meter.calcModeAndRange(meter.voltsRdg, meter.currRdg)
+        meter.refreshMeter()
+        if meter.voltsMode:
+            codes.append(meter.rangeVolts)
+        else:
+            codes.append(AMPS_CODE + meter.rangeAmps)
+        perMilles.append(meter.meterPerMille)
+        dacs.append(meter.meterDac)
+    return times, codes, perMilles, dacs
+
+
+def settleUpdates(updateHz):
+    return max(1, int(SETTLE_SECS * updateHz + 0.5))
+
+
+def metrics(times, codes, perMilles, updateHz):
+    count = len(codes)
+    hold = settleUpdates(updateHz)
+    # held at n: no range change for the next hold updates, or to the end of
+    # the replay.  Steady: held, with the needle within the band too.
+    held = []
+    steady = []
+    for n in range(count):
+        following = range(n + 1, min(n + hold, count - 1) + 1)
+        held.append(all(codes[k] == codes[n] for k in following))
+        steady.append(held[-1] and all(abs(perMilles[k] - perMilles[n]) <= SETTLE_PERMILLE
+                                       for k in following))
+    nextSteady = [0] * count
+    following = count - 1
+    for n in range(count - 1, -1, -1):
+        if steady[n]:
+            following = n
+        nextSteady[n] = following
+
+    changes = 0
+    hunts = 0
+    settles = []
+    before = -1
+    lastChange = None
+    for n in range(1, count):
+        if codes[n] == codes[n - 1]:
+            continue
+        changes += 1
+        if codes[n] == before and times[n] - lastChange <= HUNT_SECS:
+            hunts += 1
+        before = codes[n - 1]
+        lastChange = times[n]
+        if n > hold and held[n - 1 - hold]:
+            settles.append(times[nextSteady[n]] - times[n])
+    meanSettle = sum(settles) / len(settles) if settles else 0
+    return changes, hunts, meanSettle, max(settles) if settles else 0
+
+
+def parseRange(text, kind):
+    parts = [kind(part) for part in text.split(':')]
+    if len(parts) == 1:
+        return [parts[0]]
+    first, last = parts[0], parts[1]
+    stepSize = parts[2] if len(parts) > 2 else kind(1)
+    values = []
+    n = 0
+    while first + n * stepSize <= last + stepSize / 1000:
+        values.append(round(first + n * stepSize, 6) if kind is float else first + n * stepSize)
+        n += 1
+    return values
+
+
+# The replay done with NumPy for every combination of bias (or window, with
+# ring set), up and down scales at once.  Returns arrays, one row per update
+# and one column per combination, of range codes, needle positions and DAC
+# codes.
+def sweep(meter, trace, windows, ups, downs, updateHz, only=None, ring=False):
+    import numpy
+
+    grid = list(itertools.product(windows, ups, downs))
+    combos = len(grid)
+    window = numpy.array([combo[0] for combo in grid], dtype=numpy.int64)
+
+    # range tables for each combination, built once per pair of scales.
+    tables = {}
+    for combo in grid:
+        if combo[1:] not in tables:
+            tables[combo[1:]] = rangeTables(meter, combo[1], combo[2], only)
+
+    def tableArray(mode, field):
+        return numpy.array([[meterRange[field] for meterRange in tables[combo[1:]][mode]]
+                            for combo in grid], dtype=numpy.int64)
+
+    voltsUp = tableArray(0, meter.RANGE_UP_LIM)
+    voltsDown = tableArray(0, meter.RANGE_DOWN_LIM)
+    voltsScale = tableArray(0, meter.RANGE_FULL_SCALE)
+    ampsUp = tableArray(1, meter.RANGE_UP_LIM)
+    ampsDown = tableArray(1, meter.RANGE_DOWN_LIM)
+    ampsScale = tableArray(1, meter.RANGE_FULL_SCALE)
+    voltsOversample = tableArray(0, meter.RANGE_OVERSAMPLE)
+    ampsOversample = tableArray(1, meter.RANGE_OVERSAMPLE)
+    meterTable = numpy.array(list(meter.meterTable), dtype=numpy.int64)
+
+    times, ends = updatePoints(trace, updateHz)
+    sums = [numpy.concatenate(([0], numpy.cumsum(numpy.array(values, dtype=numpy.int64))))
+            for values in (trace.volts, trace.amps, trace.zero)]
+    frac = meter.RDG_FRAC_BITS
+    voltsZero = meter.VOLTS_ZERO_RDG
+    ampsZero = meter.AMPS_ZERO_RDG
+    columns = numpy.arange(combos)
+    rangeVolts = numpy.full(combos, meter.VOLTS_TOP_RANGE, dtype=numpy.int64)
+    rangeAmps = numpy.full(combos, meter.AMPS_TOP_RANGE, dtype=numpy.int64)
+    codes = numpy.zeros((len(ends), combos), dtype=numpy.int64)
+    perMilles = numpy.zeros((len(ends), combos), dtype=numpy.int64)
+
+    def nextRange(rangeIdx, reading, upLim, downLim):
+        top = upLim.shape[1] - 1
+        for n in range(top):
+            move = (rangeIdx < top) & (reading > upLim[columns, rangeIdx])
+            if not move.any():
+                break
+            rangeIdx = rangeIdx + move
+        for n in range(top):
+            move = (rangeIdx > 0) & (reading < downLim[columns, rangeIdx])
+            if not move.any():
+                break
+            rangeIdx = rangeIdx - move
+        return rangeIdx
+
+    voltsMode = True
+    for n, end in enumerate(ends):
+        if ring:
+            shift = window
+        elif voltsMode:
+            shift = numpy.clip(voltsOversample[columns, rangeVolts] + window,
+                               meter.OVERSAMPLE_MIN_SHIFT, meter.OVERSAMPLE_MAX_SHIFT)
+        else:
+            shift = numpy.clip(ampsOversample[columns, rangeAmps] + window,
+                               meter.OVERSAMPLE_MIN_SHIFT, meter.OVERSAMPLE_MAX_SHIFT)
+        start = numpy.maximum(end - numpy.left_shift(1, shift), 0)
+        volts, amps, zero = (numpy.right_shift(numpy.left_shift(total[end] - total[start], frac),
+                                               shift) for total in sums)
+        voltsMode = not trace.ilim[end - 1]
+        if trace.ilim[end - 1]:
+            amps = numpy.where(amps > zero + ampsZero, amps - zero - ampsZero, 0)
+            rangeAmps = nextRange(rangeAmps, amps, ampsUp, ampsDown)
+            rangeVolts[:] = meter.VOLTS_TOP_RANGE
+            codes[n] = AMPS_CODE + rangeAmps
+            perMilles[n] = amps * 1000 // ampsScale[columns, rangeAmps]
+        else:
+            volts = numpy.where(volts > zero + voltsZero, volts - zero - voltsZero, 0)
+            rangeVolts = nextRange(rangeVolts, volts, voltsUp, voltsDown)
+            rangeAmps[:] = meter.AMPS_TOP_RANGE
+            codes[n] = rangeVolts
+            perMilles[n] = volts * 1000 // voltsScale[columns, rangeVolts]
+    dacs = meterTable[numpy.clip(perMilles, 0, meter.METER_MAX_PERMILLE)]
+    return grid, numpy.array(times), codes, perMilles, dacs
+
+
+# metrics for every column of a sweep, as metrics does for one replay.
+def sweepMetrics(times, codes, perMilles, updateHz):
+    import numpy
+
+    count, combos = codes.shape
+    hold = settleUpdates(updateHz)
+    # pad with copies of the last update so the steady test runs to the end.
+    padCodes = numpy.concatenate((codes, numpy.repeat(codes[-1:], hold, axis=0)))
+    padPerMilles = numpy.concatenate((perMilles, numpy.repeat(perMilles[-1:], hold, axis=0)))
+    held = numpy.ones((count, combos), dtype=bool)
+    steady = numpy.ones((count, combos), dtype=bool)
+    for k in range(1, hold + 1):
+        held &= padCodes[k:k + count] == codes
+        steady &= numpy.abs(padPerMilles[k:k + count] - perMilles) <= SETTLE_PERMILLE
+    steady &= held
+    rows = numpy.arange(count)[:, None]
+    nextSteady = numpy.where(steady, rows, count - 1)
+    nextSteady = numpy.minimum.accumulate(nextSteady[::-1], axis=0)[::-1]
+
+    changed = codes[1:] != codes[:-1]
+    changes = changed.sum(axis=0)
+    hunts = numpy.zeros(combos, dtype=numpy.int64)
+    before = numpy.full(combos, -1, dtype=numpy.int64)
+    lastChange = numpy.full(combos, -numpy.inf)
+    for n in numpy.flatnonzero(changed.any(axis=1)) + 1:
+        change = changed[n - 1]
+        hunts += change & (codes[n] == before) & (times[n] - lastChange <= HUNT_SECS)
+        before = numpy.where(change, codes[n - 1], before)
+        lastChange = numpy.where(change, times[n], lastChange)
+
+    # a change at n counts if the range had been held from n - 1 - hold.
+    events = changed.copy()
+    events[:hold] = False
+    events[hold:] &= held[:count - 1 - hold]
+    settle = numpy.where(events, times[nextSteady[1:]] - times[1:, None], 0)
+    eventCount = events.sum(axis=0)
+    meanSettle = settle.sum(axis=0) / numpy.maximum(eventCount, 1)
+    return changes, hunts, meanSettle, settle.max(axis=0)
+
+
+def summary(name, result):
+    changes, hunts, meanSettle, worstSettle = result
+    print('%-28s %4d changes  %3d hunts  settle mean %4.0fms worst %4.0fms' %
+          (name, changes, hunts, meanSettle * 1000, worstSettle * 1000))
+
+
+def averaging(window, ring):
+    return ('window %d' if ring else 'bias %+d') % window
+
+
+def check(meter, trace, updateHz, only, ring):
+    if ring:
+        grid = [(meter.RDG_WINDOW_SHIFT, 1.0, 1.0), (3, 0.9, 0.65), (8, 0.8, 0.5), (5, 1.2, 1.5)]
+    else:
+        grid = [(0, 1.0, 1.0), (-2, 0.9, 0.65), (2, 0.8, 0.5), (-4, 1.2, 1.5)]
+    windows = sorted(set(combo[0] for combo in grid))
+    ups = sorted(set(combo[1] for combo in grid))
+    downs = sorted(set(combo[2] for combo in grid))
+    swept = sweep(meter, trace, windows, ups, downs, updateHz, only, ring)
+    sweptGrid, times, codes, perMilles, dacs = swept
+    sweptResults = sweepMetrics(times, codes, perMilles, updateHz)
+    differences = 0
+    for combo in grid:
+        column = sweptGrid.index(combo)
+        replayed = replay(meter, trace, combo[0], updateHz, combo[1], combo[2], only, ring)
+        name = '%s up %.2f down %.2f' % ((averaging(combo[0], ring),) + combo[1:])
+        for field, mine, theirs in (('range', replayed[1], codes[:, column]),
+                                   ('perMille', replayed[2], perMilles[:, column]),
+                                   ('dac', replayed[3], dacs[:, column])):
+            wrong = sum(1 for a, b in zip(mine, theirs) if a != b)
+            if wrong:
+                print('%s: %d updates with a different %s' % (name, wrong, field))
+                differences += wrong
+        result = metrics(replayed[0], replayed[1], replayed[2], updateHz)
+        fromSweep = tuple(float(value[column]) for value in sweptResults)
+        if any(abs(a - b) > 1e-9 for a, b in zip(result, fromSweep)):
+            print('%s: metrics %s, swept %s' % (name, result, fromSweep))
+            differences += 1
+    print('%d differences' % differences)
+    return differences
+
+
+def option(args, name, default, kind):
+    return kind(args[args.index(name) + 1]) if name in args else default
+
+
+# the comment at the top of this file, up to the imports.
+def usage():
+    with open(__file__) as f:
+        for line in f:
+            if line.startswith('#'):
+                print(line[2:].rstrip())
+            elif line.strip():
+                break
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] in ('--help', '-h'):
+        usage()
+        sys.exit(0 if args else 2)
+
+    meter = loadMeter()
+    # the ring buffers only average when oversampling is left out.
+    ring = '--ring' in args or not meter.USE_OVERSAMPLING
+    try:
+        if args[0] == '--demo':
+            trace = demoTrace(meter, DEMO_RATE_HZ if ring else meter.OVERSAMPLE_RATE_HZ // 3)
+        else:
+            trace = readTrace(args[0])
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+    updateHz = option(args, '--hz', meter.METER_UPDATE_HZ, int)
+    if ring:
+        window = option(args, '--window', meter.RDG_WINDOW_SHIFT, int)
+    else:
+        window = option(args, '--bias', 0, int)
+    up = option(args, '--up', 1.0, float)
+    down = option(args, '--down', 1.0, float)
+    only = option(args, '--range', None, int)
+    if '--save' in args:
+        writeBinary(trace, args[args.index('--save') + 1])
+    span = trace.times[-1] - trace.times[0] if trace.times else 0
+    print('%d samples over %.2fs, %d updates at %dHz' %
+          (len(trace.times), span, len(updatePoints(trace, updateHz)[1]), updateHz))
+
+    start = time.perf_counter()
+    times, codes, perMilles, dacs = replay(meter, trace, window, updateHz, up, down, only, ring)
+    elapsed = time.perf_counter() - start
+    summary('%s up %.2f down %.2f' % (averaging(window, ring), up, down),
+            metrics(times, codes, perMilles, updateHz))
+    print('replayed in %.3fs, %.0f updates/s' % (elapsed, len(times) / max(elapsed, 1e-9)))
+    if '--log' in args:
+        with open(args[args.index('--log') + 1], 'w') as f:
+            f.write('time,range,perMille,dac\n')
+            for row in zip(times, codes, perMilles, dacs):
+                f.write('%.6f,%d,%d,%d\n' % row)
+
+    result = 0
+    if '--check' in args:
+        result = min(check(meter, trace, updateHz, only, ring), 255)
+    if '--sweep' in args:
+        if ring:
+            windows = parseRange(option(args, '--windows', '3:8', str), int)
+        else:
+            windows = parseRange(option(args, '--biases', '-2:2', str), int)
+        ups = parseRange(option(args, '--ups', '1.0', str), float)
+        downs = parseRange(option(args, '--downs', '0.5:1.5:0.05', str), float)
+        start = time.perf_counter()
+        grid, times, codes, perMilles, dacs = sweep(meter, trace, windows, ups, downs,
+                                                    updateHz, only, ring)
+        changes, hunts, meanSettle, worstSettle = sweepMetrics(times, codes, perMilles, updateHz)
+        elapsed = time.perf_counter() - start
+        print('swept %d combinations in %.2fs' % (len(grid), elapsed))
+        best = sorted(range(len(grid)),
+                      key=lambda n: (hunts[n], changes[n], worstSettle[n], meanSettle[n]))
+        for n in best[:10]:
+            summary('%s up %.2f down %.2f' % ((averaging(grid[n][0], ring),) + grid[n][1:]),
+                    (changes[n], hunts[n], meanSettle[n], worstSettle[n]))
+        if '--csv' in args:
+            with open(args[args.index('--csv') + 1], 'w') as f:
+                f.write('%s,up,down,changes,hunts,settle_mean,settle_worst\n' %
+                        ('window' if ring else 'bias'))
+                for n, combo in enumerate(grid):
+                    f.write('%d,%g,%g,%d,%d,%.4f,%.4f\n' % (combo + (
+                        changes[n], hunts[n], meanSettle[n], worstSettle[n])))
+    sys.exit(result)
@@ -0,0 +1,54 @@
+
+# Run the drivemeter.py asyncio scheduler under CPython with the fake pins.
+#
+# The output voltage ramps up and down between 0 and 30V while the tasks run
+# for a few seconds, then the achieved update rate and the number of range
+# changes are printed.  With --profile the tick profile is printed too.
+#
+# usage: python3 run_meter.py [freq] [seconds] [--profile]
+
+import asyncio
+import sys
+
+import hostenv
+import machine
+
+meter = hostenv.loadProgram('drivemeter.py')
+# the startup log is for the pico's flash.
+meter.STARTUP_LOG = None
+profile = '--profile' in sys.argv
+if profile:
+    sys.argv.remove('--profile')
+    meter.enableProfiling()
+freq = int(sys.argv[1]) if len(sys.argv) > 1 else meter.METER_UPDATE_HZ
+secs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+updates = 0
+rangeChanges = 0
+updateRdgs = meter.updateRdgs
+writePanel = meter.writePanel
+
+
+def countedUpdateRdgs():
+    global updates
+    updates += 1
+    volts = 30 * abs(((updates / freq) % 2) - 1)
+    machine.adcValues[meter.OP_VOLTS_ADC] = int(volts / meter.VOLTS_PER_ADC_STEP) << 4
+    return updateRdgs()
+
+
+def countedWritePanel(bits):
+    global rangeChanges
+    if (bits ^ meter.panelShadow) & meter.PANEL_LAMPS_MASK:
+        rangeChanges += 1
+    writePanel(bits)
+
+
+meter.updateRdgs = countedUpdateRdgs
+meter.writePanel = countedWritePanel
+machine.setInput(21, 1)
+asyncio.run(meter.meterMain(freq, secs))
+print('%d updates in %ds (%.1f Hz asked for %d Hz), %d range changes' %
+      (updates, secs, updates / secs, freq, rangeChanges))
+if profile:
+    meter.tickprof.report()
@@ -0,0 +1,238 @@
+
+# Hardware simulator for drivemeter.py.
+#
+# Runs the meter program under CPython against the fake machine, utime and
+# rp2 modules, feeding the ADCs and the current limit input from scripted
+# waveforms.  Time is virtual: each tick moves the clock on by one update
+# period, so thousands of ticks run per second of host time.
+#
+# Every DAC code written and every change of the front panel lamps is logged
+# with the simulated time it happened at:
+#   dacLog  - list of (seconds, dac code)
+#   lampLog - list of (seconds, range lamp pattern, volts flag, ilim flag)
+#
+# Waveforms are just functions of time in seconds.  constant, step, ramp,
+# sine and piecewise make the usual ones.  noise is the standard deviation, in
+# ADC counts, of gaussian noise added to every ADC sample.  The time starts
+# at 0 when the Simulator is made and lampTest takes the first 1.5s of it,
+# so set the waveforms after the lamp test for a step to land after it.
+#
+# usage:
+#   sim = Simulator(amps=constant(0.1))
+#   sim.lampTest()
+#   sim.volts = step(0, 40, sim.now() + 0.5)
+#   sim.run(2.0)
+#   print(sim.dacLog[-1], sim.lampLog)
+#
+# The needle ballistics run as they would on the pico when the calibration
+# has them on, their timer stepping the needle as the virtual clock goes by,
+# so dacLog shows the needle's path between readings.  needle=False puts the
+# needle straight on each reading instead.
+#
+# Without freq the update rate is the meter's own: adaptive, going up and
+# down with what the output is doing, unless USE_ADAPTIVE_RATE is off.
+# Giving freq fixes it.  While it's idle the inputs are looked at every busy
+# period between updates, standing in for the pico's current limit interrupt
+# (rateWake, then the next update a busy period on) and the sampling core
+# waking an update when the readings jump by more than WAKE_COUNTS (once the
+# capture block with the jump in it is done).
+#
+# With telemetry set to a file name every update is also written there as
+# telemetry frames, for host/decode_telemetry.py.
+#
+# or python3 simulator.py [ticks] to time a 0V to 40V step scenario.
+
+import random
+import sys
+import time
+
+import hostenv
+import machine
+import utime
+
+PIN_ILIM = 21
+PIN_ILIM_FLAG = 20
+PIN_VOLTS_FLAG = 22
+LAMPS_SHIFT = 10
+LAMPS_MASK = 0x1FF
+DAC_MASK = 0xFF
+
+
+def constant(value):
+    return lambda t: value
+
+
+def step(before, after, at):
+    return lambda t: after if t >= at else before
+
+
+def ramp(start, end, t0, t1):
+    def wave(t):
+        if t <= t0:
+            return start
+        if t >= t1:
+            return end
+        return start + (end - start) * (t - t0) / (t1 - t0)
+    return wave
+
+
+def sine(mean, amplitude, hz):
+    import math
+    return lambda t: mean + amplitude * math.sin(2 * math.pi * hz * t)
+
+
+# straight lines between (time, value) points, held flat either side.
+def piecewise(points):
+    def wave(t):
+        if t <= points[0][0]:
+            return points[0][1]
+        for (ta, va), (tb, vb) in zip(points, points[1:]):
+            if t < tb:
+                return va + (vb - va) * (t - ta) / (tb - ta)
+        return points[-1][1]
+    return wave
+
+
+# the same sums as drivemeter.sumCapture, with C speed slice sums.
+def hostSumCapture(buf, count, sums):
+    sums[0] = sum(buf[0:count:3])
+    sums[1] = sum(buf[1:count:3])
+    sums[2] = sum(buf[2:count:3])
+
+
+class Simulator:
+    def __init__(self, volts=constant(0), amps=constant(0), ilim=constant(False),
+                 freq=None, zeroCounts=16, noise=0, capture=True, seed=1, telemetry=None,
+                 needle=True):
+        machine.reset()
+        utime.useVirtualClock()
+        self.meter = hostenv.loadProgram('drivemeter.py')
+        # sumCapture is viper on the pico, a line of Python per sample here.
+        self.meter.sumCapture = hostSumCapture
+        if not capture:
+            self.meter.captureDMA = None
+        if needle and self.meter.USE_BALLISTICS:
+            self.meter.startNeedle()
+        self.telemetryFile = None
+        if telemetry:
+            self.telemetryFile = open(telemetry, 'wb')
+            self.meter.enableTelemetry(self.telemetryFile)
+        self.volts = volts
+        self.amps = amps
+        self.ilim = ilim
+        self.freq = freq
+        if not freq and self.meter.USE_ADAPTIVE_RATE:
+            self.meter.adaptiveRate = True
+            self.meter.setUpdateRate(False)
+        self.zeroCounts = zeroCounts
+        self.noise = noise
+        self.random = random.Random(seed)
+        if noise:
+            # a prime length so the noise doesn't line up with the channels
+            machine.setAdcNoise([self.random.gauss(0, noise) * 16 for n in range(4099)])
+        self.ticks = 0
+        self.dacLog = []
+        self.lampLog = []
+        self.lastOutputs = machine.gpioOut
+        machine.onOutput = self.outputChanged
+        self.setInputs()
+
+    def now(self):
+        return utime.ticks_us() / 1000000
+
+    def outputChanged(self, value):
+        changed = value ^ self.lastOutputs
+        self.lastOutputs = value
+        if changed & DAC_MASK:
+            self.dacLog.append((self.now(), value & DAC_MASK))
+        if changed & ((LAMPS_MASK << LAMPS_SHIFT) | (1 << PIN_ILIM_FLAG) | (1 << PIN_VOLTS_FLAG)):
+            self.lampLog.append((self.now(), (value >> LAMPS_SHIFT) & LAMPS_MASK,
+                                 (value >> PIN_VOLTS_FLAG) & 1, (value >> PIN_ILIM_FLAG) & 1))
+
+    def counts(self, value, perStep):
+        return (self.zeroCounts + value / perStep) * 16
+
+    # put the waveform values for the current time on the ADCs and ILim input
+    def setInputs(self):
+        t = self.now()
+        meter = self.meter
+        machine.adcValues[meter.OP_VOLTS_ADC] = self.counts(self.volts(t), meter.VOLTS_PER_ADC_STEP)
+        machine.adcValues[meter.OP_CURR_ADC] = self.counts(self.amps(t), meter.AMPS_PER_ADC_STEP)
+        machine.adcValues[meter.OP_0V_ADC] = self.counts(0, 1)
+        # the input is low when current limit is active
+        machine.setInput(PIN_ILIM, not self.ilim(t))
+
+    def lampTest(self):
+        self.meter.lampTest()
+
+    def tick(self):
+        self.setInputs()
+        self.meter.meterUpdate()
+        if self.telemetryFile:
+            self.meter.telemetry.flush()
+        self.ticks += 1
+        self.wait(1000000 // (self.freq or self.meter.updateHz))
+
+    # wait us for the next update, or less when the meter would be woken
+    # early, see the top of this file.
+    def wait(self, us):
+        meter = self.meter
+        if not meter.adaptiveRate or meter.rateBusy:
+            utime.sleep_us(us)
+            return
+        step = 1000000 // meter.BUSY_UPDATE_HZ
+        wake = meter.WAKE_COUNTS * 16
+        ilim = self.ilim(self.now())
+        volts = machine.adcValues[meter.OP_VOLTS_ADC]
+        amps = machine.adcValues[meter.OP_CURR_ADC]
+        while us > 0:
+            utime.sleep_us(min(step, us))
+            us -= step
+            self.setInputs()
+            if meter.USE_ILIM_IRQ and self.ilim(self.now()) != ilim:
+                meter.rateWake(None)
+                utime.sleep_us(step)
+                return
+            if meter.USE_SAMPLING_CORE and (
+                    abs(machine.adcValues[meter.OP_VOLTS_ADC] - volts) > wake or
+                    abs(machine.adcValues[meter.OP_CURR_ADC] - amps) > wake):
+                # the sampling core wakes it once the block with the jump
+                # in it is done.
+                if meter.captureDMA is not None:
+                    utime.sleep_us(max(utime.ticks_diff(meter.captureDMA.due, utime.ticks_us()), 0))
+                return
+
+    def runTicks(self, ticks):
+        for n in range(ticks):
+            self.tick()
+
+    def run(self, seconds):
+        end = utime.ticks_us() + int(seconds * 1000000)
+        while utime.ticks_us() < end:
+            self.tick()
+
+    def close(self):
+        if self.telemetryFile:
+            self.telemetryFile.close()
+            self.telemetryFile = None
+
+    def dacCode(self):
+        return machine.gpioOut & DAC_MASK
+
+    def lamps(self):
+        return (machine.gpioOut >> LAMPS_SHIFT) & LAMPS_MASK
+
+
+if __name__ == '__main__':
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sim = Simulator(noise=0.5)
+    # the lamp test takes a while of virtual time, so step after it.
+    sim.lampTest()
+    sim.volts = step(0, 40, sim.now() + 0.5)
+    start = time.perf_counter()
+    sim.runTicks(ticks)
+    elapsed = time.perf_counter() - start
+    print('%d ticks in %.2fs, %.0f ticks/s' % (ticks, elapsed, ticks / elapsed))
+    print('%d DAC writes, %d lamp changes' % (len(sim.dacLog), len(sim.lampLog)))
+    for entry in sim.lampLog[:8]:
+        print('%8.3fs lamps %03x volts %d ilim %d' % entry)
@@ -0,0 +1,196 @@
+# _________________________________________
+#/ The hardware both meter programs share: \
+#| the pins, the ADC channels, the R-2R    |
+#| DAC that drives the needle and the      |
+#| front panel lamps. drivemeter.py and    |
+#| cal-meter.py both import it rather than |
+#| each setting up the pins for            |
+#| themselves, so the wiring is only       |
+#\ written down once.                      /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# note: copy this to the pico alongside the programs that import it.
+
+import machine
+from machine import Pin, mem32
+
+# set gpio23 high for continuous PWM SMPS operation.
+modeSmps = Pin(23, Pin.OUT)
+modeSmps.value(1)
+
+# An 8-bit R2R ladder DAC is used to drive the meter via a
+# single transistor V->I converter 
+# Range of meter is 0 to 1mA
+bit0 = Pin(0, Pin.OUT)
+bit1 = Pin(1, Pin.OUT)
+bit2 = Pin(2, Pin.OUT)
+bit3 = Pin(3, Pin.OUT)
+bit4 = Pin(4, Pin.OUT)
+bit5 = Pin(5, Pin.OUT)
+bit6 = Pin(6, Pin.OUT)
+bit7 = Pin(7, Pin.OUT)
+dacBits = (bit0, bit1, bit2, bit3, bit4, bit5, bit6, bit7)
+DAC_BITS_MASK = 0xFF
+
+# The RP2040 SIO block holds the output state of all the GPIOs in one
+# register, with set/clear/xor aliases for single-write updates.
+# Set USE_PORT_WRITES to False to fall back to driving the DAC pin by pin.
+USE_PORT_WRITES = True
+SIO_BASE = 0xd0000000
+SIO_GPIO_OUT = SIO_BASE + 0x010
+SIO_GPIO_OUT_XOR = SIO_BASE + 0x01c
+
+led = Pin(25, Pin.OUT)
+
+# meter range indication leds
+pin100m = Pin(10,  Pin.OUT)
+pin250m = Pin(11,  Pin.OUT)
+pin500m = Pin(12, Pin.OUT)
+pin1v   = Pin(13, Pin.OUT)
+pin2v5  = Pin(14, Pin.OUT)
+pin5v   = Pin(15, Pin.OUT)
+pin10v  = Pin(16, Pin.OUT)
+
+
+pin25v  = Pin(17, Pin.OUT)
+pin50v  = Pin(18, Pin.OUT)
+
+# GPIO Pin 21 is used to detect current limit mode.
+# Input = 0 when current limit is active. 
+pinILim = Pin(21, Pin.IN)
+# GPIO Pin 20 drives the red front panel Imode LED to mirror the control board LED.
+PinIlimFlag = Pin(20, Pin.OUT)
+# GPIO Pin 22 compliments to indicate voltage mode. 
+PinVoltsFlag = Pin(22, Pin.OUT)
+
+# The range lamps and mode flags as bits of the SIO GPIO_OUT register, for
+# writing the whole panel at once.  The lamps are in the same order as the
+# range lamp patterns below.
+PANEL_LAMPS_SHIFT = 10
+PANEL_LAMPS_MASK = 0x1FF << PANEL_LAMPS_SHIFT
+PANEL_ILIM_FLAG = 1 << 20
+PANEL_VOLTS_FLAG = 1 << 22
+PANEL_MASK = PANEL_LAMPS_MASK | PANEL_ILIM_FLAG | PANEL_VOLTS_FLAG
+panelPins = ((1 << 10, pin100m), (1 << 11, pin250m), (1 << 12, pin500m),
+             (1 << 13, pin1v), (1 << 14, pin2v5), (1 << 15, pin5v),
+             (1 << 16, pin10v), (1 << 17, pin25v), (1 << 18, pin50v),
+             (PANEL_ILIM_FLAG, PinIlimFlag), (PANEL_VOLTS_FLAG, PinVoltsFlag))
+
+# GPIO Pin 19 is the power indicator.
+PinPwr = Pin(19, Pin.OUT)
+
+# onboard led (channel 25) is used to indicate how much time the processor is
+# spending awake.  If it never switches off, slow down the scheduling timer. 
+led.value(0)
+
+### Aliases for the indicator lamps ###
+RANGE_INDICATOR_LAMP_100m = 0x001
+RANGE_INDICATOR_LAMP_250m = 0x002
+RANGE_INDICATOR_LAMP_500m = 0x004
+RANGE_INDICATOR_LAMP_1 =    0x008
+RANGE_INDICATOR_LAMP_2P5 =  0x010
+RANGE_INDICATOR_LAMP_5 =    0x020
+RANGE_INDICATOR_LAMP_10 =   0x040
+RANGE_INDICATOR_LAMP_25 =   0x080
+RANGE_INDICATOR_LAMP_50 =   0x100
+RANGE_INDICATOR_LAMPS_ALL = 0x1FF
+RANGE_INDICATOR_LAMPS_NONE = 0
+
+
+### functions ###
+
+############ openAdcs ############
+#                                       _
+#                              /\      | |
+#     ___  _ __   ___ _ __    /  \   __| | ___ ___
+#    / _ \| '_ \ / _ \ '_ \  / /\ \ / _` |/ __/ __|
+#   | (_) | |_) |  __/ | | |/ ____ \ (_| | (__\__ \
+#    \___/| .__/ \___|_| |_/_/    \_\__,_|\___|___/
+#         | |
+#         |_|
+# ADC Channels
+#=============
+# Which ADC reads what is down to the wiring, so it comes from the
+# calibration (see calstore.py) rather than being fixed here:
+#   volts - direct reading of output voltage
+#   amps  - current is read as a voltage across a 0.3 ohm resistor
+#   zero  - 0v output is measured to offset various physical effects
+# Returns the three ADCs in that order.
+#
+def openAdcs(channels):
+    return (machine.ADC(channels['volts']),
+            machine.ADC(channels['amps']),
+            machine.ADC(channels['zero']))
+
+
+############ readAverage ############
+#                       _
+#                      | |   /\
+#    _ __ ___  __ _  __| |  /  \__   _____ _ __ __ _  __ _  ___
+#   | '__/ _ \/ _` |/ _` | / /\ \ \ / / _ \ '__/ _` |/ _` |/ _ \
+#   | | |  __/ (_| | (_| |/ ____ \ V /  __/ | | (_| | (_| |  __/
+#   |_|  \___|\__,_|\__,_/_/    \_\_/ \___|_|  \__,_|\__, |\___|
+#                                                     __/ |
+#                                                    |___/
+# Read an ADC count times and return the average, shifted to give the range
+# 0 - 4095.  Blocks for the whole time - fine for calibrating, drivemeter.py
+# keeps running averages of its own.
+#
+def readAverage(adc, count):
+    total = 0
+    for i in range(count):
+        total += adc.read_u16()>>4
+    return total // count
+
+
+#
+############ driveMeterDACPort ############
+#        _      _           __  __      _            _____          _____ _____           _
+#       | |    (_)         |  \/  |    | |          |  __ \   /\   / ____|  __ \         | |
+#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| |  | | /  \ | |    | |__) |__  _ __| |_
+#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |  | |/ /\ \| |    |  ___/ _ \| '__| __|
+#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | |__| / ____ \ |____| |  | (_) | |  | |_
+#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_____/_/    \_\_____|_|   \___/|_|   \__|
+#
+#
+# Send a binary number out to the R-2R Digital to Analogue Converter which will
+# drive the meter pointer to the required position. The DAC bits are GPIO0-7,
+# the bottom byte of the SIO output register, so the bits that differ from the
+# current output are flipped with a single write to GPIO_OUT_XOR.  All eight
+# bits change together and the needle never sees an intermediate code.
+# Nothing else drives GPIO0-7 so the read-then-xor can't upset other pins.
+#
+def driveMeterDACPort(dacValue=0):
+    mem32[SIO_GPIO_OUT_XOR] = (mem32[SIO_GPIO_OUT] ^ dacValue) & DAC_BITS_MASK
+
+
+############ driveMeterDACPins ############
+#        _      _           __  __      _            _____          _____ _____ _
+#       | |    (_)         |  \/  |    | |          |  __ \   /\   / ____|  __ (_)
+#     __| |_ __ ___   _____| \  / | ___| |_ ___ _ __| |  | | /  \ | |    | |__) | _ __  ___
+#    / _` | '__| \ \ / / _ \ |\/| |/ _ \ __/ _ \ '__| |  | |/ /\ \| |    |  ___/ | '_ \/ __|
+#   | (_| | |  | |\ V /  __/ |  | |  __/ ||  __/ |  | |__| / ____ \ |____| |   | | | | \__ \
+#    \__,_|_|  |_| \_/ \___|_|  |_|\___|\__\___|_|  |_____/_/    \_\_____|_|   |_|_| |_|___/
+#
+#
+# Fallback for when the SIO registers can't be poked directly.  The value is
+# shifted out to the DAC pins bit by bit, so the needle can briefly see
+# intermediate codes while the bits settle.
+#
+def driveMeterDACPins(dacValue=0):
+    for bit in dacBits:
+        bit.value(dacValue & 0x01)
+        dacValue >>= 1
+
+
+# driveMeterDAC is whichever of the two suits USE_PORT_WRITES.
+if USE_PORT_WRITES:
+    driveMeterDAC = driveMeterDACPort
+else:
+    driveMeterDAC = driveMeterDACPins
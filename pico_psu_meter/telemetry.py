@@ -0,0 +1,157 @@
+# _________________________________________
+#/ Binary telemetry for the meter program. \
+#| Each update is packed into a small      |
+#| fixed size frame in a preallocated ring |
+#| and sent down the USB serial port a few |
+#| frames at a time, so watching the meter |
+#| work doesn't slow it down the way print |
+#\ did.                                    /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# Frame layout, little endian, FRAME_SIZE bytes:
+#   sync     2 bytes  SYNC0 SYNC1
+#   seq      1 byte   frame number, wraps at 256, gaps show dropped frames
+#   flags    1 byte   FLAG_VOLTS_MODE set when showing volts
+#   ticks    4 bytes  utime.ticks_us() at the start of the update
+#   volts    2 bytes  averaged output volts ADC counts, RDG_FRAC_BITS fraction
+#   amps     2 bytes  averaged output current ADC counts, the same
+#   zero     2 bytes  averaged 0V ADC counts, the same
+#   range    1 byte   index of the range shown in VOLTS_RANGES / AMPS_RANGES
+#   dac      1 byte   DAC code driving the needle
+#   perMille 2 bytes  needle position in tenths of a percent of full scale
+#   rate     2 bytes  update rate in Hz, which changes with USE_ADAPTIVE_RATE
+#   check    1 byte   sum of the bytes from seq to rate, modulo 256
+# host/decode_telemetry.py turns a capture into CSV or NumPy arrays.
+#
+# record() only packs the frame into the ring, flush() does the writing and
+# is called from a task of its own.  When the host isn't keeping up the ring
+# fills and frames are dropped rather than holding up the meter.
+
+import struct
+import sys
+try:
+    import select
+except ImportError:
+    import uselect as select
+
+SYNC0 = 0xA5
+SYNC1 = 0x5A
+FLAG_VOLTS_MODE = 0x01
+FRAME_FORMAT = '<BBBBIHHHBBHHB'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+CHECK_START = 2
+CHECK_END = FRAME_SIZE - 1
+
+# frames held waiting to be sent, about a third of a second at 100Hz.
+FRAMES = 32
+
+frameBuf = bytearray(FRAME_SIZE * FRAMES)
+frameView = memoryview(frameBuf)
+frameViews = [frameView[n * FRAME_SIZE:(n + 1) * FRAME_SIZE] for n in range(FRAMES)]
+head = 0
+tail = 0
+pending = 0
+seq = 0
+dropped = 0
+sent = 0
+stream = None
+poller = None
+
+
+############ start ############
+#        _             _
+#       | |           | |
+#    ___| |_ __ _ _ __| |_
+#   / __| __/ _` | '__| __|
+#   \__ \ || (_| | |  | |_
+#   |___/\__\__,_|_|   \__|
+#
+#
+# Start sending frames to stream, the USB serial port by default.  The
+# serial port is polled so that flush only writes when there's room.
+#
+def start(out=None):
+    global stream
+    global poller
+    global head
+    global tail
+    global pending
+
+    head = 0
+    tail = 0
+    pending = 0
+    if out is None:
+        out = sys.stdout.buffer
+        poller = select.poll()
+        poller.register(sys.stdout, select.POLLOUT)
+    else:
+        poller = None
+    stream = out
+
+
+############ record ############
+#                               _
+#                              | |
+#    _ __ ___  ___ ___  _ __ __| |
+#   | '__/ _ \/ __/ _ \| '__/ _` |
+#   | | |  __/ (_| (_) | | | (_| |
+#   |_|  \___|\___\___/|_|  \__,_|
+#
+#
+# Pack one update into the next free frame.  Allocation free, so it can be
+# called at the end of every update.
+#
+def record(ticks, flags, volts, amps, zero, rangeIdx, dac, perMille, rate):
+    global head
+    global pending
+    global seq
+    global dropped
+
+    if pending == FRAMES:
+        dropped += 1
+        return
+    base = head * FRAME_SIZE
+    struct.pack_into(FRAME_FORMAT, frameBuf, base, SYNC0, SYNC1, seq, flags,
+                     ticks & 0xffffffff, volts, amps, zero, rangeIdx, dac, perMille, rate, 0)
+    check = 0
+    for n in range(base + CHECK_START, base + CHECK_END):
+        check += frameBuf[n]
+    frameBuf[base + CHECK_END] = check & 0xff
+    seq = (seq + 1) & 0xff
+    head += 1
+    if head == FRAMES:
+        head = 0
+    pending += 1
+
+
+############ flush ############
+#     __ _           _
+#    / _| |         | |
+#   | |_| |_   _ ___| |__
+#   |  _| | | | / __| '_ \
+#   | | | | |_| \__ \ | | |
+#   |_| |_|\__,_|___/_| |_|
+#
+#
+# Write out the frames waiting in the ring, stopping if the port is full.
+#
+def flush():
+    global tail
+    global pending
+    global sent
+
+    while pending:
+        if poller is not None and not poller.poll(0):
+            return
+        stream.write(frameViews[tail])
+        tail += 1
+        if tail == FRAMES:
+            tail = 0
+        pending -= 1
+        sent += 1
@@ -0,0 +1,192 @@
+
+# _________________________________________
+#/ Tick profiling for the meter program.   \
+#| Times each stage of every meter update  |
+#| and keeps a small histogram per stage   |
+#| so that the cost of an update can be    |
+#| read off from the REPL rather than      |
+#| guessed at with a scope on the onboard  |
+#\ LED.                                    /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# Turn it on by setting PROFILE_TICKS in drivemeter.py, or by calling
+# enableProfiling() from the REPL, then call tickprof.report() to see how
+# long each stage takes.  Everything is kept in preallocated arrays so that
+# recording a time doesn't allocate and can be done from anywhere.
+
+import array
+import utime
+
+# stages of a meter update
+STAGE_CAPTURE = 0   # readCapture / readAdcs
+STAGE_AVERAGE = 1   # averages, zero offset and filters in updateRdgs
+STAGE_RANGE = 2     # calcModeAndRange
+STAGE_METER = 3     # driveMeterToPerMilleFS
+STAGE_LAMPS = 4     # refreshPanel / showRange
+STAGE_TICK = 5      # the whole update, from the tick to the needle moving
+STAGES = 6
+STAGE_NAMES = ('capture', 'average', 'range', 'meter', 'lamps', 'tick')
+
+# Each histogram bucket is BUCKET_US wide.  Anything longer than the last
+# bucket is counted in the last bucket.
+BUCKET_US = 20
+BUCKETS = 100
+
+# MicroPython only keeps numbers below 2**30 without allocating, so once a
+# stage's total time or count gets to HALVE_AT its total, count and
+# histogram are all halved.  The mean and percentiles come out the same,
+# they just lean a little more on the recent updates.
+HALVE_AT = 1 << 29
+counts = array.array('L', [0] * STAGES)
+totals = array.array('L', [0] * STAGES)
+mins = array.array('L', [0] * STAGES)
+maxs = array.array('L', [0] * STAGES)
+hist = array.array('L', [0] * (STAGES * BUCKETS))
+overruns = array.array('L', [0])
+
+
+############ record ############
+#                               _
+#                              | |
+#    _ __ ___  ___ ___  _ __ __| |
+#   | '__/ _ \/ __/ _ \| '__/ _` |
+#   | | |  __/ (_| (_) | | | (_| |
+#   |_|  \___|\___\___/|_|  \__,_|
+#
+#
+# Record how long a stage took, given the ticks_us() it started at.  Returns
+# the time now so the next stage can carry straight on from it.
+#
+def record(stage, start):
+    now = utime.ticks_us()
+    us = utime.ticks_diff(now, start)
+    counts[stage] += 1
+    totals[stage] += us
+    if us < mins[stage]:
+        mins[stage] = us
+    if us > maxs[stage]:
+        maxs[stage] = us
+    bucket = us // BUCKET_US
+    if bucket >= BUCKETS:
+        bucket = BUCKETS - 1
+    hist[stage * BUCKETS + bucket] += 1
+    if totals[stage] >= HALVE_AT or counts[stage] >= HALVE_AT:
+        halve(stage)
+    return now
+
+
+############ halve ############
+#    _           _
+#   | |         | |
+#   | |__   __ _| |_   _____
+#   | '_ \ / _` | \ \ / / _ \
+#   | | | | (_| | |\ V /  __/
+#   |_| |_|\__,_|_| \_/ \___|
+#
+#
+# Halve a stage's total, count and histogram, keeping the count the sum of
+# the histogram so that percentile still adds up.
+#
+def halve(stage):
+    totals[stage] >>= 1
+    count = 0
+    for bucket in range(stage * BUCKETS, (stage + 1) * BUCKETS):
+        hist[bucket] >>= 1
+        count += hist[bucket]
+    counts[stage] = count
+
+
+############ overrun ############
+#
+#
+#     _____   _____ _ __ _ __ _   _ _ __
+#    / _ \ \ / / _ \ '__| '__| | | | '_ \
+#   | (_) \ V /  __/ |  | |  | |_| | | | |
+#    \___/ \_/ \___|_|  |_|   \__,_|_| |_|
+#
+#
+# Count a timer tick that arrived while the previous update was still going.
+#
+def overrun():
+    overruns[0] += 1
+
+
+############ percentile ############
+#                                  _   _ _
+#                                 | | (_) |
+#    _ __   ___ _ __ ___ ___ _ __ | |_ _| | ___
+#   | '_ \ / _ \ '__/ __/ _ \ '_ \| __| | |/ _ \
+#   | |_) |  __/ | | (_|  __/ | | | |_| | |  __/
+#   | .__/ \___|_|  \___\___|_| |_|\__|_|_|\___|
+#   | |
+#   |_|
+# Work out from the histogram the time that pc percent of the updates of a
+# stage were quicker than.  Only as good as the bucket width.
+#
+def percentile(stage, pc):
+    wanted = (counts[stage] * pc + 99) // 100
+    seen = 0
+    for bucket in range(BUCKETS):
+        seen += hist[stage * BUCKETS + bucket]
+        if seen >= wanted:
+            return min((bucket + 1) * BUCKET_US, maxs[stage])
+    return maxs[stage]
+
+
+############ reset ############
+#                       _
+#                      | |
+#    _ __ ___  ___  ___| |_
+#   | '__/ _ \/ __|/ _ \ __|
+#   | | |  __/\__ \  __/ |_
+#   |_|  \___||___/\___|\__|
+#
+#
+# Forget everything recorded so far.
+#
+def reset():
+    for stage in range(STAGES):
+        counts[stage] = 0
+        totals[stage] = 0
+        mins[stage] = 0x3FFFFFFF
+        maxs[stage] = 0
+    for bucket in range(STAGES * BUCKETS):
+        hist[bucket] = 0
+    overruns[0] = 0
+
+
+############ report ############
+#                              _
+#                             | |
+#    _ __ ___ _ __   ___  _ __| |_
+#   | '__/ _ \ '_ \ / _ \| '__| __|
+#   | | |  __/ |_) | (_) | |  | |_
+#   |_|  \___| .__/ \___/|_|   \__|
+#            | |
+#            |_|
+# Print min, mean, 99th percentile and max times in microseconds for each
+# stage, and the update rate that keeps 99% of updates within half of the
+# timer period.
+#
+def report():
+    print("stage      count     min    mean     p99     max")
+    for stage in range(STAGES):
+        if counts[stage] == 0:
+            continue
+        print("%-8s %7d %7d %7d %7d %7d" % (STAGE_NAMES[stage], counts[stage],
+              mins[stage], totals[stage] // counts[stage],
+              percentile(stage, 99), maxs[stage]))
+    print("timer overruns:", overruns[0])
+    # a p99 of 0 is ticks quicker than the clock can see, with no limit to give.
+    p99 = percentile(STAGE_TICK, 99) if counts[STAGE_TICK] else 0
+    if p99:
+        print("safe update rate: %d Hz" % (500000 // p99))
+
+
+reset()
@@ -0,0 +1,393 @@
+# _________________________________________
+#/ Transient recorder for the meter        \
+#| program. Keeps the raw volts and amps   |
+#| samples from the ADC capture in a fixed |
+#| size ring and freezes it around a       |
+#| current limit or a threshold crossing,  |
+#| so short circuits and load transients   |
+#\ can be looked at afterwards.            /
+# -----------------------------------------
+#        \   ^__^
+#         \  (oo)\_______
+#            (__)\       )\/\
+#                ||----w |
+#                ||     ||
+#
+
+# Every block the background capture takes is copied into the ring as
+# (volts, amps) pairs of raw 12 bit counts.  Once armed, the recorder waits
+# for a trigger - the PSU going into current limit, or a sample above one of
+# the thresholds - then carries on for the post trigger part of the record
+# and freezes.  The frozen record holds preTrigger pairs before the trigger
+# and the rest after it, until dump() has been read and arm() called again.
+#
+# Within a block the pairs are one round-robin sweep apart (6us when
+# oversampling), but the ADC is idle between the end of one block and the
+# start of the next tick's, so the record is a string of bursts.  Each
+# block's start time is kept and dump() gives every pair its own time.
+# Each block's 0V average and the current limit input as the block came in
+# are kept too, so a dump has everything host/replay.py needs - to the
+# nearest block for those two.
+#
+# RAM use is fixed: RECORD_PAIRS pairs of 16 bit counts plus the block index.
+
+import array
+import micropython
+import utime
+from micropython import const
+
+RECORD_PAIRS = const(4096)
+RECORD_MASK = const(RECORD_PAIRS - 1)
+BLOCKS = 64
+NO_LIMIT = const(0xffff)
+
+# recorder states
+IDLE = 0
+ARMED = 1
+TRIGGERED = 2
+FROZEN = 3
+
+# copyPairs parameter block, consts so that viper can index with them.
+P_COUNT = const(0)
+P_VOLTS = const(1)
+P_AMPS = const(2)
+P_POS = const(3)
+P_VOLTS_LIMIT = const(4)
+P_AMPS_LIMIT = const(5)
+P_POST = const(6)
+PARAMS = const(7)
+
+samples = array.array('H', [0] * (2 * RECORD_PAIRS))
+blockPos = array.array('L', [0] * BLOCKS)
+blockTicks = array.array('L', [0] * BLOCKS)
+blockLen = array.array('L', [0] * BLOCKS)
+blockZero = array.array('H', [0] * BLOCKS)
+blockIlim = bytearray(BLOCKS)
+params = array.array('l', [0] * PARAMS)
+blockIdx = 0
+blocksUsed = 0
+pos = 0
+filled = 0
+state = IDLE
+preTrigger = RECORD_PAIRS // 4
+postLeft = 0
+triggerPos = 0
+triggerTicks = 0
+triggerWanted = False
+triggerWantedTicks = 0
+voltsLimit = NO_LIMIT
+ampsLimit = NO_LIMIT
+pairUs = 6
+voltsChannel = 0
+ampsChannel = 1
+
+
+############ start ############
+#        _             _
+#       | |           | |
+#    ___| |_ __ _ _ __| |_
+#   / __| __/ _` | '__| __|
+#   \__ \ || (_| | |  | |_
+#   |___/\__\__,_|_|   \__|
+#
+#
+# Tell the recorder where the volts and amps samples are in each round-robin
+# sweep of the capture buffer and how far apart the sweeps are.
+#
+def start(voltsOffset, ampsOffset, sweepUs):
+    global voltsChannel
+    global ampsChannel
+    global pairUs
+    voltsChannel = voltsOffset
+    ampsChannel = ampsOffset
+    pairUs = int(sweepUs)
+
+
+############ arm ############
+#
+#
+#     __ _ _ __ _ __ ___
+#    / _` | '__| '_ ` _ \
+#   | (_| | |  | | | | | |
+#    \__,_|_|  |_| |_| |_|
+#
+#
+# Start waiting for a trigger.  The thresholds are raw ADC counts, None for
+# no threshold; current limit always triggers.  pre is the number of pairs
+# kept from before the trigger, the rest of the ring is after it.
+#
+def arm(volts=None, amps=None, pre=RECORD_PAIRS // 4):
+    global state
+    global voltsLimit
+    global ampsLimit
+    global preTrigger
+    global filled
+    global blockIdx
+    global blocksUsed
+    global triggerWanted
+
+    voltsLimit = NO_LIMIT if volts is None else volts
+    ampsLimit = NO_LIMIT if amps is None else amps
+    preTrigger = min(max(pre, 0), RECORD_PAIRS - 1)
+    filled = 0
+    blockIdx = 0
+    blocksUsed = 0
+    triggerWanted = False
+    state = ARMED
+
+
+############ trigger ############
+#    _        _
+#   | |      (_)
+#   | |_ _ __ _  __ _  __ _  ___ _ __
+#   | __| '__| |/ _` |/ _` |/ _ \ '__|
+#   | |_| |  | | (_| | (_| |  __/ |
+#    \__|_|  |_|\__, |\__, |\___|_|
+#                __/ | __/ |
+#               |___/ |___/
+# Trigger at the pair captured at ticks, or now if not given.  Called when
+# the PSU goes into current limit, with the ticks of the interrupt edge so
+# the record lines up with the edge rather than with the debounce after it,
+# or from the REPL.  The blocks may be coming in on the other core, so this
+# only asks for a trigger and addBlock acts on it with the next one.
+#
+def trigger(ticks=None):
+    global triggerWanted
+    global triggerWantedTicks
+    if state == ARMED and not triggerWanted:
+        triggerWantedTicks = utime.ticks_us() if ticks is None else ticks
+        triggerWanted = True
+
+
+def triggered(at, ticks):
+    global state
+    global triggerPos
+    global triggerTicks
+    global postLeft
+    state = TRIGGERED
+    triggerPos = at
+    triggerTicks = ticks
+    # the pairs already in after the trigger count towards the post part.
+    postLeft = RECORD_PAIRS - preTrigger - ((pos - at) & RECORD_MASK)
+
+
+############ copyPairs ############
+#                          _____      _
+#                         |  __ \    (_)
+#     ___ ___  _ __  _   _| |__) |_ _ _ _ __ ___
+#    / __/ _ \| '_ \| | | |  ___/ _` | | '__/ __|
+#   | (_| (_) | |_) | |_| | |  | (_| | | |  \__ \
+#    \___\___/| .__/ \__, |_|   \__,_|_|_|  |___/
+#             | |     __/ |
+#             |_|    |___/
+# Copy up to params[P_COUNT] (volts, amps) pairs out of a capture block into
+# the ring, watching for a sample over either limit.  Stops params[P_POST]
+# pairs after a trigger.  Returns where in the block the trigger was, or -1,
+# and leaves the number copied in params[P_COUNT] and the new ring position
+# in params[P_POS].  Viper, as the blocks are thousands of samples long.
+#
+@micropython.viper
+def copyPairs(block, ring, par) -> int:
+    src = ptr16(block)
+    dst = ptr16(ring)
+    p = ptr32(par)
+    count = p[P_COUNT]
+    vIdx = p[P_VOLTS]
+    iIdx = p[P_AMPS]
+    at = p[P_POS]
+    vLimit = p[P_VOLTS_LIMIT]
+    iLimit = p[P_AMPS_LIMIT]
+    post = p[P_POST]
+    mask = RECORD_MASK
+    found = -1
+    n = 0
+    while n < count:
+        v = src[vIdx]
+        i = src[iIdx]
+        dst[at << 1] = v
+        dst[(at << 1) + 1] = i
+        at = (at + 1) & mask
+        if found < 0 and (v > vLimit or i > iLimit):
+            found = n
+            if count > n + post:
+                count = n + post
+        vIdx += 3
+        iIdx += 3
+        n += 1
+    p[P_COUNT] = n
+    p[P_POS] = at
+    return found
+
+
+############ addBlock ############
+#              _     _ ____  _            _
+#             | |   | |  _ \| |          | |
+#     __ _  __| | __| | |_) | | ___   ___| | __
+#    / _` |/ _` |/ _` |  _ <| |/ _ \ / __| |/ /
+#   | (_| | (_| | (_| | |_) | | (_) | (__|   <
+#    \__,_|\__,_|\__,_|____/|_|\___/ \___|_|\_\
+#
+#
+# Add a capture block of count round-robin sweeps, started at ticks, to the
+# ring, with the 0V average in counts and ilim, 1 if the PSU is in current
+# limit.  Does nothing unless armed or waiting for the end of a record.
+#
+def addBlock(block, count, ticks, zero, ilim):
+    global pos
+    global filled
+    global blockIdx
+    global blocksUsed
+    global state
+    global postLeft
+    global triggerWanted
+
+    if state != ARMED and state != TRIGGERED:
+        return
+    # read once, trigger() may be setting it on the other core.
+    wanted = triggerWanted and state == ARMED
+    if wanted:
+        # how far into this block the trigger falls, at its last pair if
+        # the trigger came after the block.
+        skip = min(utime.ticks_diff(triggerWantedTicks, ticks) // pairUs, count - 1)
+        if skip < 0 and filled:
+            # before this block, so among the pairs already in.
+            wanted = False
+            triggerWanted = False
+            triggered(pairAt(triggerWantedTicks), triggerWantedTicks)
+    entry = blockIdx
+    blockIdx = (blockIdx + 1) % BLOCKS
+    blocksUsed = min(blocksUsed + 1, BLOCKS)
+
+    params[P_VOLTS] = voltsChannel
+    params[P_AMPS] = ampsChannel
+    params[P_POS] = pos
+    if state == TRIGGERED:
+        params[P_COUNT] = min(count, postLeft)
+        params[P_VOLTS_LIMIT] = NO_LIMIT
+        params[P_AMPS_LIMIT] = NO_LIMIT
+    elif wanted:
+        skip = max(skip, 0)
+        params[P_COUNT] = min(count, skip + RECORD_PAIRS - preTrigger)
+        params[P_VOLTS_LIMIT] = NO_LIMIT
+        params[P_AMPS_LIMIT] = NO_LIMIT
+    else:
+        params[P_COUNT] = count
+        # the thresholds only count once there's a full pre trigger part.
+        if filled >= preTrigger:
+            params[P_VOLTS_LIMIT] = voltsLimit
+            params[P_AMPS_LIMIT] = ampsLimit
+        else:
+            params[P_VOLTS_LIMIT] = NO_LIMIT
+            params[P_AMPS_LIMIT] = NO_LIMIT
+    params[P_POST] = RECORD_PAIRS - preTrigger
+    found = copyPairs(block, samples, params)
+    copied = params[P_COUNT]
+    blockPos[entry] = pos
+    blockTicks[entry] = ticks & 0xffffffff
+    blockLen[entry] = copied
+    blockZero[entry] = zero
+    blockIlim[entry] = ilim
+    pos = params[P_POS]
+    filled = min(filled + copied, RECORD_PAIRS)
+
+    if state == TRIGGERED:
+        postLeft -= copied
+    elif wanted:
+        triggerWanted = False
+        triggered((pos - copied + skip) & RECORD_MASK, triggerWantedTicks)
+    elif found >= 0:
+        triggered((pos - copied + found) & RECORD_MASK,
+                  utime.ticks_add(ticks, found * pairUs))
+    if state == TRIGGERED and postLeft <= 0:
+        state = FROZEN
+
+
+############ pairTime ############
+#                _   _______ _
+#               (_) |__   __(_)
+#    _ __   __ _ _ _ __| |   _ _ __ ___   ___
+#   | '_ \ / _` | | '__| |  | | '_ ` _ \ / _ \
+#   | |_) | (_| | | |  | |  | | | | | | |  __/
+#   | .__/ \__,_|_|_|  |_|  |_|_| |_| |_|\___|
+#   | |
+#   |_|
+# Time, in microseconds relative to the trigger, of the pair at ring
+# position at - from the block it was captured in, entry.
+#
+def pairTime(at, entry):
+    if entry < 0:
+        return 0
+    age = (at - blockPos[entry]) & RECORD_MASK
+    ticks = utime.ticks_add(blockTicks[entry], age * pairUs)
+    return utime.ticks_diff(ticks, triggerTicks)
+
+
+############ pairAt ############
+#                _            _
+#               (_)      /\  | |
+#    _ __   __ _ _ _ __ /  \ | |_
+#   | '_ \ / _` | | '__/ /\ \| __|
+#   | |_) | (_| | | | / ____ \ |_
+#   | .__/ \__,_|_|_|/_/    \_\__|
+#   | |
+#   |_|
+# The ring position of the pair captured at ticks, or the last one before
+# it if that fell between blocks.  The oldest pair in if it's older than
+# them all.
+#
+def pairAt(ticks):
+    entry = blockIdx
+    for n in range(blocksUsed):
+        entry = (entry - 1) % BLOCKS
+        age = utime.ticks_diff(ticks, blockTicks[entry])
+        if age >= 0 and blockLen[entry]:
+            return (blockPos[entry] + min(age // pairUs, blockLen[entry] - 1)) & RECORD_MASK
+    return (pos - filled) & RECORD_MASK
+
+
+############ pairBlock ############
+#                _      ____  _            _
+#               (_)    |  _ \| |          | |
+#    _ __   __ _ _ _ __| |_) | | ___   ___| | __
+#   | '_ \ / _` | | '__|  _ <| |/ _ \ / __| |/ /
+#   | |_) | (_| | | |  | |_) | | (_) | (__|   <
+#   | .__/ \__,_|_|_|  |____/|_|\___/ \___|_|\_\
+#   | |
+#   |_|
+# The entry of the block the pair at ring position at was captured in, or
+# -1.  Newer blocks overwrite older ones, so the newest block holding that
+# position is the one.
+#
+def pairBlock(at):
+    entry = blockIdx
+    for n in range(blocksUsed):
+        entry = (entry - 1) % BLOCKS
+        if ((at - blockPos[entry]) & RECORD_MASK) < blockLen[entry]:
+            return entry
+    return -1
+
+
+############ dump ############
+#        _
+#       | |
+#     __| |_   _ _ __ ___  _ __
+#    / _` | | | | '_ ` _ \| '_ \
+#   | (_| | |_| | | | | | | |_) |
+#    \__,_|\__,_|_| |_| |_| .__/
+#                         | |
+#                         |_|
+# Print the frozen record as CSV, time from the trigger in microseconds, the
+# raw volts and amps counts, then the block's 0V average and current limit
+# input, oldest first.  host/replay.py reads it as it is.
+#
+def dump():
+    if state != FROZEN:
+        print("no record, recorder is", ('idle', 'armed', 'triggered', 'frozen')[state])
+        return
+    print("us,volts,amps,zero,ilim")
+    first = (pos - filled) & RECORD_MASK
+    for n in range(filled):
+        at = (first + n) & RECORD_MASK
+        entry = pairBlock(at)
+        print("%d,%d,%d,%d,%d" % (pairTime(at, entry), samples[at << 1], samples[(at << 1) + 1],
+                                  blockZero[entry], blockIlim[entry]))